@@ -76,12 +76,49 @@ class AppConfig:
     # サーバー設定
     server_url: str = "https://test2.eterpix.uk"
 
+    # 通信設定
+    http2_enabled: bool = True  # HTTP/2で1接続に多重化（h2未導入時はHTTP/1.1）
+    http_max_connections: int = 10
+    http_max_keepalive_connections: int = 5
+    http_keepalive_expiry: float = 60.0  # 秒
+    http_connect_timeout: float = 10.0  # 秒
+    http_read_timeout: float = 60.0  # 秒
+    http_write_timeout: float = 60.0  # 秒
+    http_pool_timeout: float = 10.0  # 秒
+    retry_max_attempts: int = 4  # 一時的なエラー時の試行回数（初回含む）
+    retry_base_delay: float = 0.5  # 再試行待機の初期値（秒、指数的に増加）
+    retry_max_delay: float = 30.0  # 再試行待機の上限（秒）
+    breaker_failure_threshold: int = 1  # 再試行を使い切った失敗が何回続いたらオフラインにするか
+    health_probe_min_sec: float = 5.0  # オフライン中の復旧確認間隔（初回）
+    health_probe_max_sec: float = 300.0  # オフライン中の復旧確認間隔（上限）
+
     # 監視設定
     watch_folder: str = ""  # 空の場合はデフォルトパス
     auto_upload: bool = True
+    log_poll_interval_sec: float = 1.0  # VRChatログの更新通知が届かない場合の確認間隔（秒）
 
     # 画像設定
     jpeg_quality: int = 85
+    defer_offline_conversion: bool = True  # オフライン中は元のPNGを参照としてキューに入れ、送信時に変換
+
+    # アップロード設定
+    upload_concurrency: int = 4  # 同時アップロード数（撮影分・再送分共通）
+    batch_max_bytes: int = 16 * 1024 * 1024  # 再送時に1リクエストにまとめる写真の合計サイズ上限
+    batch_max_items: int = 20  # 再送時に1リクエストにまとめる写真の枚数上限
+    metrics_window_minutes: int = 60  # 通信メトリクスを保持する期間（分）
+    upload_limit_in_world_kbps: int = 1024  # VRChatでワールド滞在中の送信速度上限（KB/秒、0=無制限）
+    upload_limit_idle_kbps: int = 0  # VRChat終了後・ワールド外の送信速度上限（KB/秒、0=無制限）
+    two_phase_upload: bool = False  # 先に縮小プレビューを送り、フル解像度は後から添付（サーバーの対応が必要）
+    preview_max_px: int = 1280  # プレビューの長辺（ピクセル）
+    preview_quality: int = 60  # プレビューのJPEG品質
+
+    # オフラインキュー設定
+    queue_max_mb: int = 4096  # 送信待ちのディスク使用量の上限（MB、0=無制限）
+    queue_max_items: int = 0  # 送信待ちの写真の枚数の上限（0=無制限）
+    queue_eviction_policy: str = "reencode"  # 上限時: reencode（古い順に再圧縮）/ oldest（古い順に削除）/ refuse（新しい写真を保存しない）
+    queue_reencode_quality: int = 60  # reencode時のJPEG品質
+    queue_join_min_stay_sec: int = 30  # 送信待ちのワールド参加のうち、滞在がこの秒数未満で写真のないものは報告しない（0=全て報告）
+    queue_park_after_attempts: int = 10  # サーバーに拒否された（4xx・形式エラー）回数がこの回数に達した項目は保留にして自動では再送しない（再送ボタンで再試行、0=無制限）
 
     # デフォルト公開範囲
     default_visibility: str = "self"
@@ -0,0 +1,74 @@
+"""
+Bandwidth Limiter
+アップロード帯域のトークンバケット制限
+VRChat起動中はアバター読み込み等の通信を妨げないよう送信速度を抑える
+"""
+
+import time
+import asyncio
+
+
+# 待機中も速度変更をすぐ反映するため、この間隔ごとに残量を再計算する
+MAX_WAIT_SLICE_SEC = 0.25
+
+
+class TokenBucket:
+    """
+    送信バイト数のトークンバケット（イベントループ上で共有）
+
+    同時に送信中の全リクエストで1つのバケットを使うため、合計速度が上限になる。
+    残量を超える量は先に消費して不足分を待つ（1チャンクが上限より大きくても止まらない）。
+    """
+
+    def __init__(self, bytes_per_sec: float = 0, burst_sec: float = 1.0):
+        """
+        初期化
+
+        Args:
+            bytes_per_sec: 上限（バイト/秒、0以下は無制限）
+            burst_sec: 休止後にまとめて送れる量（上限の秒数分）
+        """
+        self.burst_sec = burst_sec
+        self.rate = 0.0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(bytes_per_sec)
+        self._tokens = self.capacity
+
+    @property
+    def is_limited(self) -> bool:
+        return self.rate > 0
+
+    @property
+    def capacity(self) -> float:
+        return self.rate * self.burst_sec
+
+    def set_rate(self, bytes_per_sec: float):
+        """上限を変更（送信中のリクエストにも次のチャンクから反映）"""
+        self._refill()
+        self.rate = max(0.0, float(bytes_per_sec or 0))
+        self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, size: int):
+        """
+        sizeバイト分の送信枠を確保（不足分が貯まるまで待機）
+
+        Args:
+            size: 送信するバイト数
+        """
+        if self.rate <= 0:
+            return
+        self._refill()
+        self._tokens -= size
+        while self.rate > 0 and self._tokens < 0:
+            await asyncio.sleep(min(MAX_WAIT_SLICE_SEC, -self._tokens / self.rate))
+            self._refill()
+        if self.rate <= 0:
+            # 待機中に無制限になった
+            self._tokens = 0.0
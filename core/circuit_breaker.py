@@ -0,0 +1,130 @@
+"""
+Circuit Breaker
+サーバー障害時の送信遮断と復旧確認（適応的プローブ）
+"""
+
+import asyncio
+import random
+from enum import Enum
+from typing import Awaitable, Callable, List, Optional
+
+
+class BreakerState(Enum):
+    """サーキットブレーカーの状態"""
+    CLOSED = 'closed'        # 通常（送信可）
+    OPEN = 'open'            # 遮断中（送信せずプローブのみ）
+    HALF_OPEN = 'half_open'  # プローブ成功、実リクエストで復旧確認中
+
+
+class CircuitOpenError(Exception):
+    """遮断中のため送信しなかった"""
+
+
+class CircuitBreaker:
+    """
+    サーキットブレーカー
+
+    実リクエストの失敗が続くと遮断し、遮断中は指数バックオフ＋ジッターの間隔で
+    プローブ（ヘルスチェック）を行う。プローブが成功すると半開状態になり、
+    実リクエストが成功した時点で閉じる。
+    イベントループのスレッドからのみ使用すること。
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], Awaitable[bool]],
+        failure_threshold: int = 1,
+        probe_base_delay: float = 5.0,
+        probe_max_delay: float = 300.0
+    ):
+        """
+        初期化
+
+        Args:
+            probe: 復旧確認用の関数（到達できればTrue）
+            failure_threshold: 遮断するまでの連続失敗回数（再試行を使い切った失敗を数える）
+            probe_base_delay: 最初のプローブまでの秒数
+            probe_max_delay: プローブ間隔の上限（秒）
+        """
+        self.probe = probe
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_base_delay = probe_base_delay
+        self.probe_max_delay = probe_max_delay
+
+        self.state = BreakerState.CLOSED
+        self._failures = 0
+        self._probe_attempt = 0
+        self._probe_task: Optional[asyncio.Task] = None
+        self._callbacks: List[Callable[[BreakerState, BreakerState], None]] = []
+
+    def on_state_changed(self, callback: Callable[[BreakerState, BreakerState], None]):
+        """状態変更コールバックを登録（old, new）"""
+        self._callbacks.append(callback)
+
+    @property
+    def allows_requests(self) -> bool:
+        """実リクエストを送ってよいか"""
+        return self.state != BreakerState.OPEN
+
+    def _transition(self, new_state: BreakerState):
+        if new_state == self.state:
+            return
+        old_state = self.state
+        self.state = new_state
+        print(f"Circuit breaker: {old_state.value} -> {new_state.value}")
+        for callback in self._callbacks:
+            try:
+                callback(old_state, new_state)
+            except Exception as e:
+                print(f"Circuit breaker callback error: {e}")
+
+    def record_success(self):
+        """実リクエスト成功（サーバーに到達できた）"""
+        self._failures = 0
+        self._probe_attempt = 0
+        self._cancel_probe()
+        self._transition(BreakerState.CLOSED)
+
+    def record_failure(self):
+        """実リクエスト失敗（再試行を使い切った接続エラー・5xx）"""
+        self._failures += 1
+        if self.state == BreakerState.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self._transition(BreakerState.OPEN)
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    def next_probe_delay(self) -> float:
+        """次のプローブまでの秒数（指数バックオフ、0.5〜1.0倍のジッター）"""
+        delay = min(self.probe_max_delay, self.probe_base_delay * (2 ** self._probe_attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _probe_loop(self):
+        """遮断中のプローブ"""
+        while self.state == BreakerState.OPEN:
+            await asyncio.sleep(self.next_probe_delay())
+            if self.state != BreakerState.OPEN:
+                return
+
+            try:
+                alive = await self.probe()
+            except Exception:
+                alive = False
+
+            if alive:
+                self._transition(BreakerState.HALF_OPEN)
+                return
+            self._probe_attempt += 1
+
+    def _cancel_probe(self):
+        if self._probe_task and not self._probe_task.done():
+            # プローブ自身から呼ばれた場合はキャンセルしない
+            if self._probe_task is not asyncio.current_task():
+                self._probe_task.cancel()
+        self._probe_task = None
+
+    def shutdown(self):
+        """プローブを停止"""
+        self._cancel_probe()
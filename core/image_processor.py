@@ -5,7 +5,7 @@ PNG→JPG変換とVRChatカメラグリッドのデコード
 
 import io
 from pathlib import Path
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 from PIL import Image
 
 
@@ -86,19 +86,48 @@ class ImageProcessor:
 
         return {}
 
-    def create_thumbnail(self, jpg_bytes: bytes, max_size: Tuple[int, int] = (400, 400)) -> bytes:
+    def reencode_jpg(self, jpg_bytes: bytes, quality: int, max_size: Optional[Tuple[int, int]] = None) -> bytes:
+        """
+        JPGを低画質で再圧縮（オフラインキューの容量確保用）
+
+        Args:
+            jpg_bytes: JPG画像のバイトデータ
+            quality: JPEG品質
+            max_size: 指定した場合はこのサイズ（幅, 高さ）に収まるよう縮小
+
+        Returns:
+            bytes: 再圧縮したバイトデータ（小さくならなければ元のデータ）
+        """
+        with Image.open(io.BytesIO(jpg_bytes)) as img:
+            if max_size:
+                img.draft('RGB', max_size)
+                img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=quality, optimize=True)
+            result = buffer.getvalue()
+        return result if len(result) < len(jpg_bytes) else jpg_bytes
+
+    def create_thumbnail(
+        self,
+        jpg_bytes: bytes,
+        max_size: Tuple[int, int] = (400, 400),
+        quality: int = 75
+    ) -> bytes:
         """
         サムネイルを生成
 
         Args:
             jpg_bytes: JPG画像のバイトデータ
             max_size: 最大サイズ（幅, 高さ）
+            quality: JPEG品質
 
         Returns:
             bytes: サムネイルのバイトデータ
         """
         with Image.open(io.BytesIO(jpg_bytes)) as img:
+            # 縮小後のサイズで読み込み（JPEGはデコード時に縮小できるため大きい画像ほど速い）
+            img.draft('RGB', max_size)
             img.thumbnail(max_size, Image.Resampling.LANCZOS)
             buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=75)
+            img.save(buffer, format='JPEG', quality=quality)
             return buffer.getvalue()
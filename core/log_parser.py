@@ -5,8 +5,41 @@ VRChatログファイルからユーザー・ワールド情報を抽出
 
 import re
 import os
+import time
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Optional, Tuple, List, Callable
+from datetime import datetime
+from typing import Optional, Tuple, List, Dict, Set, Callable, Iterable
+
+
+class LogTailState:
+    """ログファイルごとの追跡状態"""
+
+    __slots__ = ('path', 'position', 'partial_line', 'current_user', 'current_world')
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.position = 0
+        self.partial_line = bytearray()  # 書き込み途中の行
+        self.current_user: Optional[Tuple[str, str]] = None  # (display_name, user_id)
+        self.current_world: Optional[Tuple[str, str]] = None  # (world_id, instance_id)
+
+
+class LogEvent:
+    """解析済みログイベント"""
+
+    __slots__ = ('seq', 'kind', 'timestamp', 'args', 'source')
+
+    def __init__(self, seq: int, kind: str, timestamp: datetime, args: tuple, source: Path):
+        self.seq = seq              # 通し番号（単調増加）
+        self.kind = kind            # イベント種別（コールバック名と同じ）
+        self.timestamp = timestamp  # ログ上の時刻（ローカル時刻）
+        self.args = args            # コールバック引数
+        self.source = source        # 発生元ログ
+
+    def __repr__(self) -> str:
+        return f"LogEvent({self.seq}, {self.kind!r}, {self.timestamp}, {self.args!r}, {self.source.name})"
 
 
 class VRChatLogParser:
@@ -16,20 +49,66 @@ class VRChatLogParser:
         'user_auth': r'User Authenticated: (.*?) \((usr_[a-zA-Z0-9\-]+)\)',
         'world_join': r'Joining (wrld_[a-zA-Z0-9\-]+):(\d+)',
         'world_leave': r'Leaving wrld_',
+        'screenshot': r'\[VRC Camera\] Took screenshot to: (.+?)\s*$',
+        'app_quit': r'VRCApplication: OnApplicationQuit',
         'timestamp': r'^(\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}:\d{2})'
     }
 
-    def __init__(self):
+    # 解析対象になり得る行のキーワード（デコード前の高速フィルタ）
+    LINE_PREFILTER = (b'User Authenticated', b'Joining wrld_', b'Leaving wrld_', b'Took screenshot to: ',
+                      b'OnApplicationQuit')
+
+    # 1回の読み込みサイズ・1回の解析で読む上限
+    READ_CHUNK_SIZE = 256 * 1024
+    MAX_READ_PER_CALL = 4 * 1024 * 1024
+
+    # 起動時に末尾から逆方向に走査するブロックサイズ
+    STARTUP_SCAN_BLOCK_SIZE = 64 * 1024
+    # ユーザー認証はセッション冒頭に出るため、見つからない場合に確認する先頭範囲
+    STARTUP_HEAD_SCAN_SIZE = 4 * 1024 * 1024
+
+    # この時間内に更新されたログを同時起動中のクライアントとして追跡する
+    ACTIVE_LOG_WINDOW_SEC = 30 * 60
+    # ワールド滞在中とみなすのは、この時間内に書き込みがあったログのみ（異常終了したクライアントを除く）
+    IN_WORLD_WRITE_WINDOW_SEC = 5 * 60
+
+    # 保持するイベント数（古いものから破棄）
+    EVENT_BUFFER_SIZE = 1024
+
+    def __init__(self, startup_seek: bool = True):
         self.log_path = self._get_log_path()
+        # 直近にイベントがあったログの状態
         self.current_user: Optional[Tuple[str, str]] = None  # (display_name, user_id)
         self.current_world: Optional[Tuple[str, str]] = None  # (world_id, instance_id)
-        self._last_position = 0
         self._current_log_file: Optional[Path] = None
 
+        # 追跡中のログごとの状態
+        self._tails: Dict[Path, LogTailState] = {}
+        # 一度でも追跡したログ（再度アクティブになった場合は末尾から復元）
+        self._known_logs: Set[str] = set()
+        self._initialized = False
+        # 末尾から復元したログ（全ログの復元後にまとめて1回だけ通知する）: (最後の行の時刻, 追跡状態)
+        self._pending_restores: List[Tuple[datetime, LogTailState]] = []
+
+        # 起動時は末尾から現在の状態を復元し、過去のイベントは再生しない
+        self._startup_seek = startup_seek
+
+        # バイナリ読み込み用バッファ（全ログで再利用）
+        self._read_buffer = bytearray(self.READ_CHUNK_SIZE)
+
+        # イベント履歴（リングバッファ）と購読者
+        self._events: deque = deque(maxlen=self.EVENT_BUFFER_SIZE)
+        self._event_seq = 0
+        self._event_lock = threading.RLock()
+        self._subscribers: List[Callable[[LogEvent], None]] = []
+
         self._callbacks = {
             'user_changed': [],
             'world_joined': [],
-            'world_left': []
+            'world_left': [],
+            'state_restored': [],
+            'screenshot_taken': [],
+            'app_quit': []
         }
 
     def _get_log_path(self) -> Path:
@@ -50,56 +129,301 @@ class VRChatLogParser:
 
         return max(log_files, key=lambda f: f.stat().st_mtime)
 
-    def parse_new_lines(self):
-        """新しい行を解析"""
-        log_file = self.get_latest_log()
-        if not log_file:
+    def get_active_logs(self) -> List[Path]:
+        """
+        追跡対象のログファイルを取得
+
+        直近ACTIVE_LOG_WINDOW_SEC以内に更新されたログ（複数クライアント同時起動時は複数）。
+        該当が無い場合も最新のログは対象に含める。
+
+        Returns:
+            List[Path]: 更新日時の古い順
+        """
+        if not self.log_path.exists():
+            return []
+
+        stats = []
+        for log_file in self.log_path.glob('output_log_*.txt'):
+            try:
+                stats.append((log_file.stat().st_mtime, log_file))
+            except OSError:
+                continue
+        if not stats:
+            return []
+
+        stats.sort()
+        threshold = time.time() - self.ACTIVE_LOG_WINDOW_SEC
+        active = [log_file for mtime, log_file in stats if mtime >= threshold]
+        return active or [stats[-1][1]]
+
+    def parse_new_lines(self) -> bool:
+        """
+        追跡中の全ログの新しい行を解析
+
+        Returns:
+            bool: 読み込み上限により未読データが残っていればTrue
+        """
+        active_logs = self.get_active_logs()
+
+        # 更新が止まったログの追跡状態を破棄
+        for log_file in list(self._tails):
+            if log_file not in active_logs:
+                del self._tails[log_file]
+
+        # 新しいログの追跡を開始し、復元した状態は新しい行より先に通知
+        for log_file in active_logs:
+            if log_file not in self._tails:
+                self._start_tail(log_file)
+        self._emit_restored_state()
+
+        has_backlog = False
+        for log_file in active_logs:
+            tail = self._tails[log_file]
+            try:
+                for line in self._read_complete_lines(tail):
+                    self._parse_line(tail, line)
+
+                if tail.position < log_file.stat().st_size:
+                    has_backlog = True
+
+            except Exception as e:
+                print(f"ログ解析エラー: {log_file.name}, {e}")
+
+        self._initialized = True
+        return has_backlog
+
+    def _start_tail(self, log_file: Path) -> LogTailState:
+        """ログの追跡を開始"""
+        tail = LogTailState(log_file)
+        self._tails[log_file] = tail
+
+        # 起動時に見つけたログ・再度アクティブになったログは末尾から状態を復元
+        # 起動後に新しく作られたログは先頭から読む
+        restore = (not self._initialized and self._startup_seek) or log_file.name in self._known_logs
+        self._known_logs.add(log_file.name)
+
+        if restore:
+            try:
+                self._pending_restores.append((self._restore_from_tail(tail), tail))
+            except Exception as e:
+                print(f"ログ状態復元エラー: {e}")
+        return tail
+
+    def _read_complete_lines(self, tail: LogTailState) -> List[str]:
+        """
+        前回位置からバイナリで読み込み、完結した行のうち解析対象のみを返す
+
+        末尾の改行なしの行は次回の読み込みまで保持する。
+        1回の読み込み量はMAX_READ_PER_CALLまでで、残りは次回に持ち越す。
+
+        Args:
+            tail: ログの追跡状態
+
+        Returns:
+            List[str]: プレフィルタを通過した行（デコード済み）
+        """
+        lines = []
+        view = memoryview(self._read_buffer)
+
+        with open(tail.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < tail.position:
+                # ログが切り詰められた場合は先頭から読み直す
+                tail.position = 0
+                tail.partial_line.clear()
+
+            f.seek(tail.position)
+            remaining = min(size - tail.position, self.MAX_READ_PER_CALL)
+
+            while remaining > 0:
+                n = f.readinto(view[:min(remaining, self.READ_CHUNK_SIZE)])
+                if not n:
+                    break
+                tail.position += n
+                remaining -= n
+
+                data = view[:n]
+                last_newline = self._read_buffer.rfind(b'\n', 0, n)
+                if last_newline < 0:
+                    # 改行が無い場合は全て持ち越し
+                    tail.partial_line += data
+                    continue
+
+                # 前回の持ち越し分と連結して完結行のみを分割
+                tail.partial_line += data[:last_newline + 1]
+                chunk = bytes(tail.partial_line)
+                tail.partial_line.clear()
+                tail.partial_line += data[last_newline + 1:]
+
+                for raw in chunk.splitlines():
+                    if any(key in raw for key in self.LINE_PREFILTER):
+                        lines.append(raw.decode('utf-8', errors='ignore'))
+
+        return lines
+
+    def _restore_from_tail(self, tail: LogTailState) -> datetime:
+        """
+        ログ末尾からブロック単位で逆方向に走査し、現在の状態を復元
+
+        最新のJoining/Leaving行とUser Authenticated行から状態を再構築し、
+        以降は末尾から追跡する。過去のイベントは発火しない
+        （state_restoredは全ログの復元後に_emit_restored_stateで1回だけ通知する）。
+
+        Args:
+            tail: ログの追跡状態
+
+        Returns:
+            datetime: 復元に使った最後の行の時刻（該当行が無ければログの更新時刻）
+        """
+        world_line: Optional[bytes] = None
+        user_line: Optional[bytes] = None
+
+        with open(tail.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            pos = size
+            carry = b''
+            tail_start = size
+
+            # ワールドが見つかった時点で逆走査を終了（ユーザーは同じ範囲か先頭付近で探す）
+            while pos > 0 and world_line is None:
+                read_size = min(self.STARTUP_SCAN_BLOCK_SIZE, pos)
+                pos -= read_size
+                f.seek(pos)
+                lines = (f.read(read_size) + carry).split(b'\n')
+
+                if pos + read_size == size:
+                    # 末尾の書き込み途中の行は追跡対象として残す
+                    tail_start = size - len(lines[-1])
+                    lines[-1] = b''
+
+                # 先頭はブロック境界で途切れている可能性があるため持ち越す
+                carry = lines[0] if pos > 0 else b''
+                for raw in reversed(lines[1:] if pos > 0 else lines):
+                    if world_line is None and (b'Joining wrld_' in raw or b'Leaving wrld_' in raw
+                                               or b'OnApplicationQuit' in raw):
+                        # 終了済みのログはワールド外として復元
+                        world_line = raw
+                    if user_line is None and b'User Authenticated' in raw:
+                        user_line = raw
+                    if world_line is not None and user_line is not None:
+                        break
+
+            if user_line is None and pos > 0:
+                f.seek(0)
+                head_size = min(self.STARTUP_HEAD_SCAN_SIZE, pos)
+                head_lines = f.read(head_size).split(b'\n')
+                if head_size == pos:
+                    head_lines[-1] += carry
+                else:
+                    head_lines.pop()
+                for raw in head_lines:
+                    if b'User Authenticated' in raw:
+                        user_line = raw
+
+        if user_line is not None:
+            user_match = re.search(self.PATTERNS['user_auth'], user_line.decode('utf-8', errors='ignore'))
+            if user_match:
+                tail.current_user = (user_match.group(1), user_match.group(2))
+
+        if world_line is not None:
+            world_match = re.search(self.PATTERNS['world_join'], world_line.decode('utf-8', errors='ignore'))
+            tail.current_world = (world_match.group(1), world_match.group(2)) if world_match else None
+
+        tail.position = tail_start
+
+        # 他のイベントと同じくログの時刻を使う
+        timestamps = [self._parse_timestamp(raw.decode('utf-8', errors='ignore'))
+                      for raw in (world_line, user_line) if raw is not None]
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+        if timestamps:
+            return max(timestamps)
+        return datetime.fromtimestamp(tail.path.stat().st_mtime)
+
+    def _emit_restored_state(self):
+        """復元したログのうち最後に書き込まれたログの状態を全体の状態として1回だけ通知"""
+        if not self._pending_restores:
             return
+        restored_at, tail = max(self._pending_restores, key=lambda restore: restore[0])
+        self._pending_restores = []
 
-        # ログファイルが変わった場合はリセット
-        if log_file != self._current_log_file:
-            self._current_log_file = log_file
-            self._last_position = 0
+        self._set_current(tail)
+        state = {'user': tail.current_user, 'world': tail.current_world}
+        self._emit('state_restored', tail, restored_at, state)
 
-        try:
-            with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
-                f.seek(self._last_position)
-                new_lines = f.readlines()
-                self._last_position = f.tell()
+    def _set_current(self, tail: LogTailState):
+        """直近にイベントがあったログの状態を全体の状態とする"""
+        self._current_log_file = tail.path
+        self.current_user = tail.current_user
+        self.current_world = tail.current_world
 
-            for line in new_lines:
-                self._parse_line(line)
+    def _emit(self, event: str, tail: LogTailState, timestamp: Optional[datetime], *args):
+        """イベントを履歴に記録し、購読者とコールバックを呼び出し（source=発生元ログ）"""
+        with self._event_lock:
+            self._event_seq += 1
+            record = LogEvent(self._event_seq, event, timestamp or datetime.now(), args, tail.path)
+            self._events.append(record)
+            for subscriber in self._subscribers:
+                try:
+                    subscriber(record)
+                except Exception as e:
+                    print(f"ログイベント購読者エラー: {e}")
 
-        except Exception as e:
-            print(f"ログ解析エラー: {e}")
+        for callback in self._callbacks[event]:
+            callback(*args, source=tail.path)
 
-    def _parse_line(self, line: str):
+    def _parse_line(self, tail: LogTailState, line: str):
         """1行を解析"""
+        timestamp = self._parse_timestamp(line)
+
         # ユーザー認証
         user_match = re.search(self.PATTERNS['user_auth'], line)
         if user_match:
             new_user = (user_match.group(1), user_match.group(2))
-            if new_user != self.current_user:
-                self.current_user = new_user
-                for callback in self._callbacks['user_changed']:
-                    callback(self.current_user)
+            if new_user != tail.current_user:
+                tail.current_user = new_user
+                self._set_current(tail)
+                self._emit('user_changed', tail, timestamp, new_user)
 
         # ワールド参加
         world_match = re.search(self.PATTERNS['world_join'], line)
         if world_match:
             world_id = world_match.group(1)
             instance_id = world_match.group(2)
-            self.current_world = (world_id, instance_id)
-            for callback in self._callbacks['world_joined']:
-                callback(world_id, instance_id)
+            tail.current_world = (world_id, instance_id)
+            self._set_current(tail)
+            self._emit('world_joined', tail, timestamp, world_id, instance_id)
 
         # ワールド退出
         leave_match = re.search(self.PATTERNS['world_leave'], line)
         if leave_match:
-            old_world = self.current_world
-            self.current_world = None
-            for callback in self._callbacks['world_left']:
-                callback(old_world)
+            old_world = tail.current_world
+            tail.current_world = None
+            self._set_current(tail)
+            self._emit('world_left', tail, timestamp, old_world)
+
+        # スクリーンショット撮影
+        screenshot_match = re.search(self.PATTERNS['screenshot'], line)
+        if screenshot_match:
+            screenshot_path = Path(screenshot_match.group(1))
+            self._emit('screenshot_taken', tail, timestamp, screenshot_path, timestamp)
+
+        # VRChat終了
+        if re.search(self.PATTERNS['app_quit'], line):
+            tail.current_world = None
+            self._set_current(tail)
+            self._emit('app_quit', tail, timestamp)
+
+    def _parse_timestamp(self, line: str) -> Optional[datetime]:
+        """行頭のタイムスタンプを取得（ローカル時刻）"""
+        ts_match = re.match(self.PATTERNS['timestamp'], line)
+        if not ts_match:
+            return None
+        try:
+            return datetime.strptime(ts_match.group(1), '%Y.%m.%d %H:%M:%S')
+        except ValueError:
+            return None
+
+    # コールバックは発生元ログのパスをキーワード引数 source で受け取る
 
     def on_user_changed(self, callback: Callable):
         """ユーザー変更コールバックを登録"""
@@ -113,10 +437,129 @@ class VRChatLogParser:
         """ワールド退出コールバックを登録"""
         self._callbacks['world_left'].append(callback)
 
+    def on_screenshot_taken(self, callback: Callable):
+        """スクリーンショット撮影コールバックを登録（path, timestamp）"""
+        self._callbacks['screenshot_taken'].append(callback)
+
+    def on_state_restored(self, callback: Callable):
+        """起動時の状態復元コールバックを登録"""
+        self._callbacks['state_restored'].append(callback)
+
+    def on_app_quit(self, callback: Callable):
+        """VRChat終了コールバックを登録"""
+        self._callbacks['app_quit'].append(callback)
+
+    # ========== イベント履歴 ==========
+
+    def events_since(self, since: Optional[datetime] = None,
+                     kinds: Optional[Iterable[str]] = None) -> List[LogEvent]:
+        """
+        保持中のイベントを取得
+
+        Args:
+            since: この時刻以降のイベントのみ（Noneなら全件）
+            kinds: 取得するイベント種別（Noneなら全種別）
+
+        Returns:
+            List[LogEvent]: 発生順のイベント
+        """
+        kinds = set(kinds) if kinds is not None else None
+        with self._event_lock:
+            events = list(self._events)
+        return [
+            e for e in events
+            if (since is None or e.timestamp >= since) and (kinds is None or e.kind in kinds)
+        ]
+
+    def events_after(self, seq: int) -> List[LogEvent]:
+        """
+        指定した通し番号より後のイベントを取得（まとめて処理する利用者向け）
+
+        Args:
+            seq: 最後に処理したイベントの通し番号（0なら全件）
+
+        Returns:
+            List[LogEvent]: 発生順のイベント
+        """
+        with self._event_lock:
+            if not self._events or self._events[-1].seq <= seq:
+                return []
+            # 通し番号は連続しているため位置を直接計算できる
+            start = max(0, seq - self._events[0].seq + 1)
+            return list(self._events)[start:]
+
+    def replay(self, callback: Callable[[LogEvent], None], since: Optional[datetime] = None) -> int:
+        """
+        保持中のイベントを再生（ファイルは再読み込みしない）
+
+        Args:
+            callback: LogEventを受け取る関数
+            since: この時刻以降のイベントのみ
+
+        Returns:
+            int: 再生したイベント数
+        """
+        events = self.events_since(since)
+        for event in events:
+            callback(event)
+        return len(events)
+
+    def subscribe(self, callback: Callable[[LogEvent], None], since: Optional[datetime] = None) -> int:
+        """
+        イベントを購読（後から購読しても保持中のイベントを先に受け取れる）
+
+        再生と登録は同じロック内で行うため、取りこぼしや重複は発生しない。
+        購読者はログ解析スレッドから呼ばれる。
+
+        Args:
+            callback: LogEventを受け取る関数
+            since: 再生するイベントの開始時刻（Noneなら保持中の全件）
+
+        Returns:
+            int: 再生したイベント数
+        """
+        with self._event_lock:
+            count = self.replay(callback, since)
+            self._subscribers.append(callback)
+        return count
+
+    def unsubscribe(self, callback: Callable[[LogEvent], None]):
+        """イベントの購読を解除"""
+        with self._event_lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def get_world(self, source: Path) -> Optional[Tuple[str, str]]:
+        """指定ログの現在のワールドを取得"""
+        tail = self._tails.get(source)
+        return tail.current_world if tail else None
+
+    def is_in_world(self, exclude: Optional[Path] = None) -> bool:
+        """
+        追跡中のいずれかのクライアントがワールドに滞在中か
+
+        異常終了したクライアントのログは終了行が無いまま残るため、
+        直近IN_WORLD_WRITE_WINDOW_SEC以内に書き込みがあったログのみを対象にする。
+
+        Args:
+            exclude: 対象から除くログ（退出したクライアント自身など）
+        """
+        threshold = time.time() - self.IN_WORLD_WRITE_WINDOW_SEC
+        for tail in list(self._tails.values()):
+            if not tail.current_world or tail.path == exclude:
+                continue
+            try:
+                if tail.path.stat().st_mtime >= threshold:
+                    return True
+            except OSError:
+                continue
+        return False
+
     def get_status(self) -> dict:
         """現在の状態を取得"""
         return {
             'user': self.current_user,
             'world': self.current_world,
-            'log_path': str(self._current_log_file) if self._current_log_file else None
+            'log_path': str(self._current_log_file) if self._current_log_file else None,
+            'active_logs': [str(path) for path in self._tails]
         }
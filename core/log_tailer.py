@@ -0,0 +1,141 @@
+"""
+Log Tailer
+VRChatログの更新をバックグラウンドスレッドで監視・解析
+"""
+
+import threading
+from pathlib import Path
+from typing import Optional
+from datetime import datetime
+
+from core.log_parser import VRChatLogParser
+
+
+def _log(msg: str):
+    """ログ出力"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[{timestamp}] [LogTailer] {msg}", flush=True)
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+    FileSystemEventHandler = object
+
+
+class VRChatLogChangeHandler(FileSystemEventHandler):
+    """ログファイル更新検出ハンドラー"""
+
+    def __init__(self, wake_event: threading.Event):
+        self.wake_event = wake_event
+
+    def _is_log_file(self, event) -> bool:
+        if event.is_directory:
+            return False
+        name = Path(event.src_path).name
+        return name.startswith('output_log_') and name.endswith('.txt')
+
+    def on_modified(self, event):
+        if self._is_log_file(event):
+            self.wake_event.set()
+
+    def on_created(self, event):
+        if self._is_log_file(event):
+            self.wake_event.set()
+
+
+class LogTailer:
+    """
+    ログ追跡クラス
+
+    ファイル更新イベントで起床してVRChatLogParserを実行する。
+    更新イベントが届かない・遅れる環境（Windowsで追記の通知がまとめられる場合等）向けに
+    ポーリングも併用する（間隔は旧タイマーと同じ1秒以下を推奨）。
+    パーサーのコールバックはこのスレッドから呼ばれるため、
+    GUI/イベントループ側への受け渡しは呼び出し側で行うこと。
+    """
+
+    def __init__(self, parser: VRChatLogParser, poll_interval: float = 1.0):
+        self.parser = parser
+        self.poll_interval = poll_interval
+
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.observer = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """追跡開始"""
+        if self.is_running:
+            return
+
+        self._stop_event.clear()
+        self._start_observer()
+
+        self._thread = threading.Thread(
+            target=self._run,
+            daemon=True,
+            name="LogTailer"
+        )
+        self._thread.start()
+        _log(f"追跡開始: {self.parser.log_path} (watchdog={self.observer is not None})")
+
+    def _start_observer(self):
+        """ログフォルダの更新監視を開始（失敗時はポーリングのみ）"""
+        if not WATCHDOG_AVAILABLE or not self.parser.log_path.exists():
+            return
+
+        try:
+            handler = VRChatLogChangeHandler(self._wake_event)
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.schedule(handler, str(self.parser.log_path), recursive=False)
+            self.observer.start()
+        except Exception as e:
+            _log(f"ログフォルダ監視の開始に失敗、ポーリングのみで動作: {e}")
+            self.observer = None
+
+    def stop(self):
+        """追跡停止"""
+        self._stop_event.set()
+        self._wake_event.set()
+
+        if self.observer:
+            try:
+                self.observer.stop()
+                self.observer.join(timeout=1)
+            except Exception as e:
+                _log(f"Observer stop failed: {e}")
+            self.observer = None
+
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+        _log("追跡停止")
+
+    def wake(self):
+        """即座に解析を実行させる"""
+        self._wake_event.set()
+
+    def _run(self):
+        """追跡ループ"""
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+
+            try:
+                has_backlog = self.parser.parse_new_lines()
+            except Exception as e:
+                _log(f"ログ解析エラー: {e}")
+                has_backlog = False
+
+            # 未読データが残っていれば待たずに続きを読む
+            if has_backlog:
+                continue
+
+            self._wake_event.wait(self.poll_interval)
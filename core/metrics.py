@@ -0,0 +1,311 @@
+"""
+Request Metrics
+サーバー通信の所要時間・サイズをエンドポイントごとに集計する
+固定バケットのヒストグラムを1分単位で保持し、直近N分のパーセンタイルを返す
+通信以外のイベント（キューの退避など）もEventCountersで1分単位に数える
+
+記録・参照はどちらもイベントループのスレッドから行う前提で、ロックは使わない
+"""
+
+import time
+import bisect
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# 時間のバケット上限（ミリ秒）
+LATENCY_BUCKETS_MS = (
+    1, 2, 5, 10, 20, 50, 100, 200, 350, 500, 750,
+    1000, 1500, 2000, 3000, 5000, 10000, 20000, 30000, 60000, 120000
+)
+# サイズのバケット上限（バイト）
+SIZE_BUCKETS = tuple(1024 * (4 ** i) for i in range(11))  # 1KB 〜 1GB
+
+# 集計する項目とバケット
+METRIC_BUCKETS = {
+    'connect_ms': LATENCY_BUCKETS_MS,
+    'ttfb_ms': LATENCY_BUCKETS_MS,
+    'total_ms': LATENCY_BUCKETS_MS,
+    'request_bytes': SIZE_BUCKETS,
+}
+
+PERCENTILES = (0.50, 0.95, 0.99)
+
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 末尾は上限超え
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """値を記録"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        """別のヒストグラムを加算"""
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        if other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        パーセンタイルを推定（バケット内は線形補間）
+
+        Args:
+            q: 0〜1
+
+        Returns:
+            Optional[float]: 推定値（データがなければNone）
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            if c and cumulative + c >= rank:
+                lower = max(self.bounds[i - 1] if i > 0 else 0.0, self.min)
+                upper = min(self.bounds[i] if i < len(self.bounds) else self.max, self.max)
+                fraction = (rank - cumulative) / c
+                return lower + (upper - lower) * max(0.0, min(1.0, fraction))
+            cumulative += c
+        return self.max
+
+    def summary(self) -> Dict:
+        """件数・平均・最大・パーセンタイル"""
+        result = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max if self.count else None,
+        }
+        for q in PERCENTILES:
+            result[f'p{int(q * 100)}'] = self.percentile(q)
+        return result
+
+
+class _MinuteSlot:
+    """1分間・1エンドポイント分の集計"""
+
+    __slots__ = ('minute', 'histograms', 'statuses', 'requests', 'retries')
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.histograms = {name: Histogram(bounds) for name, bounds in METRIC_BUCKETS.items()}
+        self.statuses: Dict[str, int] = {}
+        self.requests = 0
+        self.retries = 0
+
+
+class RequestMetrics:
+    """エンドポイントごとの通信メトリクス"""
+
+    def __init__(self, window_minutes: int = 60, clock: Callable[[], float] = time.time):
+        """
+        初期化
+
+        Args:
+            window_minutes: 保持する期間（分）
+            clock: 現在時刻（秒）を返す関数
+        """
+        self.window_minutes = window_minutes
+        self._clock = clock
+        # endpoint -> 古い順の1分ごとの集計
+        self._slots: Dict[str, List[_MinuteSlot]] = {}
+
+    def record(
+        self,
+        endpoint: str,
+        status: str,
+        total_ms: float,
+        connect_ms: Optional[float] = None,
+        ttfb_ms: Optional[float] = None,
+        request_bytes: Optional[int] = None,
+        retries: int = 0
+    ):
+        """
+        リクエスト1件を記録
+
+        Args:
+            endpoint: "POST /vrc/api/photos/upload" などのキー
+            status: HTTPステータス（接続できなかった場合はエラー種別）
+            total_ms: 全体の所要時間
+            connect_ms: 新規接続にかかった時間（接続を再利用した場合はNone）
+            ttfb_ms: 送信開始からレスポンスヘッダー受信までの時間
+            request_bytes: リクエストボディのサイズ
+            retries: 再試行回数
+        """
+        minute = int(self._clock() // 60)
+        slots = self._slots.get(endpoint)
+        if slots is None:
+            slots = self._slots[endpoint] = []
+        if not slots or slots[-1].minute != minute:
+            slots.append(_MinuteSlot(minute))
+            # 保持期間を過ぎた集計を捨てる
+            while slots[0].minute <= minute - self.window_minutes:
+                slots.pop(0)
+        slot = slots[-1]
+
+        slot.requests += 1
+        slot.retries += retries
+        slot.statuses[status] = slot.statuses.get(status, 0) + 1
+        histograms = slot.histograms
+        histograms['total_ms'].observe(total_ms)
+        if connect_ms is not None:
+            histograms['connect_ms'].observe(connect_ms)
+        if ttfb_ms is not None:
+            histograms['ttfb_ms'].observe(ttfb_ms)
+        if request_bytes is not None:
+            histograms['request_bytes'].observe(request_bytes)
+
+    def endpoints(self) -> List[str]:
+        """記録のあるエンドポイント一覧"""
+        return sorted(self._slots)
+
+    def summary(self, minutes: int = 5, endpoint: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        直近N分の集計を取得
+
+        Args:
+            minutes: 集計する期間（分）
+            endpoint: 指定した場合はそのエンドポイントのみ
+
+        Returns:
+            Dict[str, Dict]: endpoint -> {'requests', 'retries', 'statuses',
+                                          'connect_ms': {'count', 'mean', 'max', 'p50', 'p95', 'p99'}, ...}
+        """
+        since = int(self._clock() // 60) - minutes
+        targets = [endpoint] if endpoint else list(self._slots)
+
+        result = {}
+        for name in targets:
+            histograms = {metric: Histogram(bounds) for metric, bounds in METRIC_BUCKETS.items()}
+            statuses: Dict[str, int] = {}
+            requests = retries = 0
+            for slot in self._slots.get(name, ()):
+                if slot.minute <= since:
+                    continue
+                requests += slot.requests
+                retries += slot.retries
+                for status, count in slot.statuses.items():
+                    statuses[status] = statuses.get(status, 0) + count
+                for metric, histogram in slot.histograms.items():
+                    histograms[metric].merge(histogram)
+            if requests == 0:
+                continue
+            entry = {'requests': requests, 'retries': retries, 'statuses': statuses}
+            for metric, histogram in histograms.items():
+                entry[metric] = histogram.summary()
+            result[name] = entry
+        return result
+
+    def clear(self):
+        """全ての記録を削除"""
+        self._slots.clear()
+
+
+class EventCounters:
+    """
+    通信以外のイベントの回数・量を1分単位で数える（オフラインキューの退避・再圧縮など）
+
+    RequestMetricsと同じくイベントループのスレッドから使う前提で、ロックは使わない
+    """
+
+    def __init__(self, window_minutes: int = 60, clock: Callable[[], float] = time.time):
+        """
+        初期化
+
+        Args:
+            window_minutes: 保持する期間（分）
+            clock: 現在時刻（秒）を返す関数
+        """
+        self.window_minutes = window_minutes
+        self._clock = clock
+        # 古い順の (分, 名前 -> 値)
+        self._slots: List[Tuple[int, Dict[str, int]]] = []
+        # 起動からの合計
+        self.totals: Dict[str, int] = {}
+
+    def increment(self, name: str, amount: int = 1):
+        """
+        カウンターを加算
+
+        Args:
+            name: "queue_evicted" などのキー
+            amount: 加算する値（件数・バイト数）
+        """
+        minute = int(self._clock() // 60)
+        if not self._slots or self._slots[-1][0] != minute:
+            self._slots.append((minute, {}))
+            # 保持期間を過ぎた集計を捨てる
+            while self._slots[0][0] <= minute - self.window_minutes:
+                self._slots.pop(0)
+        counters = self._slots[-1][1]
+        counters[name] = counters.get(name, 0) + amount
+        self.totals[name] = self.totals.get(name, 0) + amount
+
+    def summary(self, minutes: int = 5) -> Dict[str, int]:
+        """
+        直近N分の合計を取得
+
+        Args:
+            minutes: 集計する期間（分）
+
+        Returns:
+            Dict[str, int]: 名前 -> 合計
+        """
+        since = int(self._clock() // 60) - minutes
+        result: Dict[str, int] = {}
+        for minute, counters in self._slots:
+            if minute <= since:
+                continue
+            for name, value in counters.items():
+                result[name] = result.get(name, 0) + value
+        return result
+
+    def clear(self):
+        """全ての記録を削除"""
+        self._slots.clear()
+        self.totals.clear()
+
+
+class RequestTrace:
+    """
+    httpxのtrace拡張で1回の送信の接続時間とTTFBを測る
+
+    extensions={'trace': RequestTrace()} として渡す。
+    """
+
+    __slots__ = ('started', 'connect_started', 'connect_ms', 'ttfb_ms')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connect_started: Optional[float] = None
+        self.connect_ms: Optional[float] = None
+        self.ttfb_ms: Optional[float] = None
+
+    async def __call__(self, event_name: str, info: Dict):
+        if event_name == 'connection.connect_tcp.started':
+            self.connect_started = time.perf_counter()
+        elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            if self.connect_started is not None:
+                self.connect_ms = (time.perf_counter() - self.connect_started) * 1000
+        elif event_name.endswith('.receive_response_headers.complete'):
+            self.ttfb_ms = (time.perf_counter() - self.started) * 1000
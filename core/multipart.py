@@ -0,0 +1,146 @@
+"""
+Multipart Stream
+multipart/form-dataのボディをファイルから少しずつ読みながら生成する
+大量の写真を再送してもメモリ使用量が画像サイズに比例しない
+"""
+
+import os
+import uuid
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+from core.bandwidth import TokenBucket
+
+
+# ファイルから一度に読み込むサイズ
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# 進捗コールバック: (送信済みバイト数, 合計バイト数)
+ProgressCallback = Callable[[int, int], None]
+
+
+def _quote(value: str) -> str:
+    """Content-Dispositionのパラメーター値をエスケープ"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\r', '%0D').replace('\n', '%0A')
+
+
+class MultipartStream:
+    """
+    ストリーミング送信用のmultipart/form-dataボディ
+
+    httpxのcontentにそのまま渡せる。再試行で複数回送信しても毎回先頭から生成する。
+    ファイルはスレッドで読み込むため、送信中もイベントループを止めない。
+    """
+
+    def __init__(
+        self,
+        progress: Optional[ProgressCallback] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        limiter: Optional[TokenBucket] = None
+    ):
+        """
+        初期化
+
+        Args:
+            progress: 進捗コールバック（チャンク送信ごとに呼ばれる）
+            chunk_size: 一度に読み込み・送信するサイズ
+            limiter: 送信速度の制限（チャンクごとに送信枠を確保）
+        """
+        self.boundary = uuid.uuid4().hex
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.limiter = limiter
+        # (パートヘッダー, 内容: bytes または Path)
+        self._parts: List[Tuple[bytes, Union[bytes, Path]]] = []
+
+    def add_field(self, name: str, value: str):
+        """フォーム項目を追加"""
+        header = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+        ).encode('utf-8')
+        self._parts.append((header, str(value).encode('utf-8')))
+
+    def add_fields(self, fields: Dict[str, str]):
+        """フォーム項目をまとめて追加"""
+        for name, value in fields.items():
+            self.add_field(name, value)
+
+    def add_file(self, name: str, filename: str, source: Union[bytes, Path], content_type: str = 'image/jpeg'):
+        """
+        ファイルを追加
+
+        Args:
+            name: 項目名
+            filename: 送信するファイル名
+            source: 内容（Pathの場合は送信時にディスクから読み込む）
+            content_type: Content-Type
+        """
+        header = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{_quote(name)}"; filename="{_quote(filename)}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._parts.append((header, Path(source) if isinstance(source, (str, os.PathLike)) else source))
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    @property
+    def _closing(self) -> bytes:
+        return f'--{self.boundary}--\r\n'.encode('ascii')
+
+    @property
+    def content_length(self) -> int:
+        """ボディ全体のバイト数（ファイルサイズは現時点のもの）"""
+        total = len(self._closing)
+        for header, content in self._parts:
+            size = content.stat().st_size if isinstance(content, Path) else len(content)
+            total += len(header) + size + 2
+        return total
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """リクエストに付けるヘッダー"""
+        return {
+            'Content-Type': self.content_type,
+            'Content-Length': str(self.content_length)
+        }
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._generate()
+
+    async def _generate(self) -> AsyncIterator[bytes]:
+        total = self.content_length
+        sent = 0
+        limiter = self.limiter
+
+        async def advance(chunk: bytes) -> bytes:
+            nonlocal sent
+            if limiter is not None:
+                await limiter.acquire(len(chunk))
+            sent += len(chunk)
+            if self.progress:
+                self.progress(sent, total)
+            return chunk
+
+        for header, content in self._parts:
+            yield await advance(header)
+            if isinstance(content, Path):
+                f = await asyncio.to_thread(open, content, 'rb')
+                try:
+                    while True:
+                        chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                        if not chunk:
+                            break
+                        yield await advance(chunk)
+                finally:
+                    f.close()
+            else:
+                # メモリ上の内容も分割して送る（速度制限を1枚の途中でも効かせる）
+                for offset in range(0, len(content), self.chunk_size):
+                    yield await advance(content[offset:offset + self.chunk_size])
+            yield await advance(b'\r\n')
+        yield await advance(self._closing)
@@ -1,17 +1,32 @@
 """
 Offline Queue Manager
 サーバーオフライン時のデータ一時保存・再送信管理
+
+メタデータはSQLite（WALモード）に保存し、画像はimagesフォルダに置く。
+1件の追加・削除は主キーのインデックスで行うため、キューが長くても送信済みの削除が遅くならない。
+件数・合計サイズは起動時に1回だけ集計し、以降は追加・削除のたびにメモリ上で更新する。
+参照モードでは画像をコピーせず元のPNGへのハードリンクとサイズ・更新時刻だけを保存し、送信時に変換する。
+容量上限（バイト・枚数）を超える場合は退避ポリシー（core.queue_quota）で空きを作る。
+ワールド参加は追加時に末尾の1件とだけ比較してまとめる（同じインスタンスへの連続参加・写真のない短い滞在）。
+旧バージョンのCSV（photos.csv / worlds.csv）は初回起動時に取り込む。
 """
 
+import os
 import csv
 import json
 import uuid
 import shutil
+import sqlite3
+import hashlib
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, Dict, List, Tuple
+from contextlib import contextmanager
+from typing import Callable, Optional, Dict, Iterable, Iterator, List, Tuple
 from dataclasses import dataclass, asdict
 
+from core.queue_quota import ROW_OVERHEAD_BYTES, EvictionPolicy, QueueFullError, RefuseNewPolicy
+
 
 @dataclass
 class QueuedPhoto:
@@ -24,6 +39,18 @@ class QueuedPhoto:
     taken_at: str
     camera_data: Optional[Dict]
     created_at: str
+    idempotency_key: Optional[str] = None  # 再送しても重複登録されないようにするキー
+    attach_to: Optional[str] = None  # プレビュー送信済みの写真ID（フル解像度の添付待ち）
+    source_path: Optional[str] = None  # 参照モード: 送信時に変換する元のPNG
+    source_size: Optional[int] = None  # 参照モード: キュー追加時の元ファイルのサイズ
+    source_mtime_ns: Optional[int] = None  # 参照モード: キュー追加時の元ファイルの更新時刻
+    reencoded: bool = False  # 容量上限のため低画質で再圧縮済み
+    attempts: int = 0  # 送信に失敗した回数（再起動後も保持）
+
+    @property
+    def is_reference(self) -> bool:
+        """画像をコピーせず元のPNGを参照しているか"""
+        return bool(self.source_path)
 
 
 @dataclass
@@ -32,29 +59,99 @@ class QueuedWorldJoin:
     id: str
     world_id: str
     instance_id: str
-    vrc_user_id: str
-    vrc_display_name: str
+    vrc_user_id: Optional[str]
+    vrc_display_name: Optional[str]
     created_at: str
+    attempts: int = 0  # 送信に失敗した回数（再起動後も保持）
+
+
+# 再送時に一度に読み込む件数
+DEFAULT_PAGE_SIZE = 500
+# 並び順 -> (seqの比較演算子, ORDER BY)
+PAGE_ORDERS = {
+    'oldest': ('>', 'ASC'),
+    'newest': ('<', 'DESC'),
+}
+
+# 追加順はseq（INTEGER PRIMARY KEY）、削除はid（UNIQUEインデックス）で引く
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    world_id TEXT,
+    instance_id TEXT,
+    visibility TEXT NOT NULL,
+    taken_at TEXT NOT NULL,
+    camera_data TEXT,
+    created_at TEXT NOT NULL,
+    idempotency_key TEXT,
+    attach_to TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    source_path TEXT,
+    source_size INTEGER,
+    source_mtime_ns INTEGER,
+    reencoded INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+-- VRChatユーザー情報は取得しないため未設定（NULL）で保存する
+CREATE TABLE IF NOT EXISTS worlds (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    world_id TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    vrc_user_id TEXT,
+    vrc_display_name TEXT,
+    created_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    left_at TEXT
+);
+-- 再圧縮の対象（未再圧縮・参照モード以外）だけを持つ部分インデックス（再圧縮済みの写真を毎回読み飛ばさない）
+CREATE INDEX IF NOT EXISTS photos_reencode_candidates ON photos(seq)
+    WHERE reencoded = 0 AND source_path IS NULL;
+"""
 
 
 class OfflineQueueManager:
     """オフラインキュー管理クラス"""
 
+    DB_FILE = 'queue.db'
     PHOTOS_CSV = 'photos.csv'
     WORLDS_CSV = 'worlds.csv'
     IMAGES_DIR = 'images'
+    # 取り込み済みCSVの退避先の拡張子
+    MIGRATED_SUFFIX = '.migrated'
 
     PHOTO_FIELDS = ['id', 'filename', 'world_id', 'instance_id', 'visibility',
-                    'taken_at', 'camera_data', 'created_at']
+                    'taken_at', 'camera_data', 'created_at', 'idempotency_key', 'attach_to']
     WORLD_FIELDS = ['id', 'world_id', 'instance_id', 'vrc_user_id',
                     'vrc_display_name', 'created_at']
+    # 参照モードの列（CSV時代には無い）
+    REFERENCE_FIELDS = ['source_path', 'source_size', 'source_mtime_ns']
+    # 送信失敗を記録するテーブル
+    ITEM_TABLES = {'photo': 'photos', 'world_join': 'worlds'}
 
-    def __init__(self, base_path: Optional[Path] = None):
+    def __init__(
+        self,
+        base_path: Optional[Path] = None,
+        max_bytes: int = 0,
+        max_items: int = 0,
+        eviction_policy: Optional[EvictionPolicy] = None,
+        min_stay_sec: float = 0,
+        max_attempts: int = 0
+    ):
         """
         初期化
 
         Args:
             base_path: 保存先ベースパス（デフォルト: vrc_uploader/temp）
+            max_bytes: ディスク使用量の上限（画像＋メタデータ、0=無制限）
+            max_items: 写真の枚数の上限（0=無制限）
+            eviction_policy: 上限に達した時のポリシー（デフォルト: 新しい写真を受け付けない）
+            min_stay_sec: 滞在がこの秒数未満で写真のないワールド参加は報告しない（0=まとめない）
+            max_attempts: 送り直しても成功しない失敗がこの回数に達した項目は保留にして再送しない（0=無制限）
         """
         if base_path is None:
             # vrc_uploader/temp をデフォルトに
@@ -64,16 +161,281 @@ class OfflineQueueManager:
         self.images_path = base_path / self.IMAGES_DIR
         self._ensure_dirs()
 
+        # 終了時の確認など別スレッドからも呼ばれるためロックで直列化
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        # 件数・合計サイズ（コミット済みの分のみ）と、コミット待ちの増減
+        # bytes: imagesフォルダの画像の合計（参照モードのハードリンクも元ファイルが消えれば容量を使うため含める）
+        # parked_*: 失敗が続いたため保留にした件数（photos / worlds に含まれる）
+        self._counts = {'photos': 0, 'worlds': 0, 'bytes': 0, 'parked_photos': 0, 'parked_worlds': 0}
+        self._pending_delta = dict.fromkeys(self._counts, 0)
+        self._callbacks: List[Callable[[Dict[str, int]], None]] = []
+
+        # 容量上限と退避
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.eviction_policy = eviction_policy or RefuseNewPolicy()
+        self.eviction_counts = {'evicted': 0, 'reencoded': 0, 'refused': 0, 'freed_bytes': 0}
+        # 空きの確保（再圧縮）は別スレッドで時間がかかるため、キュー全体のロックとは分ける
+        self._reserve_lock = threading.Lock()
+        self._eviction_callbacks: List[Callable[[Dict], None]] = []
+
+        # ワールド参加のまとめ（duplicates: 連続した同じインスタンス / short_stays: 写真のない短い滞在）
+        self.min_stay_sec = min_stay_sec
+        self.compaction_counts = {'duplicates': 0, 'short_stays': 0}
+
+        # 送信に失敗し続ける項目の保留
+        self.max_attempts = max_attempts
+
+        self._conn = self._connect()
+        self._migrate_csv()
+        self._load_counts()
+
     def _ensure_dirs(self):
         """ディレクトリを確保"""
         self.base_path.mkdir(parents=True, exist_ok=True)
         self.images_path.mkdir(parents=True, exist_ok=True)
 
-    def _get_photos_csv_path(self) -> Path:
-        return self.base_path / self.PHOTOS_CSV
+    def _connect(self) -> sqlite3.Connection:
+        """データベースを開く（WALモード）"""
+        conn = sqlite3.connect(str(self.base_path / self.DB_FILE), check_same_thread=False,
+                               isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL: 書き込み途中で落ちてもキュー全体が壊れない・コミットが追記のみで速い
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WALではNORMALでも整合性は保たれる（電源断時に直前のコミットが失われる可能性のみ）
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _image_size(self, queue_id: str) -> int:
+        image_path = self.images_path / f"{queue_id}.jpg"
+        return image_path.stat().st_size if image_path.exists() else 0
+
+    def _load_counts(self):
+        """件数・合計サイズを集計（起動時のみ）"""
+        row = self._execute(
+            'SELECT (SELECT COUNT(*) FROM photos), (SELECT COALESCE(SUM(size), 0) FROM photos), '
+            '(SELECT COUNT(*) FROM worlds), '
+            '(SELECT COUNT(*) FROM photos WHERE ? > 0 AND attempts >= ?), '
+            '(SELECT COUNT(*) FROM worlds WHERE ? > 0 AND attempts >= ?)',
+            [self.max_attempts] * 4
+        )[0]
+        self._counts = {'photos': row[0], 'worlds': row[2], 'bytes': row[1],
+                        'parked_photos': row[3], 'parked_worlds': row[4]}
+
+    def _is_parked(self, attempts: int) -> bool:
+        """失敗が続いたため保留にした項目か"""
+        return 0 < self.max_attempts <= attempts
+
+    def on_counts_changed(self, callback: Callable[[Dict[str, int]], None]):
+        """件数・合計サイズの変更コールバックを登録（get_queue_counts と同じ形式）"""
+        self._callbacks.append(callback)
+
+    def on_evicted(self, callback: Callable[[Dict], None]):
+        """退避（削除・再圧縮・受付拒否）のコールバックを登録（{'action', 'policy', 'filename', 'freed_bytes'}）"""
+        self._eviction_callbacks.append(callback)
+
+    def _add_counts(self, photos: int = 0, worlds: int = 0, size: int = 0,
+                    parked_photos: int = 0, parked_worlds: int = 0):
+        """件数の増減を記録（コミット時に反映）"""
+        delta = self._pending_delta
+        delta['photos'] += photos
+        delta['worlds'] += worlds
+        delta['bytes'] += size
+        delta['parked_photos'] += parked_photos
+        delta['parked_worlds'] += parked_worlds
+
+    def _apply_pending_counts(self):
+        delta = self._pending_delta
+        if not any(delta.values()):
+            return
+        for name, value in delta.items():
+            self._counts[name] += value
+            delta[name] = 0
+        counts = self.get_queue_counts()
+        for callback in self._callbacks:
+            try:
+                callback(counts)
+            except Exception as e:
+                print(f"Offline queue callback error: {e}")
+
+    def close(self):
+        """データベースを閉じる"""
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def batch(self):
+        """
+        まとめて1回のコミットにする（入れ子可）
+
+        使い方:
+            with queue.batch():
+                for queue_id in sent:
+                    queue.remove_photo(queue_id)
+        """
+        with self._lock:
+            if self._batch_depth == 0:
+                self._conn.execute('BEGIN')
+            self._batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._conn.execute('ROLLBACK')
+                    self._pending_delta = dict.fromkeys(self._pending_delta, 0)
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._conn.execute('COMMIT')
+                self._apply_pending_counts()
+
+    def _migrate_csv(self):
+        """旧バージョンのCSVキューを取り込み、CSVは退避する"""
+        photos_csv = self.base_path / self.PHOTOS_CSV
+        worlds_csv = self.base_path / self.WORLDS_CSV
+        if not photos_csv.exists() and not worlds_csv.exists():
+            return
+
+        photos = self._read_csv(photos_csv)
+        worlds = self._read_csv(worlds_csv)
+        with self.batch():
+            # 取り込み後・退避前に落ちた場合も、次回は同じIDを無視するので重複しない
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO photos ({', '.join(self.PHOTO_FIELDS)}, size) "
+                f"VALUES ({', '.join('?' * len(self.PHOTO_FIELDS))}, ?)",
+                [
+                    # 旧バージョンで追加された写真はキューIDをキーにする
+                    tuple(row.get(name) or (row['id'] if name == 'idempotency_key' else '')
+                          for name in self.PHOTO_FIELDS) + (self._image_size(row['id']),)
+                    for row in photos
+                ]
+            )
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO worlds ({', '.join(self.WORLD_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(self.WORLD_FIELDS))})",
+                [tuple(row.get(name) or '' for name in self.WORLD_FIELDS) for row in worlds]
+            )
+
+        for csv_path in (photos_csv, worlds_csv):
+            if csv_path.exists():
+                csv_path.replace(csv_path.with_name(csv_path.name + self.MIGRATED_SUFFIX))
+        print(f"Migrated offline queue from CSV: {len(photos)} photos, {len(worlds)} world joins")
+
+    @staticmethod
+    def _read_csv(csv_path: Path) -> List[Dict[str, str]]:
+        if not csv_path.exists():
+            return []
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            return [row for row in csv.DictReader(f) if row.get('id')]
+
+    # ========== 容量上限 ==========
+
+    @property
+    def disk_usage(self) -> int:
+        """ディスク使用量の見積もり（保存している画像＋1件あたりのメタデータ）"""
+        counts = self._counts
+        return counts['bytes'] + (counts['photos'] + counts['worlds']) * ROW_OVERHEAD_BYTES
+
+    def fits_item_quota(self, incoming_items: int = 0) -> bool:
+        """写真を追加しても枚数の上限に収まるか"""
+        return self.max_items <= 0 or self._counts['photos'] + incoming_items <= self.max_items
+
+    def has_room(self, incoming_bytes: int = 0, incoming_items: int = 0) -> bool:
+        """
+        データを追加しても上限に収まるか
+
+        Args:
+            incoming_bytes: 追加するデータのディスク使用量
+            incoming_items: 追加する写真の枚数
+        """
+        if self.max_bytes > 0 and self.disk_usage + incoming_bytes > self.max_bytes:
+            return False
+        return self.fits_item_quota(incoming_items)
+
+    def _reserve(self, incoming_bytes: int, filename: str):
+        """写真1枚分の空きを確保（ポリシーでも確保できなければQueueFullError）"""
+        if self.has_room(incoming_bytes, 1):
+            return
+        with self._reserve_lock:
+            if self.eviction_policy.make_room(self, incoming_bytes, 1):
+                return
+        self._record_eviction('refused', self.eviction_policy.name, filename, 0)
+        raise QueueFullError(
+            f"Offline queue is full ({self.disk_usage} / {self.max_bytes} bytes, "
+            f"{self._counts['photos']} / {self.max_items} photos)"
+        )
+
+    def evict_photo(self, photo: QueuedPhoto, policy: str):
+        """
+        容量確保のために写真をキューから削除
+
+        Args:
+            photo: 削除する写真
+            policy: 削除したポリシー名（記録用）
+        """
+        before = self.disk_usage
+        self.remove_photos([photo.id])
+        self._record_eviction('evicted', policy, photo.filename, before - self.disk_usage)
+
+    def replace_photo_image(self, photo: QueuedPhoto, jpg_bytes: bytes, policy: str):
+        """
+        容量確保のためにキュー内の画像を差し替え（再圧縮）
 
-    def _get_worlds_csv_path(self) -> Path:
-        return self.base_path / self.WORLDS_CSV
+        Args:
+            photo: 対象の写真（参照モードは不可）
+            jpg_bytes: 差し替える画像
+            policy: 差し替えたポリシー名（記録用）
+        """
+        image_path = self.images_path / f"{photo.id}.jpg"
+        temp_path = image_path.with_suffix('.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(jpg_bytes)
+        with self.batch():
+            found = self._conn.execute('SELECT size FROM photos WHERE id = ?', (photo.id,)).fetchone()
+            if found is None:
+                temp_path.unlink()
+                return
+            self._conn.execute('UPDATE photos SET size = ?, reencoded = 1 WHERE id = ?', (len(jpg_bytes), photo.id))
+            delta = len(jpg_bytes) - found['size']
+            self._add_counts(size=delta)
+            temp_path.replace(image_path)
+        photo.reencoded = True
+        self._record_eviction('reencoded', policy, photo.filename, -delta)
+
+    def _record_eviction(self, action: str, policy: str, filename: str, freed_bytes: int):
+        self.eviction_counts[action] += 1
+        self.eviction_counts['freed_bytes'] += max(0, freed_bytes)
+        print(f"Offline queue {action} ({policy}): {filename}, freed {freed_bytes} bytes")
+        event = {'action': action, 'policy': policy, 'filename': filename, 'freed_bytes': freed_bytes}
+        for callback in self._eviction_callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Offline queue callback error: {e}")
+
+    def get_quota_status(self) -> Dict[str, int]:
+        """
+        容量上限と使用量・退避の回数を取得
+
+        Returns:
+            Dict[str, int]: {'disk_bytes', 'max_bytes', 'photos', 'max_items',
+                             'evicted', 'reencoded', 'refused', 'freed_bytes'}
+        """
+        return {
+            'disk_bytes': self.disk_usage,
+            'max_bytes': self.max_bytes,
+            'photos': self._counts['photos'],
+            'max_items': self.max_items,
+            **self.eviction_counts
+        }
+
+    def _execute(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        """SQLを1文実行して結果の行を返す"""
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
 
     # ========== 写真キュー操作 ==========
 
@@ -85,7 +447,9 @@ class OfflineQueueManager:
         instance_id: Optional[str] = None,
         visibility: str = 'self',
         taken_at: Optional[datetime] = None,
-        camera_data: Optional[Dict] = None
+        camera_data: Optional[Dict] = None,
+        idempotency_key: Optional[str] = None,
+        attach_to: Optional[str] = None
     ) -> str:
         """
         写真をキューに追加
@@ -98,19 +462,24 @@ class OfflineQueueManager:
             visibility: 公開範囲
             taken_at: 撮影日時
             camera_data: カメラデータ
+            idempotency_key: 重複防止キー（省略時は画像のハッシュ）
+            attach_to: プレビュー送信済みの写真ID（指定時は再送でフル解像度を添付する）
 
         Returns:
             str: キューID
+
+        Raises:
+            QueueFullError: 容量上限に達していて、ポリシーでも空きを作れない場合
         """
+        self._reserve(len(jpg_bytes) + ROW_OVERHEAD_BYTES, filename)
         queue_id = str(uuid.uuid4())
 
-        # 画像を保存
+        # 画像を保存（行より先に書くので、行があれば画像も必ずある）
         image_filename = f"{queue_id}.jpg"
         image_path = self.images_path / image_filename
         with open(image_path, 'wb') as f:
             f.write(jpg_bytes)
 
-        # CSVに追加
         photo_data = QueuedPhoto(
             id=queue_id,
             filename=filename,
@@ -119,56 +488,284 @@ class OfflineQueueManager:
             visibility=visibility,
             taken_at=(taken_at or datetime.now()).isoformat(),
             camera_data=json.dumps(camera_data) if camera_data else '',
-            created_at=datetime.now().isoformat()
+            created_at=datetime.now().isoformat(),
+            idempotency_key=idempotency_key or hashlib.sha256(jpg_bytes).hexdigest(),
+            attach_to=attach_to or ''
         )
+        row = asdict(photo_data)
+        with self.batch():
+            self._conn.execute(
+                f"INSERT INTO photos ({', '.join(self.PHOTO_FIELDS)}, size) "
+                f"VALUES ({', '.join('?' * len(self.PHOTO_FIELDS))}, ?)",
+                [row[name] for name in self.PHOTO_FIELDS] + [len(jpg_bytes)]
+            )
+            self._add_counts(photos=1, size=len(jpg_bytes))
+
+        return queue_id
+
+    def queue_photo_reference(
+        self,
+        source_path: Path,
+        filename: str,
+        world_id: Optional[str] = None,
+        instance_id: Optional[str] = None,
+        visibility: str = 'self',
+        taken_at: Optional[datetime] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        写真を元のPNGの参照としてキューに追加（変換・コピーは送信時まで行わない）
 
-        csv_path = self._get_photos_csv_path()
-        file_exists = csv_path.exists()
+        元ファイルはimagesフォルダにハードリンクしておくため、送信前に移動・削除されても送信できる
+        （元ファイルが消えるとハードリンクがその分の容量を使うため、容量上限にはPNGのサイズで数える）。ハードリンクできない場合（別ドライブ等）は元ファイルが残る保証が
+        無いためNoneを返し、呼び出し側で変換してコピーを保存する。
 
-        with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.PHOTO_FIELDS)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(asdict(photo_data))
+        Args:
+            source_path: 元のPNGファイルのパス
+            filename: 送信するファイル名
+            world_id: ワールドID
+            instance_id: インスタンスID
+            visibility: 公開範囲
+            taken_at: 撮影日時
+            idempotency_key: 重複防止キー（省略時は元ファイルのパス・サイズ・更新時刻から生成）
+
+        Returns:
+            Optional[str]: キューID（元ファイルをハードリンクできない場合はNone）
+
+        Raises:
+            QueueFullError: 容量上限に達していて、ポリシーでも空きを作れない場合
+        """
+        try:
+            source_size = Path(source_path).stat().st_size
+        except OSError:
+            return None
+        self._reserve(source_size + ROW_OVERHEAD_BYTES, filename)
+
+        queue_id = str(uuid.uuid4())
+        link_path = self.images_path / f"{queue_id}.png"
+        try:
+            os.link(source_path, link_path)
+            stat = link_path.stat()
+        except OSError:
+            return None
+        photo_data = QueuedPhoto(
+            id=queue_id,
+            filename=filename,
+            world_id=world_id or '',
+            instance_id=instance_id or '',
+            visibility=visibility,
+            taken_at=(taken_at or datetime.now()).isoformat(),
+            camera_data='',
+            created_at=datetime.now().isoformat(),
+            idempotency_key=idempotency_key or hashlib.sha256(
+                f"{Path(source_path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')
+            ).hexdigest(),
+            attach_to='',
+            source_path=str(link_path),
+            source_size=stat.st_size,
+            source_mtime_ns=stat.st_mtime_ns
+        )
+        row = asdict(photo_data)
+        fields = self.PHOTO_FIELDS + self.REFERENCE_FIELDS
+        with self.batch():
+            self._conn.execute(
+                f"INSERT INTO photos ({', '.join(fields)}, size) VALUES ({', '.join('?' * len(fields))}, ?)",
+                [row[name] for name in fields] + [stat.st_size]
+            )
+            self._add_counts(photos=1, size=stat.st_size)
 
         return queue_id
 
+    def replace_reference_with_copy(self, photo: QueuedPhoto, jpg_bytes: bytes,
+                                    camera_data: Optional[Dict] = None) -> Path:
+        """
+        参照モードの写真を変換済みのコピーに置き換え（キュー追加後に元ファイルが変更された場合）
+
+        重複防止キーは変換後の画像のハッシュに変える（変更前の内容とは別の写真として送る）。
+
+        Args:
+            photo: 対象の写真（更新される）
+            jpg_bytes: 変換済みの画像
+            camera_data: カメラデータ
+
+        Returns:
+            Path: 保存した画像のパス
+        """
+        image_path = self.images_path / f"{photo.id}.jpg"
+        temp_path = image_path.with_suffix('.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(jpg_bytes)
+        idempotency_key = hashlib.sha256(jpg_bytes).hexdigest()
+        with self.batch():
+            found = self._conn.execute('SELECT size FROM photos WHERE id = ?', (photo.id,)).fetchone()
+            if found is None:
+                temp_path.unlink()
+                return image_path
+            self._conn.execute(
+                'UPDATE photos SET size = ?, camera_data = ?, idempotency_key = ?, '
+                'source_path = NULL, source_size = NULL, source_mtime_ns = NULL WHERE id = ?',
+                (len(jpg_bytes), json.dumps(camera_data) if camera_data else '', idempotency_key, photo.id)
+            )
+            self._add_counts(size=len(jpg_bytes) - found['size'])
+            temp_path.replace(image_path)
+        # 参照用のハードリンク（元ファイルは消さない）
+        (self.images_path / f"{photo.id}.png").unlink(missing_ok=True)
+
+        photo.camera_data = camera_data or None
+        photo.idempotency_key = idempotency_key
+        photo.source_path = photo.source_size = photo.source_mtime_ns = None
+        return image_path
+
+    @staticmethod
+    def is_source_unchanged(photo: QueuedPhoto) -> bool:
+        """
+        参照している元ファイルがキュー追加時から変わっていないか
+
+        Returns:
+            bool: 存在し、サイズ・更新時刻が一致すればTrue（参照でない写真は常にTrue）
+        """
+        if not photo.is_reference:
+            return True
+        try:
+            stat = Path(photo.source_path).stat()
+        except OSError:
+            return False
+        return stat.st_size == photo.source_size and stat.st_mtime_ns == photo.source_mtime_ns
+
     def get_queued_photos(self) -> List[Tuple[QueuedPhoto, bytes]]:
         """
-        キューに入っている全写真を取得
+        キューに入っている全写真を取得（全画像をメモリに読み込むため、再送には iter_photo_pages を使う）
 
         Returns:
             List[Tuple[QueuedPhoto, bytes]]: (写真データ, 画像バイト) のリスト
         """
-        csv_path = self._get_photos_csv_path()
-        if not csv_path.exists():
-            return []
-
         result = []
-        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # 画像ファイルを読み込み
+        for photo, image_path in self.get_queued_photo_files():
+            with open(image_path, 'rb') as img_f:
+                jpg_bytes = img_f.read()
+            result.append((photo, jpg_bytes))
+
+        return result
+
+    def get_queued_photo_files(self) -> List[Tuple[QueuedPhoto, Path]]:
+        """
+        キューに入っている全写真を画像を読み込まずに取得（ストリーミング送信用）
+
+        Returns:
+            List[Tuple[QueuedPhoto, Path]]: (写真データ, 画像ファイルのパス) のリスト（追加順）
+        """
+        return [item for page in self.iter_photo_pages() for item in page]
+
+    def iter_photo_pages(
+        self,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        order: str = 'oldest',
+        skip_parked: bool = False
+    ) -> Iterator[List[Tuple[QueuedPhoto, Path]]]:
+        """
+        キューの写真をページ単位で順に取得（画像は読み込まず、次のページは要求されるまで読まない）
+
+        前回のページの最後の位置から続きを読むため、送信済みの削除や追加が途中で起きても
+        同じ写真を二度返したり読み飛ばしたりしない。
+
+        Args:
+            page_size: 1ページの件数
+            order: 'oldest'（追加順）/ 'newest'（新しい順）
+            skip_parked: 失敗が続いたため保留にした写真を除く（再送用）
+
+        Yields:
+            List[Tuple[QueuedPhoto, Path]]: (写真データ, 画像ファイルのパス) のリスト
+                                            参照モードの写真は元のPNGのパス（消えていても返す）
+        """
+        if order not in PAGE_ORDERS:
+            raise ValueError(f"Unknown order: {order}")
+        compare, direction = PAGE_ORDERS[order]
+        columns = ', '.join(['seq', *self.PHOTO_FIELDS, *self.REFERENCE_FIELDS, 'reencoded', 'attempts'])
+        max_attempts = self.max_attempts if skip_parked else 0
+
+        last_seq = None
+        while True:
+            if last_seq is None:
+                rows = self._execute(
+                    f"SELECT {columns} FROM photos WHERE (? <= 0 OR attempts < ?) "
+                    f"ORDER BY seq {direction} LIMIT ?",
+                    [max_attempts, max_attempts, page_size]
+                )
+            else:
+                rows = self._execute(
+                    f"SELECT {columns} FROM photos WHERE seq {compare} ? AND (? <= 0 OR attempts < ?) "
+                    f"ORDER BY seq {direction} LIMIT ?",
+                    [last_seq, max_attempts, max_attempts, page_size]
+                )
+            if not rows:
+                return
+            last_seq = rows[-1]['seq']
+
+            page = []
+            for row in rows:
+                photo = self._photo_from_row(row)
+                if photo.is_reference:
+                    # 元ファイルの確認は送信時に行う（消えていれば送信側でキューから外す）
+                    page.append((photo, Path(photo.source_path)))
+                    continue
                 image_path = self.images_path / f"{row['id']}.jpg"
                 if not image_path.exists():
                     continue
+                page.append((photo, image_path))
+            if page:
+                yield page
+            if len(rows) < page_size:
+                return
 
-                with open(image_path, 'rb') as img_f:
-                    jpg_bytes = img_f.read()
-
-                photo = QueuedPhoto(
-                    id=row['id'],
-                    filename=row['filename'],
-                    world_id=row['world_id'] or None,
-                    instance_id=row['instance_id'] or None,
-                    visibility=row['visibility'],
-                    taken_at=row['taken_at'],
-                    camera_data=json.loads(row['camera_data']) if row['camera_data'] else None,
-                    created_at=row['created_at']
-                )
-                result.append((photo, jpg_bytes))
+    def iter_reencode_candidates(
+        self,
+        after_seq: int = 0,
+        page_size: int = DEFAULT_PAGE_SIZE
+    ) -> Iterator[Tuple[int, QueuedPhoto, Path]]:
+        """
+        再圧縮できる写真（未再圧縮・参照モード以外）を古い順に取得（部分インデックスで対象だけを読む）
 
-        return result
+        Args:
+            after_seq: この位置より後の写真から読む（前回の続き）
+            page_size: 一度に読み込む件数
+
+        Yields:
+            Tuple[int, QueuedPhoto, Path]: (キュー内の位置, 写真データ, 画像ファイルのパス)
+        """
+        columns = ', '.join(['seq', *self.PHOTO_FIELDS, *self.REFERENCE_FIELDS, 'reencoded', 'attempts'])
+        while True:
+            rows = self._execute(
+                f"SELECT {columns} FROM photos INDEXED BY photos_reencode_candidates "
+                f"WHERE reencoded = 0 AND source_path IS NULL AND seq > ? ORDER BY seq LIMIT ?",
+                [after_seq, page_size]
+            )
+            for row in rows:
+                after_seq = row['seq']
+                image_path = self.images_path / f"{row['id']}.jpg"
+                if image_path.exists():
+                    yield row['seq'], self._photo_from_row(row), image_path
+            if len(rows) < page_size:
+                return
+
+    @staticmethod
+    def _photo_from_row(row: sqlite3.Row) -> QueuedPhoto:
+        return QueuedPhoto(
+            id=row['id'],
+            filename=row['filename'],
+            world_id=row['world_id'] or None,
+            instance_id=row['instance_id'] or None,
+            visibility=row['visibility'],
+            taken_at=row['taken_at'],
+            camera_data=json.loads(row['camera_data']) if row['camera_data'] else None,
+            created_at=row['created_at'],
+            idempotency_key=row['idempotency_key'] or row['id'],
+            attach_to=row['attach_to'] or None,
+            source_path=row['source_path'] or None,
+            source_size=row['source_size'],
+            source_mtime_ns=row['source_mtime_ns'],
+            reencoded=bool(row['reencoded']),
+            attempts=row['attempts']
+        )
 
     def remove_photo(self, queue_id: str):
         """
@@ -177,28 +774,30 @@ class OfflineQueueManager:
         Args:
             queue_id: キューID
         """
-        # 画像ファイルを削除
-        image_path = self.images_path / f"{queue_id}.jpg"
-        if image_path.exists():
-            image_path.unlink()
+        self.remove_photos([queue_id])
 
-        # CSVから削除
-        csv_path = self._get_photos_csv_path()
-        if not csv_path.exists():
-            return
+    def remove_photos(self, queue_ids: List[str]):
+        """
+        複数の写真をまとめてキューから削除（1回のコミット）
 
-        rows = []
-        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = [row for row in reader if row['id'] != queue_id]
+        Args:
+            queue_ids: キューIDのリスト
+        """
+        with self.batch():
+            for queue_id in queue_ids:
+                found = self._conn.execute(
+                    'SELECT size, attempts FROM photos WHERE id = ?', (queue_id,)
+                ).fetchone()
+                if found is None:
+                    continue
+                self._conn.execute('DELETE FROM photos WHERE id = ?', (queue_id,))
+                self._add_counts(photos=-1, size=-found['size'],
+                                 parked_photos=-self._is_parked(found['attempts']))
 
-        if rows:
-            with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=self.PHOTO_FIELDS)
-                writer.writeheader()
-                writer.writerows(rows)
-        else:
-            csv_path.unlink()
+        # 画像ファイル・参照モードのハードリンクを削除（行の削除後なので、途中で落ちても画像が残るだけ）
+        for queue_id in queue_ids:
+            for suffix in ('.jpg', '.png'):
+                (self.images_path / f"{queue_id}{suffix}").unlink(missing_ok=True)
 
     # ========== ワールド参加キュー操作 ==========
 
@@ -206,8 +805,8 @@ class OfflineQueueManager:
         self,
         world_id: str,
         instance_id: str,
-        vrc_user_id: str,
-        vrc_display_name: str
+        vrc_user_id: Optional[str],
+        vrc_display_name: Optional[str]
     ) -> str:
         """
         ワールド参加をキューに追加
@@ -215,60 +814,105 @@ class OfflineQueueManager:
         Args:
             world_id: ワールドID
             instance_id: インスタンスID
-            vrc_user_id: VRChatユーザーID
-            vrc_display_name: VRChat表示名
+            vrc_user_id: VRChatユーザーID（未取得はNone）
+            vrc_display_name: VRChat表示名（未取得はNone）
 
         Returns:
-            str: キューID
+            str: キューID（直前の参加にまとめた場合はそのキューID）
         """
-        queue_id = str(uuid.uuid4())
+        now = datetime.now()
+        with self.batch():
+            # 末尾の参加とだけ比較する（追加のたびにまとめるので、それより前は既にまとめ済み）
+            # 同じインスタンスへのすぐの再参加を短い滞在として消さないよう、重複を先に確認する
+            last = self._last_world_join()
+            if last and not self._is_same_instance(last, world_id, instance_id) and self._is_short_stay(last, now):
+                self._conn.execute('DELETE FROM worlds WHERE id = ?', (last['id'],))
+                self._add_counts(worlds=-1, parked_worlds=-self._is_parked(last['attempts']))
+                self.compaction_counts['short_stays'] += 1
+                last = self._last_world_join()
+            if last and self._is_same_instance(last, world_id, instance_id):
+                # 同じインスタンスへの再参加は1件にまとめる（退出していないことにする）
+                self._conn.execute('UPDATE worlds SET left_at = NULL WHERE id = ?', (last['id'],))
+                self.compaction_counts['duplicates'] += 1
+                return last['id']
 
-        world_data = QueuedWorldJoin(
-            id=queue_id,
-            world_id=world_id,
-            instance_id=instance_id,
-            vrc_user_id=vrc_user_id,
-            vrc_display_name=vrc_display_name,
-            created_at=datetime.now().isoformat()
-        )
+            queue_id = str(uuid.uuid4())
+            world_data = QueuedWorldJoin(
+                id=queue_id,
+                world_id=world_id,
+                instance_id=instance_id,
+                vrc_user_id=vrc_user_id,
+                vrc_display_name=vrc_display_name,
+                created_at=now.isoformat()
+            )
+            row = asdict(world_data)
+            self._conn.execute(
+                f"INSERT INTO worlds ({', '.join(self.WORLD_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(self.WORLD_FIELDS))})",
+                [row[name] for name in self.WORLD_FIELDS]
+            )
+            self._add_counts(worlds=1)
 
-        csv_path = self._get_worlds_csv_path()
-        file_exists = csv_path.exists()
+        return queue_id
 
-        with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.WORLD_FIELDS)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(asdict(world_data))
+    def mark_world_left(self, queue_id: str):
+        """
+        キューに入れたワールド参加の退出時刻を記録（滞在時間の判定に使う）
 
-        return queue_id
+        Args:
+            queue_id: 退出したワールドの参加を追加した時のキューID（queue_world_join の戻り値）
+        """
+        with self.batch():
+            self._conn.execute(
+                'UPDATE worlds SET left_at = ? WHERE id = ? AND left_at IS NULL',
+                (datetime.now().isoformat(), queue_id)
+            )
+
+    @staticmethod
+    def _is_same_instance(join: sqlite3.Row, world_id: str, instance_id: str) -> bool:
+        return (join['world_id'], join['instance_id']) == (world_id, instance_id)
+
+    def _last_world_join(self) -> Optional[sqlite3.Row]:
+        """キュー末尾のワールド参加（主キーの末尾から1件だけ読む）"""
+        rows = self._execute('SELECT id, world_id, instance_id, created_at, left_at, attempts FROM worlds '
+                             'ORDER BY seq DESC LIMIT 1')
+        return rows[0] if rows else None
 
-    def get_queued_world_joins(self) -> List[QueuedWorldJoin]:
+    def _is_short_stay(self, join: sqlite3.Row, now: datetime) -> bool:
         """
-        キューに入っている全ワールド参加を取得
+        報告しなくてよい短い滞在か（退出時刻が無ければ次の参加時刻を退出とみなす）
 
-        Returns:
-            List[QueuedWorldJoin]: ワールド参加データのリスト
+        その参加以降に撮影された写真がある場合は、写真が依存するため残す。
+        （キューに入った日時ではなく撮影日時で比べる。ログの遅れや起動時の取り込みで後からキューに入るため）
         """
-        csv_path = self._get_worlds_csv_path()
-        if not csv_path.exists():
-            return []
+        if self.min_stay_sec <= 0:
+            return False
+        left_at = datetime.fromisoformat(join['left_at']) if join['left_at'] else now
+        if (left_at - datetime.fromisoformat(join['created_at'])).total_seconds() >= self.min_stay_sec:
+            return False
+        taken = self._execute(
+            "SELECT 1 FROM photos WHERE COALESCE(attach_to, '') = '' AND taken_at >= ? LIMIT 1",
+            (join['created_at'],)
+        )
+        return not taken
 
-        result = []
-        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                world = QueuedWorldJoin(
-                    id=row['id'],
-                    world_id=row['world_id'],
-                    instance_id=row['instance_id'],
-                    vrc_user_id=row['vrc_user_id'],
-                    vrc_display_name=row['vrc_display_name'],
-                    created_at=row['created_at']
-                )
-                result.append(world)
+    def get_queued_world_joins(self, skip_parked: bool = False) -> List[QueuedWorldJoin]:
+        """
+        キューに入っている全ワールド参加を取得
 
-        return result
+        Args:
+            skip_parked: 失敗が続いたため保留にした参加を除く（再送用）
+
+        Returns:
+            List[QueuedWorldJoin]: ワールド参加データのリスト（追加順）
+        """
+        max_attempts = self.max_attempts if skip_parked else 0
+        rows = self._execute(
+            f"SELECT {', '.join(self.WORLD_FIELDS)}, attempts FROM worlds "
+            f"WHERE (? <= 0 OR attempts < ?) ORDER BY seq",
+            [max_attempts, max_attempts]
+        )
+        return [QueuedWorldJoin(**{name: row[name] for name in [*self.WORLD_FIELDS, 'attempts']}) for row in rows]
 
     def remove_world_join(self, queue_id: str):
         """
@@ -277,67 +921,107 @@ class OfflineQueueManager:
         Args:
             queue_id: キューID
         """
-        csv_path = self._get_worlds_csv_path()
-        if not csv_path.exists():
-            return
+        self.remove_world_joins([queue_id])
 
-        rows = []
-        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = [row for row in reader if row['id'] != queue_id]
+    def remove_world_joins(self, queue_ids: List[str]):
+        """
+        複数のワールド参加をまとめてキューから削除（1回のコミット）
 
-        if rows:
-            with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=self.WORLD_FIELDS)
-                writer.writeheader()
-                writer.writerows(rows)
-        else:
-            csv_path.unlink()
+        Args:
+            queue_ids: キューIDのリスト
+        """
+        with self.batch():
+            for queue_id in queue_ids:
+                found = self._conn.execute('SELECT attempts FROM worlds WHERE id = ?', (queue_id,)).fetchone()
+                if found is None:
+                    continue
+                self._conn.execute('DELETE FROM worlds WHERE id = ?', (queue_id,))
+                self._add_counts(worlds=-1, parked_worlds=-self._is_parked(found['attempts']))
 
-    # ========== ユーティリティ ==========
+    # ========== 送信失敗の記録 ==========
 
-    def get_queue_counts(self) -> Dict[str, int]:
+    def record_failures(self, item_type: str, queue_ids: List[str], error: str):
         """
-        キューに入っているデータの件数を取得
+        送り直しても成功しない失敗（4xx・形式エラー）の回数とエラーを記録（1回のコミット）
+
+        接続エラー・5xx・遮断中の失敗は呼び出し側で除く（障害が続いただけで保留にしない）。
+        失敗が max_attempts 回に達した項目は保留になり、reset_parked を呼ぶまで再送しない。
+
+        Args:
+            item_type: 'photo' / 'world_join'
+            queue_ids: キューIDのリスト
+            error: エラーメッセージ
+        """
+        table = self.ITEM_TABLES[item_type]
+        with self.batch():
+            self._conn.executemany(
+                f'UPDATE {table} SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                [(error, queue_id) for queue_id in queue_ids]
+            )
+            if self.max_attempts > 0:
+                parked = self._conn.execute(
+                    f"SELECT COUNT(*) FROM {table} WHERE attempts = ? "
+                    f"AND id IN ({', '.join('?' * len(queue_ids))})",
+                    [self.max_attempts, *queue_ids]
+                ).fetchone()[0]
+                if parked:
+                    print(f"Offline queue parked {parked} {item_type} item(s) after {self.max_attempts} failures: {error}")
+                    self._add_counts(**{f'parked_{table}': parked})
+
+    def reset_parked(self) -> int:
+        """
+        保留にした項目の失敗回数を戻して再送の対象にする（手動の再送用）
 
         Returns:
-            Dict[str, int]: {'photos': N, 'worlds': N}
+            int: 再送の対象に戻した件数
         """
-        photos_count = 0
-        worlds_count = 0
+        if self.max_attempts <= 0:
+            return 0
+        with self.batch():
+            photos = self._conn.execute(
+                'UPDATE photos SET attempts = 0 WHERE attempts >= ?', (self.max_attempts,)
+            ).rowcount
+            worlds = self._conn.execute(
+                'UPDATE worlds SET attempts = 0 WHERE attempts >= ?', (self.max_attempts,)
+            ).rowcount
+            self._add_counts(parked_photos=-photos, parked_worlds=-worlds)
+        return photos + worlds
 
-        photos_csv = self._get_photos_csv_path()
-        if photos_csv.exists():
-            with open(photos_csv, 'r', newline='', encoding='utf-8') as f:
-                photos_count = sum(1 for _ in csv.DictReader(f))
+    # ========== ユーティリティ ==========
 
-        worlds_csv = self._get_worlds_csv_path()
-        if worlds_csv.exists():
-            with open(worlds_csv, 'r', newline='', encoding='utf-8') as f:
-                worlds_count = sum(1 for _ in csv.DictReader(f))
+    def get_queue_counts(self) -> Dict[str, int]:
+        """
+        キューに入っているデータの件数を取得（ディスクは読まない）
 
-        return {'photos': photos_count, 'worlds': worlds_count}
+        Returns:
+            Dict[str, int]: {'photos': N, 'worlds': N, 'bytes': 画像の合計サイズ,
+                             'disk_bytes': ディスク使用量の見積もり,
+                             'parked_photos': N, 'parked_worlds': N（保留中、photos / worlds に含まれる）}
+        """
+        counts = self._counts
+        return {'photos': counts['photos'], 'worlds': counts['worlds'], 'bytes': counts['bytes'],
+                'disk_bytes': self.disk_usage,
+                'parked_photos': counts['parked_photos'], 'parked_worlds': counts['parked_worlds']}
 
     def has_pending_data(self) -> bool:
         """
-        送信待ちデータがあるか確認
+        送信待ちデータがあるか確認（保留中の項目は含めない）
 
         Returns:
             bool: 送信待ちデータがあればTrue
         """
-        counts = self.get_queue_counts()
-        return counts['photos'] > 0 or counts['worlds'] > 0
+        counts = self._counts
+        return counts['photos'] > counts['parked_photos'] or counts['worlds'] > counts['parked_worlds']
 
     def clear_all(self):
         """全キューをクリア"""
-        # CSVファイルを削除
-        photos_csv = self._get_photos_csv_path()
-        if photos_csv.exists():
-            photos_csv.unlink()
-
-        worlds_csv = self._get_worlds_csv_path()
-        if worlds_csv.exists():
-            worlds_csv.unlink()
+        with self.batch():
+            self._conn.execute('DELETE FROM photos')
+            self._conn.execute('DELETE FROM worlds')
+            self._add_counts(photos=-self._counts['photos'], worlds=-self._counts['worlds'],
+                             size=-self._counts['bytes'],
+                             parked_photos=-self._counts['parked_photos'],
+                             parked_worlds=-self._counts['parked_worlds'])
 
         # 画像フォルダをクリア
         if self.images_path.exists():
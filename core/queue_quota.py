@@ -0,0 +1,123 @@
+"""
+Queue Quota
+オフラインキューの容量上限と、上限に達した時の退避ポリシー
+長時間サーバーに接続できなくても temp/images がディスクを使い切らないようにする
+"""
+
+from typing import Callable, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from core.offline_queue import OfflineQueueManager
+
+
+# 1件あたりのメタデータ（データベースの行・インデックス）の見積もりサイズ
+ROW_OVERHEAD_BYTES = 512
+# 退避対象を探すときに一度に読み込む件数
+EVICTION_PAGE_SIZE = 100
+
+
+class QueueFullError(Exception):
+    """容量上限に達していて、新しいデータをキューに入れられない"""
+
+
+class EvictionPolicy:
+    """
+    容量上限に達した時の退避ポリシー（基底クラス）
+
+    make_roomで空きを作り、新しいデータを受け入れられるかを返す。
+    """
+
+    name = 'refuse'
+
+    def make_room(self, queue: 'OfflineQueueManager', incoming_bytes: int, incoming_items: int) -> bool:
+        """
+        新しいデータのための空きを作る
+
+        Args:
+            queue: 対象のキュー
+            incoming_bytes: 追加するデータのディスク使用量
+            incoming_items: 追加する写真の枚数
+
+        Returns:
+            bool: 受け入れられる場合はTrue
+        """
+        return queue.has_room(incoming_bytes, incoming_items)
+
+
+class RefuseNewPolicy(EvictionPolicy):
+    """新しいデータを受け付けない（キュー内の写真はそのまま残す）"""
+
+    name = 'refuse'
+
+
+class OldestFirstPolicy(EvictionPolicy):
+    """古い写真から削除して空きを作る"""
+
+    name = 'oldest'
+
+    def make_room(self, queue: 'OfflineQueueManager', incoming_bytes: int, incoming_items: int) -> bool:
+        while not queue.has_room(incoming_bytes, incoming_items):
+            oldest = next(queue.iter_photo_pages(page_size=1), None)
+            if not oldest:
+                break
+            queue.evict_photo(oldest[0][0], self.name)
+        return queue.has_room(incoming_bytes, incoming_items)
+
+
+class ReencodePolicy(EvictionPolicy):
+    """
+    古い写真から低画質で再圧縮して空きを作る
+
+    再圧縮済みの写真は対象外。全て再圧縮しても足りなければfallbackに任せる。
+    確認済みの位置を覚えておき、次回はその続きから探す（再圧縮できなかった写真を毎回試さない）。
+    キューへの追加と同じく別スレッドから呼ばれる（再圧縮中も画面を止めない）。
+    """
+
+    name = 'reencode'
+
+    def __init__(self, reencode: Callable[[bytes], bytes], fallback: Optional[EvictionPolicy] = None):
+        """
+        初期化
+
+        Args:
+            reencode: JPGバイトを受け取り、再圧縮したJPGバイトを返す関数
+            fallback: 再圧縮で足りない場合のポリシー（デフォルト: 受け付けない）
+        """
+        self.reencode = reencode
+        self.fallback = fallback or RefuseNewPolicy()
+        # 確認済みのキュー内の位置
+        self._after_seq = 0
+
+    def make_room(self, queue: 'OfflineQueueManager', incoming_bytes: int, incoming_items: int) -> bool:
+        if queue.fits_item_quota(incoming_items):
+            for seq, photo, image_path in queue.iter_reencode_candidates(self._after_seq, EVICTION_PAGE_SIZE):
+                if queue.has_room(incoming_bytes, incoming_items):
+                    return True
+                self._after_seq = seq
+                try:
+                    smaller = self.reencode(image_path.read_bytes())
+                except Exception as e:
+                    print(f"Re-encode failed ({photo.filename}): {e}")
+                    continue
+                queue.replace_photo_image(photo, smaller, self.name)
+        if queue.has_room(incoming_bytes, incoming_items):
+            return True
+        return self.fallback.make_room(queue, incoming_bytes, incoming_items)
+
+
+def create_eviction_policy(name: str, reencode: Optional[Callable[[bytes], bytes]] = None) -> EvictionPolicy:
+    """
+    設定値からポリシーを作成
+
+    Args:
+        name: 'oldest' / 'reencode' / 'refuse'
+        reencode: 'reencode'で使う再圧縮関数
+
+    Returns:
+        EvictionPolicy: ポリシー（不明な名前は'refuse'）
+    """
+    if name == OldestFirstPolicy.name:
+        return OldestFirstPolicy()
+    if name == ReencodePolicy.name and reencode is not None:
+        return ReencodePolicy(reencode)
+    return RefuseNewPolicy()
@@ -0,0 +1,209 @@
+"""
+Upload Scheduler
+アップロードの並列実行管理（同時実行数の上限付き）
+"""
+
+import asyncio
+import itertools
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class UploadState(Enum):
+    """アップロードジョブの状態"""
+    PENDING = 'pending'
+    IN_FLIGHT = 'in_flight'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+class UploadJob:
+    """アップロードジョブ"""
+
+    def __init__(self, job_id: str, factory: Callable[[], Awaitable[Any]], priority: int, group: Optional[str]):
+        self.id = job_id
+        self.factory = factory      # 実行時にコルーチンを生成する関数
+        self.priority = priority    # 小さいほど優先
+        self.group = group          # まとめてキャンセルするためのグループ名
+        self.state = UploadState.PENDING
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._done = asyncio.get_event_loop().create_future()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in (UploadState.DONE, UploadState.FAILED, UploadState.CANCELLED)
+
+    async def wait(self) -> Any:
+        """
+        完了を待機
+
+        Returns:
+            Any: 実行結果
+
+        Raises:
+            Exception: 実行時の例外（キャンセル時はasyncio.CancelledError）
+        """
+        return await asyncio.shield(self._done)
+
+    def _finish(self, state: UploadState, result: Any = None, error: Optional[BaseException] = None):
+        self.state = state
+        self.result = result
+        self.error = error
+        if self._done.done():
+            return
+        if state == UploadState.DONE:
+            self._done.set_result(result)
+        elif state == UploadState.CANCELLED:
+            self._done.cancel()
+        else:
+            self._done.set_exception(error or Exception('Upload failed'))
+            # 待機されなかったジョブの例外で警告が出ないようにする
+            self._done.exception()
+
+
+class UploadScheduler:
+    """
+    アップロードスケジューラ
+
+    ライブ撮影分とオフラインキュー再送分を同じワーカーで処理し、
+    同時実行数をconcurrencyまでに制限する。
+    イベントループのスレッドからのみ使用すること。
+    """
+
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = max(1, concurrency)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._jobs: Dict[str, UploadJob] = {}
+        self._seq = itertools.count()
+        self._callbacks: List[Callable[[UploadJob], None]] = []
+
+    def on_state_changed(self, callback: Callable[[UploadJob], None]):
+        """ジョブ状態変更コールバックを登録"""
+        self._callbacks.append(callback)
+
+    def _notify(self, job: UploadJob):
+        for callback in self._callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Upload scheduler callback error: {e}")
+
+    def _ensure_workers(self):
+        """ワーカーを起動（初回submit時）"""
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.concurrency:
+            self._workers.append(asyncio.ensure_future(self._worker()))
+
+    def submit(
+        self,
+        job_id: str,
+        factory: Callable[[], Awaitable[Any]],
+        priority: int = 0,
+        group: Optional[str] = None
+    ) -> UploadJob:
+        """
+        ジョブを追加
+
+        Args:
+            job_id: ジョブID（同じIDが未完了なら既存ジョブを返す）
+            factory: 実行するコルーチンを生成する関数
+            priority: 優先度（小さいほど先に実行）
+            group: グループ名（cancel_groupでまとめてキャンセル）
+
+        Returns:
+            UploadJob: 追加されたジョブ
+        """
+        existing = self._jobs.get(job_id)
+        if existing and not existing.is_finished:
+            return existing
+
+        self._ensure_workers()
+        job = UploadJob(job_id, factory, priority, group)
+        self._jobs[job_id] = job
+        self._queue.put_nowait((priority, next(self._seq), job))
+        self._notify(job)
+        return job
+
+    def cancel_group(self, group: str) -> int:
+        """
+        グループ内の未実行ジョブをキャンセル
+
+        Returns:
+            int: キャンセルしたジョブ数
+        """
+        count = 0
+        for job in list(self._jobs.values()):
+            if job.group == group and job.state == UploadState.PENDING:
+                self._finish(job, UploadState.CANCELLED)
+                count += 1
+        return count
+
+    def set_concurrency(self, concurrency: int):
+        """同時実行数を変更（減らした場合は実行中ジョブの完了後に反映）"""
+        self.concurrency = max(1, concurrency)
+        if self._queue is not None:
+            self._ensure_workers()
+
+    async def _worker(self):
+        """ワーカー（キューからジョブを取り出して実行）"""
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                if job.state != UploadState.PENDING:
+                    continue
+
+                job.state = UploadState.IN_FLIGHT
+                self._notify(job)
+                try:
+                    result = await job.factory()
+                    self._finish(job, UploadState.DONE, result=result)
+                except asyncio.CancelledError:
+                    self._finish(job, UploadState.CANCELLED)
+                    raise
+                except Exception as e:
+                    self._finish(job, UploadState.FAILED, error=e)
+            finally:
+                self._queue.task_done()
+
+            # 同時実行数が減らされた場合は余剰ワーカーを終了
+            if len(self._workers) > self.concurrency:
+                current = asyncio.current_task()
+                if current in self._workers:
+                    self._workers.remove(current)
+                return
+
+    def _finish(self, job: UploadJob, state: UploadState, result: Any = None,
+                error: Optional[BaseException] = None):
+        job._finish(state, result, error)
+        # 完了したジョブは保持しない
+        if self._jobs.get(job.id) is job:
+            del self._jobs[job.id]
+        self._notify(job)
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        未完了ジョブの状態別件数
+
+        Returns:
+            Dict[str, int]: {'pending': N, 'in_flight': N}
+        """
+        counts = {'pending': 0, 'in_flight': 0}
+        for job in self._jobs.values():
+            if job.state.value in counts:
+                counts[job.state.value] += 1
+        return counts
+
+    async def close(self):
+        """ワーカーを停止"""
+        for job in list(self._jobs.values()):
+            if job.state == UploadState.PENDING:
+                self._finish(job, UploadState.CANCELLED)
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
@@ -3,26 +3,356 @@ Uploader Client
 サーバーとの通信クライアント（同期版）
 """
 
+import json
+import time
+import asyncio
+import random
 import httpx
-from datetime import datetime
-from typing import Optional, Dict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Dict, List, Union
+
+from core.circuit_breaker import CircuitBreaker, CircuitOpenError
+from core.metrics import RequestMetrics, RequestTrace
+from core.bandwidth import TokenBucket
+from core.multipart import MultipartStream, ProgressCallback
+
+try:
+    import h2  # noqa: F401  httpxのHTTP/2サポートに必要
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# 再試行対象のエラー種別
+RETRYABLE_ERROR_KINDS = {'connection', 'timeout', 'server', 'rate_limited'}
+# サーキットブレーカーの失敗として数えるエラー種別（429はサーバー到達済みのため除外）
+BREAKER_FAILURE_KINDS = {'connection', 'timeout', 'server'}
+# 送り直しても成功しない（項目そのものが拒否された）エラー種別
+PERMANENT_ERROR_KINDS = {'client'}
+# 認証切れ（項目の問題ではないため送り直せば成功する）
+AUTH_ERROR_STATUS = {401, 403}
+# バッチAPI非対応と判断するステータス
+BATCH_UNSUPPORTED_STATUS = {404, 405, 501}
+# 413応答時に縮小するバッチサイズの下限
+MIN_BATCH_BYTES = 1024 * 1024
+# 重複防止キーが登録済みの場合のステータス
+ALREADY_EXISTS_STATUS = 409
+# 登録済み確認で1リクエストに含めるキーの上限
+EXISTS_CHECK_MAX_KEYS = 500
+
+
+def classify_status(status_code: int) -> Optional[str]:
+    """
+    HTTPステータスをエラー種別に分類
+
+    Returns:
+        Optional[str]: 'rate_limited' / 'server' / 'auth' / 'client'、成功ならNone
+    """
+    if status_code == 429:
+        return 'rate_limited'
+    if status_code >= 500:
+        return 'server'
+    if status_code in AUTH_ERROR_STATUS:
+        return 'auth'
+    if status_code >= 400:
+        return 'client'
+    return None
+
+
+def classify_exception(error: Exception) -> str:
+    """
+    例外をエラー種別に分類
+
+    Returns:
+        str: 'timeout' / 'connection' / 'rate_limited' / 'server' / 'auth' / 'client' / 'circuit_open' / 'unknown'
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return classify_status(error.response.status_code) or 'unknown'
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, httpx.TimeoutException):
+        return 'timeout'
+    if isinstance(error, httpx.TransportError):
+        return 'connection'
+    return 'unknown'
+
+
+def is_permanent_error(result: Dict) -> bool:
+    """
+    送り直しても成功しないエラー応答か（4xx、またはバッチ内でサーバーが項目を個別に拒否した）
+
+    接続エラー・タイムアウト・5xx・429・遮断中（circuit_open）は障害が直れば送れるため含めない。
+    """
+    return result.get('error_kind', 'client') in PERMANENT_ERROR_KINDS
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-Afterヘッダー（秒数またはHTTP日付）を待機秒数に変換"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def split_progress(progress: Optional[ProgressCallback], count: int) -> List[Optional[ProgressCallback]]:
+    """
+    1つの進捗コールバックを複数リクエストに分配（合計値で通知）
+
+    Args:
+        progress: 元の進捗コールバック
+        count: リクエスト数
+
+    Returns:
+        List: リクエストごとの進捗コールバック
+    """
+    if progress is None:
+        return [None] * count
+
+    sent = [0] * count
+    totals = [0] * count
+
+    def make(index: int) -> ProgressCallback:
+        def callback(done: int, total: int):
+            sent[index] = done
+            totals[index] = total
+            progress(sum(sent), sum(totals))
+        return callback
+
+    return [make(i) for i in range(count)]
+
+
+@dataclass
+class RetryPolicy:
+    """再試行ポリシー（指数バックオフ＋ジッター）"""
+    max_attempts: int = 4       # 初回を含む試行回数
+    base_delay: float = 0.5     # 初回の待機上限（秒）
+    max_delay: float = 30.0     # 待機上限（秒）
+    max_retry_after: float = 60.0  # これより長いRetry-Afterは待たずに諦める
+
+    def backoff(self, attempt: int) -> float:
+        """attempt回目（1始まり）の失敗後の待機秒数（フルジッター）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
 
 
 class UploaderClient:
     """アップロードクライアント（非同期版）"""
 
-    def __init__(self, base_url: str, token: Optional[str] = None):
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        http2: bool = True,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        write_timeout: float = 60.0,
+        pool_timeout: float = 10.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker_failure_threshold: int = 1,
+        probe_base_delay: float = 5.0,
+        probe_max_delay: float = 300.0,
+        batch_max_bytes: int = 16 * 1024 * 1024,
+        batch_max_items: int = 20,
+        event_batch_max_items: int = 200,
+        metrics_window_minutes: int = 60,
+        upload_limit_bps: float = 0
+    ):
         self.base_url = base_url.rstrip('/')
         self.token = token
         self._client: Optional[httpx.AsyncClient] = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 遮断中のプローブにはヘルスチェックを使用
+        self.breaker = CircuitBreaker(
+            probe=self.health_check,
+            failure_threshold=breaker_failure_threshold,
+            probe_base_delay=probe_base_delay,
+            probe_max_delay=probe_max_delay
+        )
+
+        # バッチ送信設定（サーバーの対応状況は初回送信時に判定: None=未確認）
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_max_items = batch_max_items
+        self.event_batch_max_items = event_batch_max_items
+        self._batch_support: Dict[str, Optional[bool]] = {
+            'photos': None, 'events': None, 'exists': None, 'attach': None
+        }
+
+        # エンドポイントごとの通信メトリクス
+        self.metrics = RequestMetrics(window_minutes=metrics_window_minutes)
+
+        # 写真送信の帯域制限（全リクエスト共通、0=無制限）
+        self.bandwidth = TokenBucket(upload_limit_bps)
+
+        # 接続設定
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout
+        )
+
+        if http2 and not HTTP2_AVAILABLE:
+            print("h2がインストールされていないためHTTP/1.1で通信します。pip install httpx[http2] を実行してください。")
 
     @property
     def client(self) -> httpx.AsyncClient:
         """HTTPクライアントを取得（遅延初期化）"""
         if self._client is None:
-            self._client = httpx.AsyncClient(timeout=60.0)
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout
+            )
         return self._client
 
+    async def warm_up(self, connections: int = 1) -> bool:
+        """
+        接続を事前に確立（DNS解決・TLSハンドシェイクを済ませておく）
+
+        Args:
+            connections: 確立する接続数（HTTP/2では1接続で多重化されるため1で十分）
+
+        Returns:
+            bool: サーバーに到達できればTrue
+        """
+        count = 1 if self.http2 else max(1, min(connections, self.limits.max_keepalive_connections or 1))
+        results = await asyncio.gather(
+            *(self.health_check() for _ in range(count)),
+            return_exceptions=True
+        )
+        return any(result is True for result in results)
+
+    async def _send(self, method: str, url: str, endpoint: Optional[str] = None, optional: bool = False,
+                    **kwargs) -> httpx.Response:
+        """
+        リクエストを送信（一時的なエラーは再試行）
+
+        接続エラー・タイムアウト・5xx・429は指数バックオフ＋ジッターで再試行し、
+        Retry-Afterがあればそれに従う。4xxはそのまま返す。
+        結果はサーキットブレーカーに記録し、遮断中は送信せずに失敗させる。
+        所要時間・サイズ・ステータス・再試行回数はmetricsに記録する。
+
+        Args:
+            method: HTTPメソッド
+            url: URL
+            endpoint: メトリクスの集計キー（省略時は "メソッド パス"、IDを含むパスは指定する）
+            optional: 失敗しても送信を続けられる補助的なリクエスト（再試行せず、サーキットブレーカーに記録しない）
+            **kwargs: httpxに渡す引数
+
+        Returns:
+            httpx.Response: 最後のレスポンス
+
+        Raises:
+            httpx.TransportError: 再試行しても接続できなかった場合
+            CircuitOpenError: 遮断中の場合
+        """
+        if not self.breaker.allows_requests:
+            raise CircuitOpenError('サーバー障害のため送信を停止中')
+
+        policy = self.retry_policy
+        max_attempts = 1 if optional else policy.max_attempts
+        record_breaker = not optional
+        endpoint = endpoint or f"{method} {httpx.URL(url).path}"
+        started = time.perf_counter()
+        attempt = 0
+        trace = None
+        status = 'error'
+        request_bytes = None
+        try:
+            while True:
+                attempt += 1
+                retry_after = None
+                trace = RequestTrace()
+                try:
+                    response = await self.client.request(method, url, extensions={'trace': trace}, **kwargs)
+                    status = str(response.status_code)
+                    request_bytes = int(response.request.headers.get('Content-Length', 0))
+                    kind = classify_status(response.status_code)
+                    if kind not in RETRYABLE_ERROR_KINDS:
+                        if record_breaker:
+                            self.breaker.record_success()
+                        return response
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    reason = f"HTTP {response.status_code}"
+                    if attempt >= max_attempts:
+                        if record_breaker and kind in BREAKER_FAILURE_KINDS:
+                            self.breaker.record_failure()
+                        return response
+                except httpx.TransportError as e:
+                    kind = classify_exception(e)
+                    status = kind
+                    reason = f"{kind}: {e}"
+                    if attempt >= max_attempts:
+                        if record_breaker:
+                            self.breaker.record_failure()
+                        raise
+
+                if retry_after is not None:
+                    if retry_after > policy.max_retry_after:
+                        # 長時間の待機指示は再試行せず呼び出し元に返す
+                        return response
+                    delay = retry_after
+                else:
+                    delay = policy.backoff(attempt)
+
+                print(f"Request retry {attempt}/{policy.max_attempts - 1} in {delay:.2f}s ({method} {url}: {reason})")
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
+        finally:
+            # 再試行の待機も含めた全体時間と、最後の送信の接続時間・TTFBを記録
+            self.metrics.record(
+                endpoint,
+                status,
+                (time.perf_counter() - started) * 1000,
+                connect_ms=trace.connect_ms if trace else None,
+                ttfb_ms=trace.ttfb_ms if trace else None,
+                request_bytes=request_bytes,
+                retries=attempt - 1
+            )
+
+    def _error_result(self, error: Exception) -> Dict:
+        """例外をエラーレスポンスに変換（error_kindに種別を付与）"""
+        kind = classify_exception(error)
+        if isinstance(error, httpx.HTTPStatusError):
+            try:
+                data = error.response.json()
+                if isinstance(data, dict):
+                    data.setdefault('status', 'error')
+                    data.setdefault('error_kind', kind)
+                    return data
+            except Exception:
+                pass
+        return {'status': 'error', 'message': str(error), 'error_kind': kind}
+
+    def set_upload_limit(self, bytes_per_sec: float):
+        """
+        写真送信の帯域上限を変更（送信中のリクエストにも反映）
+
+        Args:
+            bytes_per_sec: 上限（バイト/秒、0は無制限）
+        """
+        self.bandwidth.set_rate(bytes_per_sec)
+
     @property
     def headers(self) -> Dict[str, str]:
         """リクエストヘッダー"""
@@ -43,7 +373,8 @@ class UploaderClient:
             Dict: レスポンス
         """
         try:
-            response = await self.client.post(
+            response = await self._send(
+                'POST',
                 f'{self.base_url}/vrc/api/auth/login',
                 json={'username': username, 'password': password}
             )
@@ -54,13 +385,8 @@ class UploaderClient:
                 self.token = data['data']['token']
 
             return data
-        except httpx.HTTPStatusError as e:
-            try:
-                return e.response.json()
-            except Exception:
-                return {'status': 'error', 'message': str(e)}
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return self._error_result(e)
 
     async def register(self, username: str, password: str) -> Dict:
         """
@@ -74,7 +400,8 @@ class UploaderClient:
             Dict: レスポンス
         """
         try:
-            response = await self.client.post(
+            response = await self._send(
+                'POST',
                 f'{self.base_url}/vrc/api/auth/register',
                 json={'username': username, 'password': password}
             )
@@ -85,13 +412,8 @@ class UploaderClient:
                 self.token = data['data']['token']
 
             return data
-        except httpx.HTTPStatusError as e:
-            try:
-                return e.response.json()
-            except Exception:
-                return {'status': 'error', 'message': str(e)}
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return self._error_result(e)
 
     async def upload_photo(
         self,
@@ -101,7 +423,10 @@ class UploaderClient:
         instance_id: Optional[str] = None,
         taken_at: Optional[datetime] = None,
         visibility: str = 'self',
-        camera_data: Optional[Dict] = None
+        camera_data: Optional[Dict] = None,
+        idempotency_key: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+        preview: bool = False
     ) -> Dict:
         """
         写真をアップロード
@@ -114,41 +439,400 @@ class UploaderClient:
             taken_at: 撮影日時
             visibility: 公開範囲
             camera_data: カメラデータ
+            idempotency_key: 重複防止キー（再試行・再送しても同じ写真は1枚として扱われる）
+            progress: 送信進捗コールバック (送信済み, 合計)
+            preview: プレビュー画像として登録（後からattach_full_resolutionで差し替える）
 
         Returns:
             Dict: レスポンス
         """
+        return await self._post_photo(jpg_bytes, filename, world_id, instance_id,
+                                      taken_at, visibility, camera_data, idempotency_key, progress,
+                                      preview=preview)
+
+    async def upload_photo_file(
+        self,
+        jpg_path: Union[str, Path],
+        filename: str,
+        world_id: Optional[str] = None,
+        instance_id: Optional[str] = None,
+        taken_at: Optional[datetime] = None,
+        visibility: str = 'self',
+        camera_data: Optional[Dict] = None,
+        idempotency_key: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> Dict:
+        """
+        ディスク上の写真をアップロード（全体をメモリに読み込まず少しずつ送信）
+
+        Args:
+            jpg_path: JPGファイルのパス
+            filename: ファイル名
+            world_id: ワールドID
+            instance_id: インスタンスID
+            taken_at: 撮影日時
+            visibility: 公開範囲
+            camera_data: カメラデータ
+            idempotency_key: 重複防止キー（再試行・再送しても同じ写真は1枚として扱われる）
+            progress: 送信進捗コールバック (送信済み, 合計)
+
+        Returns:
+            Dict: レスポンス
+        """
+        return await self._post_photo(Path(jpg_path), filename, world_id, instance_id,
+                                      taken_at, visibility, camera_data, idempotency_key, progress)
+
+    async def _post_photo(
+        self,
+        source: Union[bytes, Path],
+        filename: str,
+        world_id: Optional[str],
+        instance_id: Optional[str],
+        taken_at: Optional[datetime],
+        visibility: str,
+        camera_data: Optional[Dict],
+        idempotency_key: Optional[str],
+        progress: Optional[ProgressCallback],
+        preview: bool = False
+    ) -> Dict:
+        """写真1枚をmultipartで送信（登録済みの応答は成功として返す）"""
         try:
-            files = {'image': (filename, jpg_bytes, 'image/jpeg')}
-            data = {
-                'visibility': visibility,
-                'taken_at': (taken_at or datetime.utcnow()).isoformat() + 'Z'
-            }
-
-            if world_id:
-                data['world_id'] = world_id
-            if instance_id:
-                data['instance_id'] = instance_id
-            if camera_data:
-                for key, value in camera_data.items():
-                    if value is not None:
-                        data[key] = str(value)
-
-            response = await self.client.post(
+            body = MultipartStream(progress, limiter=self.bandwidth)
+            body.add_fields(self._photo_form_fields(world_id, instance_id, taken_at, visibility, camera_data))
+            if preview:
+                body.add_field('preview', 'true')
+            body.add_file('image', filename, source)
+
+            headers = {**self.headers, **body.headers}
+            if idempotency_key:
+                # 全ての再試行で同じキーを送る
+                headers['Idempotency-Key'] = idempotency_key
+
+            response = await self._send(
+                'POST',
                 f'{self.base_url}/vrc/api/photos/upload',
-                headers=self.headers,
-                files=files,
-                data=data
+                headers=headers,
+                content=body
             )
+            if response.status_code == ALREADY_EXISTS_STATUS:
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {}
+                return self._already_exists_result(data)
             response.raise_for_status()
             return response.json()
-        except httpx.HTTPStatusError as e:
+        except Exception as e:
+            return self._error_result(e)
+
+    async def attach_full_resolution(
+        self,
+        photo_uuid: str,
+        source: Union[bytes, str, Path],
+        filename: str,
+        idempotency_key: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> Dict:
+        """
+        プレビューとして登録済みの写真にフル解像度の画像を添付
+
+        Args:
+            photo_uuid: プレビュー登録時の写真ID
+            source: JPG画像データ、またはJPGファイルのパス
+            filename: ファイル名
+            idempotency_key: 重複防止キー
+            progress: 送信進捗コールバック (送信済み, 合計)
+
+        Returns:
+            Dict: レスポンス（添付済みの場合も成功）
+        """
+        try:
+            body = MultipartStream(progress, limiter=self.bandwidth)
+            body.add_file('image', filename, source if isinstance(source, bytes) else Path(source))
+
+            headers = {**self.headers, **body.headers}
+            if idempotency_key:
+                headers['Idempotency-Key'] = idempotency_key
+
+            response = await self._send(
+                'PUT',
+                f'{self.base_url}/vrc/api/photos/{photo_uuid}/full',
+                endpoint='PUT /vrc/api/photos/{photo_uuid}/full',
+                headers=headers,
+                content=body
+            )
+            if response.status_code in (405, 501):
+                print("サーバーがフル解像度の添付に非対応です")
+                self._batch_support['attach'] = False
+                return {'status': 'error', 'message': 'Full resolution attach is not supported',
+                        'error_kind': 'unsupported'}
+            if response.status_code == ALREADY_EXISTS_STATUS:
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {}
+                return self._already_exists_result(data)
+            response.raise_for_status()
+            self._batch_support['attach'] = True
+            return response.json()
+        except Exception as e:
+            return self._error_result(e)
+
+    @property
+    def supports_full_attach(self) -> Optional[bool]:
+        """フル解像度の添付に対応しているか（None=未確認）"""
+        return self._batch_support['attach']
+
+    def _already_exists_result(self, result: Dict) -> Dict:
+        """「登録済み」の応答を成功に変換（data.duplicate=True）"""
+        return {'status': 'success', 'data': dict(result.get('data') or {}, duplicate=True)}
+
+    async def check_existing_photos(self, keys: List[str]) -> set:
+        """
+        サーバーに登録済みの重複防止キーを問い合わせ
+
+        非対応サーバーや通信エラーの場合は空集合を返す（全て送信する）。
+
+        Args:
+            keys: 重複防止キーのリスト
+
+        Returns:
+            set: 登録済みのキー
+        """
+        existing = set()
+        if self._batch_support['exists'] is False:
+            return existing
+
+        for start in range(0, len(keys), EXISTS_CHECK_MAX_KEYS):
+            chunk = keys[start:start + EXISTS_CHECK_MAX_KEYS]
             try:
-                return e.response.json()
-            except Exception:
-                return {'status': 'error', 'message': str(e)}
+                # 確認できなくても全て送れば済むため、失敗をオフライン判定に数えない
+                response = await self._send(
+                    'POST',
+                    f'{self.base_url}/vrc/api/photos/exists',
+                    optional=True,
+                    headers=self.headers,
+                    json={'idempotency_keys': chunk}
+                )
+                if response.status_code in BATCH_UNSUPPORTED_STATUS:
+                    print("サーバーが登録済み確認に非対応のため確認せずに送信します")
+                    self._batch_support['exists'] = False
+                    return existing
+                response.raise_for_status()
+                self._batch_support['exists'] = True
+                existing.update(response.json().get('data', {}).get('existing', []))
+            except Exception as e:
+                print(f"Existing photo check failed: {e}")
+                break
+        return existing
+
+    async def _upload_photo_item(self, item: Dict, progress: Optional[ProgressCallback] = None) -> Dict:
+        """バッチ用の辞書（jpg_bytes または jpg_path）から1枚アップロード"""
+        fields = {k: v for k, v in item.items() if k not in ('jpg_bytes', 'jpg_path')}
+        if 'jpg_path' in item:
+            return await self.upload_photo_file(item['jpg_path'], progress=progress, **fields)
+        return await self.upload_photo(item['jpg_bytes'], progress=progress, **fields)
+
+    def _photo_form_fields(
+        self,
+        world_id: Optional[str] = None,
+        instance_id: Optional[str] = None,
+        taken_at: Optional[datetime] = None,
+        visibility: str = 'self',
+        camera_data: Optional[Dict] = None
+    ) -> Dict[str, str]:
+        """写真アップロードのフォーム項目を作成"""
+        data = {
+            'visibility': visibility,
+            'taken_at': (taken_at or datetime.utcnow()).isoformat() + 'Z'
+        }
+
+        if world_id:
+            data['world_id'] = world_id
+        if instance_id:
+            data['instance_id'] = instance_id
+        if camera_data:
+            for key, value in camera_data.items():
+                if value is not None:
+                    data[key] = str(value)
+        return data
+
+    def plan_batches(self, sizes: List[int]) -> List[List[int]]:
+        """
+        送信サイズに応じてバッチに分割
+
+        Args:
+            sizes: 各写真のバイト数
+
+        Returns:
+            List[List[int]]: バッチごとのindexのリスト（batch_max_bytes / batch_max_items以内）
+        """
+        if self._batch_support['photos'] is False:
+            return [[i] for i in range(len(sizes))]
+
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_bytes = 0
+        for i, size in enumerate(sizes):
+            if current and (current_bytes + size > self.batch_max_bytes or len(current) >= self.batch_max_items):
+                batches.append(current)
+                current, current_bytes = [], 0
+            current.append(i)
+            current_bytes += size
+        if current:
+            batches.append(current)
+        return batches
+
+    async def upload_photos_batch(
+        self,
+        items: List[Dict],
+        progress: Optional[ProgressCallback] = None
+    ) -> List[Dict]:
+        """
+        複数の写真をまとめてアップロード
+
+        サーバーがバッチAPIに対応していなければ1件ずつ送信する。
+        413応答の場合はバッチサイズを縮小して分割送信する。
+
+        Args:
+            items: upload_photoの引数（jpg_bytes, filename, world_id, ...）の辞書のリスト
+                   jpg_bytesの代わりにjpg_pathを指定するとディスクから少しずつ送信する
+            progress: 送信進捗コールバック (送信済み, 合計)
+
+        Returns:
+            List[Dict]: itemsと同じ順の各写真のレスポンス
+        """
+        if not items:
+            return []
+
+        if len(items) == 1 or self._batch_support['photos'] is False:
+            progresses = split_progress(progress, len(items))
+            return list(await asyncio.gather(
+                *(self._upload_photo_item(item, p) for item, p in zip(items, progresses))
+            ))
+
+        try:
+            body = MultipartStream(progress, limiter=self.bandwidth)
+            metadata = [
+                dict(
+                    self._photo_form_fields(
+                        item.get('world_id'),
+                        item.get('instance_id'),
+                        item.get('taken_at'),
+                        item.get('visibility', 'self'),
+                        item.get('camera_data')
+                    ),
+                    filename=item['filename'],
+                    **({'idempotency_key': item['idempotency_key']} if item.get('idempotency_key') else {})
+                )
+                for item in items
+            ]
+
+            body.add_field('metadata', json.dumps(metadata))
+            for item in items:
+                body.add_file('images', item['filename'],
+                              Path(item['jpg_path']) if 'jpg_path' in item else item['jpg_bytes'])
+
+            response = await self._send(
+                'POST',
+                f'{self.base_url}/vrc/api/photos/upload/batch',
+                headers={**self.headers, **body.headers},
+                content=body
+            )
+
+            if response.status_code in BATCH_UNSUPPORTED_STATUS:
+                print("サーバーが写真のバッチアップロードに非対応のため1件ずつ送信します")
+                self._batch_support['photos'] = False
+                return await self.upload_photos_batch(items, progress)
+
+            if response.status_code == 413:
+                # 大きすぎる - 以降のバッチを小さくして分割送信
+                self.batch_max_bytes = max(MIN_BATCH_BYTES, self.batch_max_bytes // 2)
+                half = len(items) // 2
+                first, second = split_progress(progress, 2)
+                return (await self.upload_photos_batch(items[:half], first)
+                        + await self.upload_photos_batch(items[half:], second))
+
+            response.raise_for_status()
+            self._batch_support['photos'] = True
+            results = response.json().get('data', {}).get('results', [])
+            if len(results) != len(items):
+                raise ValueError(f'バッチ応答の件数が一致しません: {len(results)} != {len(items)}')
+            return [
+                self._already_exists_result(result) if result.get('code') == 'already_exists' else result
+                for result in results
+            ]
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            error = self._error_result(e)
+            return [dict(error) for _ in items]
+
+    async def report_instance_events(self, events: List[Dict]) -> List[Dict]:
+        """
+        インスタンス参加・退出イベントをまとめて報告
+
+        サーバーがバッチAPIに対応していなければ1件ずつ順に送信する。
+        1件ずつ送信する場合は失敗した時点で中断し、残りはエラーとして返す。
+
+        Args:
+            events: {'type': 'join'|'leave', 'world_id', 'instance_id',
+                     'vrc_user_id', 'vrc_display_name', 'occurred_at'} のリスト
+
+        Returns:
+            List[Dict]: eventsと同じ順の各イベントのレスポンス
+        """
+        results: List[Dict] = []
+        for start in range(0, len(events), self.event_batch_max_items):
+            chunk = events[start:start + self.event_batch_max_items]
+            chunk_results = await self._report_instance_events_chunk(chunk)
+            results.extend(chunk_results)
+            if any(r.get('status') == 'error' for r in chunk_results):
+                skipped = {'status': 'error', 'message': '前のイベントの送信に失敗したため未送信', 'error_kind': 'skipped'}
+                results.extend(dict(skipped) for _ in events[start + len(chunk):])
+                break
+        return results
+
+    async def _report_instance_events_chunk(self, events: List[Dict]) -> List[Dict]:
+        """イベントを1リクエストで報告（非対応なら1件ずつ）"""
+        if len(events) > 1 and self._batch_support['events'] is not False:
+            try:
+                response = await self._send(
+                    'POST',
+                    f'{self.base_url}/vrc/api/instance/events/batch',
+                    headers=self.headers,
+                    json=events
+                )
+                if response.status_code in BATCH_UNSUPPORTED_STATUS:
+                    print("サーバーがイベントのバッチ報告に非対応のため1件ずつ送信します")
+                    self._batch_support['events'] = False
+                else:
+                    response.raise_for_status()
+                    self._batch_support['events'] = True
+                    results = response.json().get('data', {}).get('results', [])
+                    if len(results) != len(events):
+                        raise ValueError(f'バッチ応答の件数が一致しません: {len(results)} != {len(events)}')
+                    return results
+            except Exception as e:
+                error = self._error_result(e)
+                return [dict(error) for _ in events]
+
+        # 1件ずつ順に送信（順序が意味を持つため並列にしない）
+        results = []
+        for i, event in enumerate(events):
+            if event.get('type') == 'leave':
+                result = await self.report_instance_leave()
+            else:
+                result = await self.report_instance_join(
+                    event.get('world_id'),
+                    event.get('instance_id'),
+                    event.get('vrc_user_id'),
+                    event.get('vrc_display_name')
+                )
+            results.append(result)
+            if result.get('status') == 'error':
+                skipped = {'status': 'error', 'message': '前のイベントの送信に失敗したため未送信', 'error_kind': 'skipped'}
+                results.extend(dict(skipped) for _ in events[i + 1:])
+                break
+        return results
 
     async def report_instance_join(
         self,
@@ -170,7 +854,8 @@ class UploaderClient:
             Dict: レスポンス
         """
         try:
-            response = await self.client.post(
+            response = await self._send(
+                'POST',
                 f'{self.base_url}/vrc/api/instance/join',
                 headers=self.headers,
                 json={
@@ -183,7 +868,7 @@ class UploaderClient:
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return self._error_result(e)
 
     async def report_instance_leave(self) -> Dict:
         """
@@ -194,14 +879,15 @@ class UploaderClient:
             Dict: レスポンス
         """
         try:
-            response = await self.client.post(
+            response = await self._send(
+                'POST',
                 f'{self.base_url}/vrc/api/instance/leave',
                 headers=self.headers
             )
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return self._error_result(e)
 
     async def get_current_location(self) -> Dict:
         """
@@ -211,14 +897,15 @@ class UploaderClient:
             Dict: 現在地情報（world_id, instance_id等）
         """
         try:
-            response = await self.client.get(
+            response = await self._send(
+                'GET',
                 f'{self.base_url}/vrc/api/location/current',
                 headers=self.headers
             )
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return self._error_result(e)
 
     async def get_me(self) -> Dict:
         """
@@ -228,14 +915,15 @@ class UploaderClient:
             Dict: ユーザー情報
         """
         try:
-            response = await self.client.get(
+            response = await self._send(
+                'GET',
                 f'{self.base_url}/vrc/api/auth/me',
                 headers=self.headers
             )
             response.raise_for_status()
             return response.json()
         except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+            return self._error_result(e)
 
     async def health_check(self, timeout: float = 5.0) -> bool:
         """
@@ -259,6 +947,7 @@ class UploaderClient:
 
     async def close(self):
         """クライアントをクローズ"""
+        self.breaker.shutdown()
         if self._client:
             await self._client.aclose()
             self._client = None
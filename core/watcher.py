@@ -17,6 +17,41 @@ def _log(msg: str):
     timestamp = datetime.now().strftime("%H:%M:%S")
     print(f"[{timestamp}] [Watcher] {msg}", flush=True)
 
+def wait_until_written(path: Path, settle_sec: float = 0.2, timeout_sec: float = 5.0) -> bool:
+    """
+    ファイルの書き込みが終わるまで待ち、画像として読めるか確認（ブロックするので別スレッドで呼ぶ）
+
+    Args:
+        path: 画像ファイルのパス
+        settle_sec: サイズがこの秒数変わらなければ書き込み完了とみなす
+        timeout_sec: 待機の上限
+
+    Returns:
+        bool: 書き込みが終わった有効な画像ならTrue
+    """
+    deadline = time.monotonic() + timeout_sec
+    last_size = -1
+    while True:
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return False
+        if size == last_size and size > 0:
+            break
+        if time.monotonic() >= deadline:
+            return False
+        last_size = size
+        time.sleep(settle_sec)
+
+    try:
+        with Image.open(path) as img:
+            img.verify()
+    except Exception:
+        # 書き込み途中、または画像として無効
+        return False
+    return True
+
+
 try:
     from watchdog.observers import Observer
     from watchdog.events import FileSystemEventHandler, FileCreatedEvent
@@ -88,6 +123,7 @@ class ScreenshotWatcher:
         self.observer = None
         self._running = False
         self.queue = Queue()
+        self.watch_path: Optional[Path] = None
 
     def get_vrchat_pictures_path(self) -> Path:
         """VRChatスクリーンショットフォルダを取得"""
@@ -118,6 +154,7 @@ class ScreenshotWatcher:
         self.observer.schedule(handler, str(path), recursive=True)
         self.observer.start()
         self._running = True
+        self.watch_path = path
 
         _log(f"監視開始: {path}")
         _log(f"Observer thread: {self.observer.name}, daemon={self.observer.daemon}")
@@ -138,6 +175,7 @@ class ScreenshotWatcher:
                 _log(f"Observer join failed: {e}")
 
             self.observer = None
+            self.watch_path = None
             _log("監視停止完了")
         else:
             _log("Nothing to stop")
@@ -152,6 +190,16 @@ class ScreenshotWatcher:
                 break
         return files
 
+    def is_watched(self, path: Path) -> bool:
+        """監視中のフォルダ配下のファイルか確認"""
+        if not self._running or self.watch_path is None:
+            return False
+        try:
+            path.resolve().relative_to(self.watch_path.resolve())
+            return True
+        except (ValueError, OSError):
+            return False
+
     @property
     def is_running(self) -> bool:
         return self._running
@@ -0,0 +1,310 @@
+"""
+World Session Index
+VRChatログから過去のワールド滞在区間を索引化し、撮影時刻からワールドを特定
+"""
+
+import re
+import os
+import json
+import time
+import bisect
+import threading
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass, astuple
+from typing import Optional, Dict, List, Tuple
+
+from core.log_parser import VRChatLogParser
+
+
+# VRChatスクリーンショットのファイル名（例: VRChat_2024-01-15_21-30-45.123_1920x1080.png）
+SCREENSHOT_NAME_PATTERN = re.compile(r'VRChat_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})')
+
+
+def get_screenshot_time(path: Path) -> datetime:
+    """
+    スクリーンショットの撮影日時を取得（ローカル時刻）
+
+    ファイル名から取得し、取得できなければ更新日時を使用する。
+
+    Args:
+        path: 画像ファイルのパス
+
+    Returns:
+        datetime: 撮影日時
+    """
+    match = SCREENSHOT_NAME_PATTERN.search(path.name)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), '%Y-%m-%d_%H-%M-%S')
+        except ValueError:
+            pass
+
+    try:
+        return datetime.fromtimestamp(path.stat().st_mtime)
+    except OSError:
+        return datetime.now()
+
+
+@dataclass
+class WorldSession:
+    """ワールド滞在区間（時刻はUNIX秒）"""
+    start: float
+    end: Optional[float]  # 滞在中ならNone
+    world_id: str
+    instance_id: str
+
+
+class WorldSessionIndex:
+    """
+    ワールド滞在区間インデックス
+
+    全てのoutput_log_*.txtからタイムスタンプ付きのJoining/Leaving行を抽出し、
+    (開始, 終了, world_id, instance_id) の区間を開始時刻順に保持する。
+    ファイルごとの読み込み位置を保存し、更新時は追記分のみを解析する。
+    """
+
+    INDEX_FILE = 'world_index.json'
+    INDEX_VERSION = 1
+    READ_CHUNK_SIZE = 1024 * 1024
+    OVERLAP_LOOKBACK = 4
+
+    def __init__(self, log_path: Path, base_path: Optional[Path] = None):
+        """
+        初期化
+
+        Args:
+            log_path: VRChatログフォルダ
+            base_path: インデックス保存先（デフォルト: vrc_uploader/temp）
+        """
+        if base_path is None:
+            base_path = Path(__file__).parent.parent / 'temp'
+
+        self.log_path = log_path
+        self.base_path = base_path
+        self.base_path.mkdir(parents=True, exist_ok=True)
+
+        self._timestamp_re = re.compile(VRChatLogParser.PATTERNS['timestamp'].encode())
+        self._join_re = re.compile(VRChatLogParser.PATTERNS['world_join'].encode())
+
+        self._lock = threading.Lock()         # 区間データ保護
+        self._update_lock = threading.Lock()  # 更新処理の直列化
+
+        self._sessions: List[WorldSession] = []
+        self._starts: List[float] = []
+        # ファイル名 -> {'offset': 読み込み位置, 'open': 滞在中の区間 or None, 'last_ts': 最終時刻}
+        self._files: Dict[str, Dict] = {}
+
+        self._load()
+
+    def _get_index_path(self) -> Path:
+        return self.base_path / self.INDEX_FILE
+
+    # ========== 永続化 ==========
+
+    def _load(self):
+        """保存済みインデックスを読み込み"""
+        index_path = self._get_index_path()
+        if not index_path.exists():
+            return
+
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != self.INDEX_VERSION:
+                return
+
+            self._sessions = [WorldSession(*row) for row in data.get('sessions', [])]
+            self._starts = [s.start for s in self._sessions]
+            self._files = data.get('files', {})
+            # 保存時はindexで持っている滞在中区間をオブジェクトに戻す
+            for state in self._files.values():
+                if state['open'] is not None:
+                    state['open'] = self._sessions[state['open']]
+        except Exception as e:
+            print(f"ワールドインデックス読み込みエラー: {e}")
+            self._sessions, self._starts, self._files = [], [], {}
+
+    def _save(self):
+        """インデックスを保存（一時ファイル経由で置き換え）"""
+        index_path = self._get_index_path()
+        tmp_path = index_path.with_suffix('.tmp')
+
+        with self._lock:
+            positions = {id(s): i for i, s in enumerate(self._sessions)}
+            files = {
+                name: dict(state, open=positions[id(state['open'])] if state['open'] is not None else None)
+                for name, state in self._files.items()
+            }
+            data = {
+                'version': self.INDEX_VERSION,
+                'files': files,
+                'sessions': [astuple(s) for s in self._sessions]
+            }
+
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, index_path)
+        except Exception as e:
+            print(f"ワールドインデックス保存エラー: {e}")
+
+    # ========== 更新 ==========
+
+    def update(self) -> int:
+        """
+        ログフォルダ内の全ログから追記分を解析してインデックスを更新
+
+        Returns:
+            int: 新しく追加された区間数
+        """
+        if not self.log_path.exists():
+            return 0
+
+        with self._update_lock:
+            added = 0
+            # ファイル名に日時が含まれるため名前順 = 作成順
+            for log_file in sorted(self.log_path.glob('output_log_*.txt')):
+                try:
+                    added += self._update_file(log_file)
+                except Exception as e:
+                    print(f"ワールドインデックス更新エラー: {log_file.name}, {e}")
+
+            closed = self._close_stale_sessions()
+            if added or closed:
+                self._save()
+            return added
+
+    def _update_file(self, log_file: Path) -> int:
+        """1ファイルの追記分を解析"""
+        state = self._files.setdefault(log_file.name, {'offset': 0, 'open': None, 'last_ts': None})
+        size = log_file.stat().st_size
+        if size < state['offset']:
+            # 切り詰められたログは読み直さない（VRChatは追記のみ）
+            state['offset'] = size
+        if size == state['offset']:
+            return 0
+
+        added = 0
+        with open(log_file, 'rb') as f:
+            f.seek(state['offset'])
+            carry = b''
+            while True:
+                chunk = f.read(self.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                data = carry + chunk
+                last_newline = data.rfind(b'\n')
+                if last_newline < 0:
+                    carry = data
+                    continue
+                carry = data[last_newline + 1:]
+                state['offset'] = f.tell() - len(carry)
+
+                for raw in data[:last_newline].splitlines():
+                    is_join = b'Joining wrld_' in raw
+                    if not is_join and b'Leaving wrld_' not in raw:
+                        continue
+
+                    ts = self._parse_timestamp(raw)
+                    if ts is None:
+                        continue
+                    state['last_ts'] = ts
+
+                    # 直前の滞在を閉じる
+                    self._close_session(state, ts)
+
+                    if is_join:
+                        join_match = self._join_re.search(raw)
+                        if join_match:
+                            state['open'] = self._insert_session(WorldSession(
+                                start=ts,
+                                end=None,
+                                world_id=join_match.group(1).decode(),
+                                instance_id=join_match.group(2).decode()
+                            ))
+                            added += 1
+
+                # 末尾行の時刻を最終時刻として記録（終了時刻の推定用）
+                tail_line = data[:last_newline].rsplit(b'\n', 1)[-1]
+                tail_ts = self._parse_timestamp(tail_line)
+                if tail_ts is not None:
+                    state['last_ts'] = tail_ts
+
+        return added
+
+    def _parse_timestamp(self, raw: bytes) -> Optional[float]:
+        """行頭のタイムスタンプをUNIX秒に変換"""
+        match = self._timestamp_re.match(raw)
+        if not match:
+            return None
+        try:
+            return datetime.strptime(match.group(1).decode(), '%Y.%m.%d %H:%M:%S').timestamp()
+        except ValueError:
+            return None
+
+    def _insert_session(self, session: WorldSession) -> WorldSession:
+        """区間を開始時刻順に挿入（通常は末尾への追加）"""
+        with self._lock:
+            pos = bisect.bisect_right(self._starts, session.start)
+            self._starts.insert(pos, session.start)
+            self._sessions.insert(pos, session)
+        return session
+
+    def _close_session(self, state: Dict, end: float):
+        """ファイルの滞在中区間を閉じる"""
+        if state['open'] is None:
+            return
+        with self._lock:
+            state['open'].end = end
+        state['open'] = None
+
+    def _close_stale_sessions(self) -> bool:
+        """
+        更新が止まったログの滞在中区間を最終時刻で閉じる
+
+        VRChatの終了時にLeaving行が出ない場合の補正。
+        同時起動中のクライアントのログは閉じない。
+
+        Returns:
+            bool: 閉じた区間があればTrue
+        """
+        threshold = time.time() - VRChatLogParser.ACTIVE_LOG_WINDOW_SEC
+        closed = False
+        for name, state in self._files.items():
+            if state['open'] is None or state['last_ts'] is None:
+                continue
+            try:
+                if (self.log_path / name).stat().st_mtime >= threshold:
+                    continue
+            except OSError:
+                pass
+            self._close_session(state, state['last_ts'])
+            closed = True
+        return closed
+
+    # ========== 検索 ==========
+
+    def lookup(self, when: datetime) -> Optional[Tuple[str, str]]:
+        """
+        指定時刻に滞在していたワールドを取得（O(log n)）
+
+        Args:
+            when: 時刻（ローカル時刻のnaive datetime）
+
+        Returns:
+            Optional[Tuple[str, str]]: (world_id, instance_id)、該当なしならNone
+        """
+        ts = when.timestamp()
+        with self._lock:
+            pos = bisect.bisect_right(self._starts, ts) - 1
+            # 複数クライアント同時起動時は区間が重なるため、直前の数件も確認する
+            for session in reversed(self._sessions[max(0, pos - self.OVERLAP_LOOKBACK):pos + 1]):
+                if session.end is None or ts < session.end:
+                    return (session.world_id, session.instance_id)
+            return None
+
+    @property
+    def session_count(self) -> int:
+        return len(self._sessions)
@@ -6,11 +6,17 @@ VRC Uploader - VRChat Screenshot Uploader for EterPix
 import sys
 import os
 import asyncio
+import bisect
 import qasync
+import time
+import hashlib
 import threading
+import functools
 from pathlib import Path
 from queue import Queue
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional
 
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtCore import QTimer
@@ -18,11 +24,17 @@ from PyQt6.QtGui import QIcon
 from PyQt6.QtNetwork import QLocalServer, QLocalSocket
 
 from ui.main_window import MainWindow
-from core.watcher import ScreenshotWatcher
+from core.watcher import ScreenshotWatcher, wait_until_written
 from core.log_parser import VRChatLogParser
+from core.log_tailer import LogTailer
+from core.world_index import WorldSessionIndex, get_screenshot_time
 from core.image_processor import ImageProcessor
-from core.uploader import UploaderClient
+from core.uploader import UploaderClient, RetryPolicy, RETRYABLE_ERROR_KINDS, is_permanent_error
+from core.circuit_breaker import BreakerState
+from core.upload_scheduler import UploadScheduler
 from core.offline_queue import OfflineQueueManager
+from core.queue_quota import QueueFullError, create_eviction_policy
+from core.metrics import EventCounters
 from core.osc_handler import OSCHandler
 from config import AppConfig
 
@@ -30,6 +42,16 @@ from config import AppConfig
 # 定数
 HEALTH_CHECK_INTERVAL_MS = 10 * 60 * 1000  # 10分
 DEBUG_LOG_INTERVAL_MS = 5000  # 5秒ごとにデバッグログ
+SCREENSHOT_DEDUP_SIZE = 256  # 検出元の重複排除で記憶するパス数
+UPLOAD_PRIORITY_LIVE = 0  # 撮影直後の写真を優先
+UPLOAD_PRIORITY_QUEUE = 10
+UPLOAD_PRIORITY_FULL_RES = 20  # プレビュー送信後のフル解像度は最後
+QUEUE_DRAIN_PAGE_SIZE = 200  # 再送時に一度に読み込む写真の件数
+QUEUE_DRAIN_GROUP = 'offline_queue'
+QUEUE_ITEM_MAX_ATTEMPTS = 3  # 再送1回の中で1件を送り直す最大回数（残りは次回の再送で送る）
+QUEUE_PROGRESS_INTERVAL_SEC = 0.25  # 再送進捗をUIへ通知する最短間隔
+WORLD_SWITCH_GRACE_SEC = 60  # ワールド退出後もこの間は滞在中の速度上限を維持（移動先の読み込み用）
+IN_WORLD_RECHECK_SEC = 60  # ログから滞在中と判定している間の再判定間隔（書き込みが止まったログを滞在中から外す）
 APP_UNIQUE_KEY = "EterPixVRCUploader_SingleInstance"
 
 
@@ -48,6 +70,11 @@ def log_debug(msg: str):
     print(f"[{timestamp}] {msg}", flush=True)
 
 
+def _to_utc(local_dt: datetime) -> datetime:
+    """ローカル時刻(naive)をUTC(naive)に変換（サーバー送信用）"""
+    return local_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 def log_active_threads():
     """アクティブなスレッドをログ出力"""
     threads = threading.enumerate()
@@ -60,13 +87,57 @@ def log_active_threads():
 class VRCUploaderApp:
     """メインアプリケーションクラス"""
 
-    def __init__(self):
-        self.config = AppConfig.load()
+    def __init__(self, config: Optional[AppConfig] = None, queue_path: Optional[Path] = None):
+        """
+        初期化
+
+        Args:
+            config: 設定（省略時は保存済みの設定を読み込む）
+            queue_path: オフラインキューの保存先（省略時は temp）
+        """
+        self.config = config or AppConfig.load()
         self.watcher = ScreenshotWatcher()
         self.log_parser = VRChatLogParser()
+        self.log_tailer = LogTailer(self.log_parser, poll_interval=self.config.log_poll_interval_sec)
+        self.world_index = WorldSessionIndex(self.log_parser.log_path)
         self.processor = ImageProcessor(jpeg_quality=self.config.jpeg_quality)
-        self.uploader = UploaderClient(self.config.server_url)
-        self.offline_queue = OfflineQueueManager()
+        self.uploader = UploaderClient(
+            self.config.server_url,
+            http2=self.config.http2_enabled,
+            max_connections=self.config.http_max_connections,
+            max_keepalive_connections=self.config.http_max_keepalive_connections,
+            keepalive_expiry=self.config.http_keepalive_expiry,
+            connect_timeout=self.config.http_connect_timeout,
+            read_timeout=self.config.http_read_timeout,
+            write_timeout=self.config.http_write_timeout,
+            pool_timeout=self.config.http_pool_timeout,
+            retry_policy=RetryPolicy(
+                max_attempts=self.config.retry_max_attempts,
+                base_delay=self.config.retry_base_delay,
+                max_delay=self.config.retry_max_delay
+            ),
+            breaker_failure_threshold=self.config.breaker_failure_threshold,
+            probe_base_delay=self.config.health_probe_min_sec,
+            probe_max_delay=self.config.health_probe_max_sec,
+            batch_max_bytes=self.config.batch_max_bytes,
+            batch_max_items=self.config.batch_max_items,
+            metrics_window_minutes=self.config.metrics_window_minutes,
+            upload_limit_bps=self.config.upload_limit_idle_kbps * 1024
+        )
+        self.offline_queue = OfflineQueueManager(
+            queue_path,
+            max_bytes=self.config.queue_max_mb * 1024 * 1024,
+            max_items=self.config.queue_max_items,
+            eviction_policy=create_eviction_policy(
+                self.config.queue_eviction_policy,
+                functools.partial(self.processor.reencode_jpg, quality=self.config.queue_reencode_quality)
+            ),
+            min_stay_sec=self.config.queue_join_min_stay_sec,
+            max_attempts=self.config.queue_park_after_attempts
+        )
+        # 通信以外の記録（キューの退避・再圧縮の回数と解放量）
+        self.queue_metrics = EventCounters(window_minutes=self.config.metrics_window_minutes)
+        self.upload_scheduler = UploadScheduler(concurrency=self.config.upload_concurrency)
         self.osc_handler = OSCHandler(
             send_port=self.config.osc_send_port,
             recv_port=self.config.osc_recv_port
@@ -74,20 +145,56 @@ class VRCUploaderApp:
 
         self._callbacks = []
         self._task_queue = Queue()  # 非同期タスク用キュー
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 監視フォルダとログの両方から検出されるため、処理済みパスを記憶
+        self._claimed_screenshots: OrderedDict = OrderedDict()
 
         # オフラインモード状態
         self._is_offline = False
-        self._last_health_check = None
+        # ログ（クライアント）ごとに、今の滞在先の参加をキューに入れた時のキューID（退出時刻の記録用）
+        self._queued_join_ids: Dict[Optional[Path], str] = {}
+        self._drain_lock = asyncio.Lock()
+        self._drain_progress: dict = {}  # 送信中のバッチごとの送信済みバイト数
+        self._drain_sent_bytes = 0
+        self._drain_total_bytes = 0
+        self._drain_notified_at = 0.0
+        # 再送で失敗した項目の再試行間隔（他の項目の送信は止めない）
+        self._drain_retry = RetryPolicy(
+            max_attempts=QUEUE_ITEM_MAX_ATTEMPTS,
+            base_delay=self.config.retry_base_delay,
+            max_delay=self.config.retry_max_delay
+        )
 
-        # コールバック設定
-        self.log_parser.on_world_joined(self._on_world_joined)
-        self.log_parser.on_world_left(self._on_world_left)
+        # 送信速度制限（ワールド退出直後は移動先の読み込みがあるため猶予を置く）
+        self._in_world_until = 0.0
+        self._upload_limit_timer: Optional[asyncio.TimerHandle] = None
+
+        # コールバック設定（ログ解析スレッドからイベントループへ受け渡す）
+        self.log_parser.on_world_joined(self._post_to_loop(self._on_world_joined))
+        self.log_parser.on_world_left(self._post_to_loop(self._on_world_left))
+        self.log_parser.on_state_restored(self._post_to_loop(self._on_log_state_restored))
+        self.log_parser.on_app_quit(self._post_to_loop(self._on_vrchat_quit))
+        # 撮影時点のワールドはログ解析スレッド上で確定させてから受け渡す
+        post_screenshot = self._post_to_loop(self._on_log_screenshot_taken)
+        self.log_parser.on_screenshot_taken(
+            lambda path, timestamp, source: post_screenshot(
+                path, timestamp, self.log_parser.get_world(source), source=source
+            )
+        )
         # VRCユーザー名・ID取得は無効化
-        # self.log_parser.on_user_changed(self._on_user_changed)
+        # self.log_parser.on_user_changed(self._post_to_loop(self._on_user_changed))
 
         # OSC公開範囲変更コールバック
         self.osc_handler.on_visibility_changed(self._on_osc_visibility_changed)
 
+        # サーバー障害の遮断・復旧でオフラインモードを切り替え
+        self.uploader.breaker.on_state_changed(self._on_breaker_state_changed)
+
+        # キューの件数変化をUIへ通知（UIは件数表示のためにキューを読まない）
+        # キューへの追加・退避は別スレッドでも行われるため、通知はイベントループで実行
+        self.offline_queue.on_counts_changed(self._post_to_loop(self._on_queue_counts_changed))
+        self.offline_queue.on_evicted(self._post_to_loop(self._on_queue_evicted))
+
     def add_callback(self, callback):
         """UIコールバックを追加"""
         self._callbacks.append(callback)
@@ -100,6 +207,16 @@ class VRCUploaderApp:
             except Exception as e:
                 print(f"Callback error: {e}")
 
+    def _post_to_loop(self, callback):
+        """別スレッドからのコールバックをイベントループのスレッドで実行するラッパー"""
+        def wrapper(*args, **kwargs):
+            loop = self._loop
+            if loop is None or loop.is_closed():
+                callback(*args, **kwargs)
+                return
+            loop.call_soon_threadsafe(functools.partial(callback, *args, **kwargs))
+        return wrapper
+
     def _schedule_task(self, coro):
         """非同期タスクをキューに追加"""
         self._task_queue.put(coro)
@@ -119,13 +236,58 @@ class VRCUploaderApp:
         # スクリーンショットキューを処理
         files = self.watcher.get_pending_files()
         for path in files:
-            asyncio.ensure_future(self._on_new_screenshot(path))
+            if self._claim_screenshot(path):
+                asyncio.ensure_future(self._on_new_screenshot(path))
 
         if task_count > 0 or files:
             log_debug(f"Processed {task_count} tasks, {len(files)} files")
 
-    async def _on_new_screenshot(self, path: Path):
-        """新しいスクリーンショット検出時"""
+    def _claim_screenshot(self, path: Path) -> bool:
+        """
+        スクリーンショットの処理権を取得（先に届いた検出元のみ処理する）
+
+        Returns:
+            bool: 未処理のパスならTrue
+        """
+        key = os.path.normcase(os.path.abspath(str(path)))
+        if key in self._claimed_screenshots:
+            return False
+
+        self._claimed_screenshots[key] = True
+        if len(self._claimed_screenshots) > SCREENSHOT_DEDUP_SIZE:
+            self._claimed_screenshots.popitem(last=False)
+        return True
+
+    def _release_screenshot(self, path: Path):
+        """処理に失敗したスクリーンショットの処理権を戻す（後から届いた検出元で処理し直せるように）"""
+        self._claimed_screenshots.pop(os.path.normcase(os.path.abspath(str(path))), None)
+
+    def _on_log_screenshot_taken(self, path: Path, timestamp: Optional[datetime], world,
+                                 source: Optional[Path] = None):
+        """VRChatログに撮影行が出た時（監視フォルダの検出より早い）"""
+        if not self.watcher.is_watched(path):
+            # 監視対象外は監視フォルダ側に任せる
+            return
+        asyncio.ensure_future(self._claim_logged_screenshot(path, timestamp, world))
+
+    async def _claim_logged_screenshot(self, path: Path, timestamp: Optional[datetime], world):
+        """ログから検出したスクリーンショットの書き込み完了を待ってから処理権を取得"""
+        if not await asyncio.to_thread(wait_until_written, path):
+            # 書き込みが終わらない・読めない場合は監視フォルダ側に任せる
+            return
+
+        if self._claim_screenshot(path):
+            log_debug(f"Screenshot detected from log: {path.name} ({timestamp})")
+            await self._on_new_screenshot(path, world=world)
+
+    async def _on_new_screenshot(self, path: Path, world: Optional[tuple] = None):
+        """
+        新しいスクリーンショット検出時
+
+        Args:
+            path: スクリーンショットのパス
+            world: 撮影時点の (world_id, instance_id)（ログから検出した場合）
+        """
         if not self.uploader.token:
             self.notify('status', {'message': 'ログインしていません'})
             return
@@ -137,58 +299,184 @@ class VRCUploaderApp:
         try:
             self.notify('upload_start', {'path': str(path)})
 
+            # オフライン中は変換せず元のPNGを参照としてキューに入れる（送信時に変換）
+            if self._is_offline and self.config.defer_offline_conversion:
+                taken_at = get_screenshot_time(path)
+                if world:
+                    world_id, instance_id = world
+                else:
+                    world_id, instance_id = await self._lookup_world_at(taken_at)
+                if await self._queue_photo_reference(path, world_id, instance_id, taken_at):
+                    return
+                # ハードリンクできない（元ファイルが残る保証が無い）場合は従来どおり変換してコピーを保存
+
             # 画像処理
             jpg_bytes, camera_data = self.processor.convert_png_to_jpg(path)
+            # 重複防止キー（ライブ送信とキュー再送で同じキーを使う）
+            idempotency_key = hashlib.sha256(jpg_bytes).hexdigest()
 
-            # 現在のワールド情報取得
-            world_id, instance_id = self.log_parser.current_world or (None, None)
+            # 撮影時刻のワールド情報取得（処理が遅れても撮影時点のワールドを使う）
+            taken_at = get_screenshot_time(path)
+            if world:
+                world_id, instance_id = world
+            else:
+                world_id, instance_id = await self._lookup_world_at(taken_at)
 
             # オフラインモードの場合は直接キューに追加
             if self._is_offline:
-                self._queue_photo(jpg_bytes, path.name, world_id, instance_id, camera_data)
+                await self._queue_photo(jpg_bytes, path.name, world_id, instance_id, camera_data, taken_at,
+                                        idempotency_key)
                 return
 
-            # アップロード試行
-            try:
-                result = await self.uploader.upload_photo(
-                    jpg_bytes,
-                    filename=path.name.replace('.png', '.jpg'),
-                    world_id=world_id,
-                    instance_id=instance_id,
-                    visibility=self.config.default_visibility,
-                    camera_data=camera_data
+            # 2段階アップロード: 先に縮小プレビューを送り、フル解像度は後から添付
+            upload_bytes = jpg_bytes
+            two_phase = self.config.two_phase_upload and self.uploader.supports_full_attach is not False
+            if two_phase:
+                max_px = self.config.preview_max_px
+                # 大きな画像の縮小・エンコードでGUIが固まらないよう別スレッドで実行
+                upload_bytes = await asyncio.to_thread(
+                    self.processor.create_thumbnail,
+                    jpg_bytes, (max_px, max_px), quality=self.config.preview_quality
                 )
+                if len(upload_bytes) >= len(jpg_bytes):
+                    # 縮小しても小さくならない画像はそのまま送る
+                    upload_bytes = jpg_bytes
+                    two_phase = False
 
-                if result.get('status') == 'error':
-                    raise Exception(result.get('message', 'Upload failed'))
+            # アップロード試行（キュー再送と同じスケジューラで同時実行数を制限）
+            try:
+                job = self.upload_scheduler.submit(
+                    f"live:{path}",
+                    functools.partial(
+                        self._upload_photo_or_raise,
+                        upload_bytes,
+                        filename=path.name.replace('.png', '.jpg'),
+                        world_id=world_id,
+                        instance_id=instance_id,
+                        taken_at=_to_utc(taken_at),
+                        visibility=self.config.default_visibility,
+                        camera_data=camera_data,
+                        idempotency_key=idempotency_key,
+                        preview=two_phase
+                    ),
+                    priority=UPLOAD_PRIORITY_LIVE
+                )
+                result = await job.wait()
 
                 # 成功 - オンラインモードを確認
                 self._set_online()
 
+                photo_uuid = result.get('data', {}).get('photo_uuid')
                 self.notify('upload_complete', {
                     'path': str(path),
-                    'photo_uuid': result.get('data', {}).get('photo_uuid')
+                    'photo_uuid': photo_uuid,
+                    'preview': two_phase
                 })
+                if two_phase and photo_uuid and not result.get('data', {}).get('duplicate'):
+                    self._submit_full_resolution(
+                        photo_uuid, jpg_bytes, path.name, world_id, instance_id, camera_data,
+                        taken_at, idempotency_key
+                    )
 
             except Exception as upload_error:
-                # アップロード失敗 - オフラインモードに移行してキューに追加
-                print(f"Upload failed, switching to offline mode: {upload_error}")
-                self._set_offline()
-                self._queue_photo(jpg_bytes, path.name, world_id, instance_id, camera_data)
+                # アップロード失敗 - キューに追加（オフラインへの移行はサーキットブレーカーが判断する）
+                print(f"Upload failed, queuing: {upload_error}")
+                await self._queue_photo(jpg_bytes, path.name, world_id, instance_id, camera_data, taken_at,
+                                        idempotency_key)
 
         except Exception as e:
+            # 変換などに失敗した写真は、監視フォルダからの検出で処理し直せるように処理権を戻す
+            self._release_screenshot(path)
             self.notify('upload_error', {'path': str(path), 'error': str(e)})
 
-    def _queue_photo(self, jpg_bytes: bytes, filename: str, world_id, instance_id, camera_data):
-        """写真をオフラインキューに追加"""
-        queue_id = self.offline_queue.queue_photo(
-            jpg_bytes=jpg_bytes,
-            filename=filename.replace('.png', '.jpg'),
-            world_id=world_id,
-            instance_id=instance_id,
-            visibility=self.config.default_visibility,
-            camera_data=camera_data
+    def _submit_full_resolution(self, photo_uuid: str, jpg_bytes: bytes, filename: str, world_id, instance_id,
+                                camera_data, taken_at: datetime, idempotency_key: str):
+        """プレビュー送信済みの写真にフル解像度を添付（撮影直後・再送より後回し）"""
+        job = self.upload_scheduler.submit(
+            f"full:{photo_uuid}",
+            functools.partial(
+                self._attach_full_or_raise,
+                photo_uuid,
+                jpg_bytes,
+                filename.replace('.png', '.jpg'),
+                idempotency_key
+            ),
+            priority=UPLOAD_PRIORITY_FULL_RES
         )
+
+        async def wait_attached():
+            try:
+                await job.wait()
+                self.notify('full_resolution_attached', {'filename': filename, 'photo_uuid': photo_uuid})
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"Full resolution attach failed: {e}")
+                if getattr(e, 'error_kind', None) in RETRYABLE_ERROR_KINDS | {'circuit_open'}:
+                    # 一時的な失敗 - キューに入れて再送時に添付
+                    await self._queue_photo(jpg_bytes, filename, world_id, instance_id, camera_data, taken_at,
+                                            idempotency_key, attach_to=photo_uuid)
+
+        asyncio.ensure_future(wait_attached())
+
+    async def _attach_full_or_raise(self, photo_uuid: str, source, filename: str,
+                                    idempotency_key: Optional[str] = None, progress=None) -> dict:
+        """フル解像度を添付し、エラー応答なら例外を送出（error_kindを付与）"""
+        result = await self.uploader.attach_full_resolution(
+            photo_uuid, source, filename, idempotency_key=idempotency_key, progress=progress
+        )
+        if result.get('status') == 'error':
+            error = Exception(result.get('message', 'Attach failed'))
+            error.error_kind = result.get('error_kind')
+            raise error
+        return result
+
+    async def _upload_photo_or_raise(self, jpg_bytes: bytes, **kwargs) -> dict:
+        """写真をアップロードし、エラー応答なら例外を送出"""
+        result = await self.uploader.upload_photo(jpg_bytes, **kwargs)
+        if result.get('status') == 'error':
+            raise Exception(result.get('message', 'Upload failed'))
+        return result
+
+    async def _lookup_world_at(self, taken_at: datetime):
+        """撮影時刻に滞在していたワールドを取得（索引に無ければ現在のワールド）"""
+        try:
+            await asyncio.to_thread(self.world_index.update)
+            world = self.world_index.lookup(taken_at)
+            if world:
+                return world
+        except Exception as e:
+            print(f"World index lookup error: {e}")
+        return self.log_parser.current_world or (None, None)
+
+    async def refresh_world_index(self):
+        """ワールド滞在インデックスをバックグラウンドで更新"""
+        try:
+            added = await asyncio.to_thread(self.world_index.update)
+            log_debug(f"World index updated: +{added} sessions ({self.world_index.session_count} total)")
+        except Exception as e:
+            log_debug(f"World index update failed: {e}")
+
+    async def _queue_photo(self, jpg_bytes: bytes, filename: str, world_id, instance_id, camera_data,
+                           taken_at: Optional[datetime] = None, idempotency_key: Optional[str] = None,
+                           attach_to: Optional[str] = None):
+        """写真をオフラインキューに追加（容量上限時の再圧縮で画面が止まらないよう別スレッドで実行）"""
+        try:
+            queue_id = await asyncio.to_thread(
+                self.offline_queue.queue_photo,
+                jpg_bytes=jpg_bytes,
+                filename=filename.replace('.png', '.jpg'),
+                world_id=world_id,
+                instance_id=instance_id,
+                visibility=self.config.default_visibility,
+                taken_at=taken_at,
+                camera_data=camera_data,
+                idempotency_key=idempotency_key,
+                attach_to=attach_to
+            )
+        except QueueFullError as e:
+            self._notify_queue_full(filename, e)
+            return
         counts = self.offline_queue.get_queue_counts()
         self.notify('photo_queued', {
             'queue_id': queue_id,
@@ -198,8 +486,47 @@ class VRCUploaderApp:
         # キューに追加後、すぐに送信を試みる
         self._schedule_task(self.try_send_queue())
 
+    async def _queue_photo_reference(self, path: Path, world_id, instance_id, taken_at: datetime) -> bool:
+        """
+        元のPNGを参照としてオフラインキューに追加（容量上限時の再圧縮は別スレッドで実行）
+
+        Returns:
+            bool: 処理済みならTrue（容量上限で保存しなかった場合も含む、元ファイルを参照できない場合はFalse）
+        """
+        try:
+            queue_id = await asyncio.to_thread(
+                self.offline_queue.queue_photo_reference,
+                path,
+                filename=path.name.replace('.png', '.jpg'),
+                world_id=world_id,
+                instance_id=instance_id,
+                visibility=self.config.default_visibility,
+                taken_at=taken_at
+            )
+        except QueueFullError as e:
+            self._notify_queue_full(path.name, e)
+            return True
+        if queue_id is None:
+            return False
+        counts = self.offline_queue.get_queue_counts()
+        self.notify('photo_queued', {
+            'queue_id': queue_id,
+            'filename': path.name,
+            'pending_count': counts['photos']
+        })
+        self._schedule_task(self.try_send_queue())
+        return True
+
+    def _notify_queue_full(self, filename: str, error: Exception):
+        """容量上限のため写真をキューに保存できなかった時"""
+        print(f"Photo not queued: {error}")
+        self.notify('upload_error', {
+            'path': filename,
+            'error': '送信待ちの容量上限に達したため保存できませんでした'
+        })
+
     def _set_offline(self):
-        """オフラインモードに設定"""
+        """オフラインモードに設定（サーキットブレーカーが遮断した時のみ）"""
         if not self._is_offline:
             self._is_offline = True
             self.notify('offline_mode', {'is_offline': True})
@@ -209,26 +536,99 @@ class VRCUploaderApp:
         if self._is_offline:
             self._is_offline = False
             self.notify('offline_mode', {'is_offline': False})
-
-    def _on_world_joined(self, world_id: str, instance_id: str):
+            # 復帰直後の送信に備えて接続を確立しておく
+            asyncio.ensure_future(self.uploader.warm_up())
+
+    def _on_queue_counts_changed(self, counts: dict):
+        """オフラインキューの件数・合計サイズが変わった時"""
+        self.notify('queue_counts', dict(counts, max_bytes=self.offline_queue.max_bytes))
+
+    def _on_queue_evicted(self, event: dict):
+        """容量上限のためにキューの写真を削除・再圧縮した（または保存しなかった）時"""
+        self.queue_metrics.increment(f"queue_{event['action']}")
+        self.queue_metrics.increment('queue_freed_bytes', max(0, event['freed_bytes']))
+        self.notify('queue_evicted', dict(event, totals=dict(self.offline_queue.eviction_counts)))
+
+    def _on_breaker_state_changed(self, old_state: BreakerState, new_state: BreakerState):
+        """サーキットブレーカーの状態変化時"""
+        if new_state == BreakerState.OPEN:
+            self._set_offline()
+            # 未実行の再送は取り消して復旧確認に任せる（遮断後に始まって失敗するのを防ぐ）
+            self.upload_scheduler.cancel_group(QUEUE_DRAIN_GROUP)
+        elif new_state == BreakerState.HALF_OPEN:
+            # プローブ成功 - 実リクエストで復旧を確認
+            asyncio.ensure_future(self._resume_after_probe())
+        elif new_state == BreakerState.CLOSED:
+            self._set_online()
+            if self.offline_queue.has_pending_data():
+                asyncio.ensure_future(self.try_send_queue())
+
+    async def _resume_after_probe(self):
+        """プローブ成功後、送信待ちがあれば再送して復旧を確認"""
+        if self.uploader.token and self.offline_queue.has_pending_data():
+            if self._drain_lock.locked():
+                # 遮断前に始まった再送の終了を待つ（待たずに戻るとプローブの結果が記録されない）
+                async with self._drain_lock:
+                    pass
+            await self._process_offline_queue()
+        if self.uploader.breaker.state == BreakerState.HALF_OPEN:
+            # 確認に使う送信が無かった（キューが空・送信対象外のみ等）ためプローブ結果で復旧とみなす
+            self.uploader.breaker.record_success()
+
+    def _update_upload_limit(self):
+        """VRChatの滞在状態に応じて送信速度の上限を切り替え"""
+        if self._upload_limit_timer is not None:
+            self._upload_limit_timer.cancel()
+            self._upload_limit_timer = None
+
+        remaining = self._in_world_until - time.monotonic()
+        in_world = self.log_parser.is_in_world() or remaining > 0
+        kbps = self.config.upload_limit_in_world_kbps if in_world else self.config.upload_limit_idle_kbps
+        bytes_per_sec = kbps * 1024
+
+        if bytes_per_sec != self.uploader.bandwidth.rate:
+            self.uploader.set_upload_limit(bytes_per_sec)
+            log_debug(f"Upload limit: {kbps or 'unlimited'} KB/s ({'in world' if in_world else 'idle'})")
+            self.notify('upload_limit_changed', {'in_world': in_world, 'kbps': kbps})
+
+        if self._loop is None:
+            return
+        if self.log_parser.is_in_world():
+            # ログの書き込みが止まった（異常終了した）クライアントを滞在中とみなし続けないよう定期的に再判定
+            self._upload_limit_timer = self._loop.call_later(IN_WORLD_RECHECK_SEC, self._update_upload_limit)
+        elif remaining > 0:
+            # 猶予が切れたら再判定
+            self._upload_limit_timer = self._loop.call_later(remaining, self._update_upload_limit)
+
+    def _on_vrchat_quit(self, source: Optional[Path] = None):
+        """VRChat終了時 - 猶予を待たずに送信速度の制限を解除"""
+        log_debug(f"VRChat quit detected ({source.name if source else '-'})")
+        self._queued_join_ids.pop(source, None)
+        self._in_world_until = 0.0
+        self._update_upload_limit()
+
+    def _on_world_joined(self, world_id: str, instance_id: str, source: Optional[Path] = None):
         """ワールド参加時"""
+        self._queued_join_ids.pop(source, None)
+        self._update_upload_limit()
         self.notify('world_joined', {
             'world_id': world_id,
-            'instance_id': instance_id
+            'instance_id': instance_id,
+            'log_path': str(source) if source else None
         })
 
         if self.uploader.token:
-            self._schedule_task(self._report_join(world_id, instance_id))
+            asyncio.ensure_future(self._report_join(world_id, instance_id, source))
 
-    async def _report_join(self, world_id: str, instance_id: str):
-        """インスタンス参加を報告"""
+    async def _report_join(self, world_id: str, instance_id: str, source: Optional[Path] = None):
+        """インスタンス参加を報告（source: 参加を検出したログ）"""
         # VRCユーザー情報は取得しない
         user_id = None
         display_name = None
 
         # オフラインモードの場合はキューに追加
         if self._is_offline:
-            self._queue_world_join(world_id, instance_id, user_id, display_name)
+            self._queue_world_join(world_id, instance_id, user_id, display_name, source)
             return
 
         try:
@@ -238,16 +638,17 @@ class VRCUploaderApp:
             if result.get('status') == 'error':
                 raise Exception(result.get('message', 'Report failed'))
 
+            self._queued_join_ids.pop(source, None)
             self._set_online()
 
         except Exception as e:
             print(f"Failed to report join, queuing: {e}")
-            self._set_offline()
-            self._queue_world_join(world_id, instance_id, user_id, display_name)
+            self._queue_world_join(world_id, instance_id, user_id, display_name, source)
 
-    def _queue_world_join(self, world_id: str, instance_id: str, user_id: str, display_name: str):
+    def _queue_world_join(self, world_id: str, instance_id: str, user_id: str, display_name: str,
+                          source: Optional[Path] = None):
         """ワールド参加をオフラインキューに追加"""
-        self.offline_queue.queue_world_join(
+        self._queued_join_ids[source] = self.offline_queue.queue_world_join(
             world_id=world_id,
             instance_id=instance_id,
             vrc_user_id=user_id,
@@ -259,14 +660,37 @@ class VRCUploaderApp:
             'pending_count': counts['worlds']
         })
 
-    def _on_world_left(self, world_info):
+    def _on_log_state_restored(self, state: dict, source: Optional[Path] = None):
+        """起動時にログ末尾から現在地が復元された時"""
+        world = state.get('world')
+        if not world:
+            self._update_upload_limit()
+            return
+
+        world_id, instance_id = world
+        log_debug(f"Restored current world from log: {world_id}:{instance_id} ({source.name if source else '-'})")
+        # 過去の参加は再生せず、現在地のみを1回報告する
+        self._on_world_joined(world_id, instance_id, source=source)
+
+    def _on_world_left(self, world_info, source: Optional[Path] = None):
         """ワールド退出時"""
+        self._in_world_until = time.monotonic() + WORLD_SWITCH_GRACE_SEC
+        self._update_upload_limit()
+        # このクライアントがキューに入れた参加の滞在時間（短い滞在は次の参加時にまとめる、報告済みの参加では記録しない）
+        queued_join_id = self._queued_join_ids.pop(source, None)
+        if queued_join_id is not None:
+            self.offline_queue.mark_world_left(queued_join_id)
         if world_info:
             self.notify('world_left', {
                 'world_id': world_info[0],
-                'instance_id': world_info[1]
+                'instance_id': world_info[1],
+                'log_path': str(source) if source else None
             })
-        self._schedule_task(self._report_leave())
+        if self.log_parser.is_in_world(exclude=source):
+            # 別のクライアントがまだ滞在中ならサーバー上の現在地を消さない
+            log_debug(f"World left but another client is still in a world ({source.name if source else '-'})")
+            return
+        asyncio.ensure_future(self._report_leave())
 
     def _on_osc_visibility_changed(self, visibility: str):
         """OSC経由で公開範囲が変更された時"""
@@ -283,7 +707,7 @@ class VRCUploaderApp:
                 print(f"Failed to report leave: {e}")
 
     # VRCユーザー名・ID取得は無効化
-    # def _on_user_changed(self, user_info):
+    # def _on_user_changed(self, user_info, source: Optional[Path] = None):
     #     """VRChatユーザー変更時"""
     #     display_name, user_id = user_info
     #     self.notify('user_changed', {
@@ -302,6 +726,15 @@ class VRCUploaderApp:
         self.watcher.stop()
         self.notify('status', {'message': '監視停止'})
 
+    def start_log_tailing(self, loop: asyncio.AbstractEventLoop):
+        """VRChatログのバックグラウンド追跡開始"""
+        self._loop = loop
+        self.log_tailer.start()
+
+    def stop_log_tailing(self):
+        """VRChatログの追跡停止"""
+        self.log_tailer.stop()
+
     # ========== OSC関連 ==========
 
     def start_osc(self):
@@ -328,6 +761,7 @@ class VRCUploaderApp:
             self.config.saved_token = self.uploader.token
             self.config.saved_username = username
             self.config.save()
+            asyncio.ensure_future(self.uploader.warm_up())
         return result
 
     async def register(self, username: str, password: str) -> dict:
@@ -337,6 +771,7 @@ class VRCUploaderApp:
             self.config.saved_token = self.uploader.token
             self.config.saved_username = username
             self.config.save()
+            asyncio.ensure_future(self.uploader.warm_up())
         return result
 
     def logout(self):
@@ -355,49 +790,39 @@ class VRCUploaderApp:
 
     def get_pending_counts(self) -> dict:
         """送信待ちデータの件数を取得"""
-        return self.offline_queue.get_queue_counts()
+        return dict(self.offline_queue.get_queue_counts(), max_bytes=self.offline_queue.max_bytes)
 
-    async def check_server_health(self):
-        """サーバーの死活確認を行い、オンラインなら再送信"""
-        self._last_health_check = datetime.now()
+    def get_queue_quota(self) -> dict:
+        """送信待ちの容量上限・使用量と、退避（削除・再圧縮・受付拒否）の回数を取得"""
+        return self.offline_queue.get_quota_status()
 
-        if not self.uploader.token:
-            return
-
-        try:
-            is_alive = await self.uploader.health_check()
+    def get_upload_metrics(self, minutes: int = 5) -> dict:
+        """
+        直近N分の通信メトリクスを取得
 
-            if is_alive:
-                # サーバー復活 - キューを処理
-                if self._is_offline:
-                    print("Server is back online, processing queue...")
-                    self._set_online()
-                    await self._process_offline_queue()
-            else:
-                # サーバーダウン
-                if not self._is_offline:
-                    print("Server is offline")
-                    self._set_offline()
+        Args:
+            minutes: 集計する期間（分）
 
-        except Exception as e:
-            print(f"Health check error: {e}")
+        Returns:
+            dict: エンドポイント -> 件数・ステータス・各項目のp50/p95/p99
+        """
+        return self.uploader.metrics.summary(minutes)
 
     async def try_send_queue(self):
-        """キューにデータがあればサーバー確認して送信を試みる"""
+        """キューにデータがあれば送信を試みる（遮断中は復旧確認に任せる）"""
         if not self.uploader.token:
             return
 
-        # キューが空なら何もしない
-        counts = self.offline_queue.get_queue_counts()
-        if counts['photos'] == 0 and counts['worlds'] == 0:
+        # キューが空（保留中の項目のみを含む）なら何もしない
+        if not self.offline_queue.has_pending_data():
+            return
+
+        # 遮断中は送信しない（プローブ成功時に再送される）
+        if not self.uploader.breaker.allows_requests:
             return
 
-        # サーバー確認して送信
         try:
-            is_alive = await self.uploader.health_check()
-            if is_alive:
-                self._set_online()
-                await self._process_offline_queue()
+            await self._process_offline_queue()
         except Exception as e:
             print(f"Queue send check error: {e}")
 
@@ -407,8 +832,9 @@ class VRCUploaderApp:
             self.notify('status', {'message': 'ログインしていません'})
             return False
 
-        counts = self.offline_queue.get_queue_counts()
-        if counts['photos'] == 0 and counts['worlds'] == 0:
+        # 失敗が続いて保留にした項目も手動の再送では送り直す
+        self.offline_queue.reset_parked()
+        if not self.offline_queue.has_pending_data():
             self.notify('status', {'message': '送信待ちデータがありません'})
             return True
 
@@ -417,6 +843,8 @@ class VRCUploaderApp:
         try:
             is_alive = await self.uploader.health_check()
             if is_alive:
+                # 手動確認で到達できたので遮断を解除
+                self.uploader.breaker.record_success()
                 self._set_online()
                 self.notify('status', {'message': '再送信中...'})
                 await self._process_offline_queue()
@@ -434,64 +862,423 @@ class VRCUploaderApp:
         if not self.uploader.token:
             return
 
-        # ワールド参加を処理
-        world_joins = self.offline_queue.get_queued_world_joins()
-        for world_join in world_joins:
-            try:
-                result = await self.uploader.report_instance_join(
-                    world_join.world_id,
-                    world_join.instance_id,
-                    world_join.vrc_user_id,
-                    world_join.vrc_display_name
-                )
-                if result.get('status') != 'error':
-                    self.offline_queue.remove_world_join(world_join.id)
-                    self.notify('queue_item_sent', {
-                        'type': 'world_join',
-                        'world_id': world_join.world_id
-                    })
+        # 再送処理の多重実行を防止
+        if self._drain_lock.locked():
+            return
+
+        async with self._drain_lock:
+            await self._drain_offline_queue()
+
+    def _on_drain_progress(self, key: str, sent: int, total: int):
+        """再送の進捗を集計してUIへ通知（間隔を空けて間引く）"""
+        # 再試行で先頭から送り直した場合は差分が負になる
+        self._drain_sent_bytes += sent - self._drain_progress.get(key, 0)
+        if sent >= total:
+            self._drain_progress.pop(key, None)
+        else:
+            self._drain_progress[key] = sent
+        sent_bytes = min(self._drain_sent_bytes, self._drain_total_bytes)
+        now = time.monotonic()
+        if now - self._drain_notified_at < QUEUE_PROGRESS_INTERVAL_SEC and sent_bytes < self._drain_total_bytes:
+            return
+        self._drain_notified_at = now
+        self.notify('queue_progress', {
+            'sent_bytes': sent_bytes,
+            'total_bytes': self._drain_total_bytes
+        })
+
+    async def _send_queued_photo_batch(self, batch: list) -> list:
+        """
+        キュー内の写真をまとめて送信し、成功した分をキューから削除
+        画像はメモリに読み込まずディスクから少しずつ送信する
+
+        参照モードの写真はここでJPGに変換する（現在の画質設定を使う）
+
+        Args:
+            batch: (QueuedPhoto, 画像ファイルのパス) のリスト
+
+        Returns:
+            list: 送り直す (QueuedPhoto, 画像ファイルのパス) のリスト
+                  （送り直しても成功しない写真は失敗回数を記録し、今回は送り直さない）
+        """
+        key = batch[0][0].id
+        paths = {photo.id: image_path for photo, image_path in batch}
+        resolved = await self._resolve_queued_references(batch)
+        if not resolved:
+            return []
+        items = []
+        for photo, source in resolved:
+            item = {
+                'filename': photo.filename,
+                'world_id': photo.world_id,
+                'instance_id': photo.instance_id,
+                'taken_at': _to_utc(datetime.fromisoformat(photo.taken_at)),
+                'visibility': photo.visibility,
+                'camera_data': photo.camera_data,
+                'idempotency_key': photo.idempotency_key
+            }
+            if isinstance(source, bytes):
+                item['jpg_bytes'] = source
+            else:
+                item['jpg_path'] = source
+            items.append(item)
+        results = await self.uploader.upload_photos_batch(
+            items, progress=functools.partial(self._on_drain_progress, key)
+        )
+
+        failed = []
+        sent = []
+        for (photo, _), result in zip(resolved, results):
+            if result.get('status') == 'error':
+                failed.append((photo, result))
+            else:
+                sent.append((photo, result))
+        # 送信済みの分はまとめて1回のコミットで削除（途中で落ちても送信済みの分は再送しない）
+        self.offline_queue.remove_photos([photo.id for photo, _ in sent])
+        for photo, result in sent:
+            self.notify('queue_item_sent', {
+                'type': 'photo',
+                'filename': photo.filename,
+                'photo_uuid': result.get('data', {}).get('photo_uuid'),
+                'duplicate': result.get('data', {}).get('duplicate', False)
+            })
+        retry = []
+        with self.offline_queue.batch():
+            for photo, result in failed:
+                message = result.get('message', 'Upload failed')
+                print(f"Failed to send queued photo: {photo.filename}: {message}")
+                if is_permanent_error(result):
+                    # 保留の判定に数えるのはサーバーが写真を拒否した場合のみ（障害中の失敗では保留にしない）
+                    self.offline_queue.record_failures('photo', [photo.id], message)
                 else:
-                    # 送信失敗 - オフラインモードに戻る
-                    self._set_offline()
-                    return
-            except Exception as e:
-                print(f"Failed to send queued world join: {e}")
-                self._set_offline()
-                return
+                    retry.append((photo, paths[photo.id]))
+        return retry
+
+    async def _resolve_queued_references(self, batch: list) -> list:
+        """
+        参照モードの写真を送信直前にJPGへ変換（元ファイルが消えていればキューから外す）
+
+        Args:
+            batch: (QueuedPhoto, 画像ファイルのパス) のリスト
+
+        Returns:
+            list: (QueuedPhoto, JPGのパス または 変換したJPGバイト) のリスト
+        """
+        resolved = []
+        missing = []
+        for photo, source in batch:
+            if not photo.is_reference:
+                resolved.append((photo, source))
+                continue
+            if not source.exists():
+                missing.append(photo)
+                continue
+            unchanged = self.offline_queue.is_source_unchanged(photo)
+            jpg_bytes, camera_data = await asyncio.to_thread(self.processor.convert_png_to_jpg, source)
+            # 進捗の合計は実際に送るJPGのサイズで数える
+            self._drain_total_bytes += len(jpg_bytes)
+            if not unchanged:
+                # キュー追加後に変更された - 変換したコピーに置き換え、新しい重複防止キーで送る
+                log_debug(f"Queued source changed since it was queued, keeping a converted copy: {source}")
+                image_path = await asyncio.to_thread(
+                    self.offline_queue.replace_reference_with_copy, photo, jpg_bytes, camera_data
+                )
+                resolved.append((photo, image_path))
+                continue
+            photo.camera_data = camera_data or None
+            resolved.append((photo, jpg_bytes))
+
+        if missing:
+            self.offline_queue.remove_photos([photo.id for photo in missing])
+            for photo in missing:
+                print(f"Queued source was deleted, dropping: {photo.source_path}")
+                self.notify('upload_error', {
+                    'path': photo.source_path,
+                    'error': '送信待ちの元画像が削除されています'
+                })
+        return resolved
+
+    async def _send_queued_full_resolution(self, photo, image_path) -> list:
+        """
+        プレビュー送信済みの写真にキューのフル解像度を添付し、成功したらキューから削除
+
+        Returns:
+            list: 送り直す場合は [(QueuedPhoto, 画像ファイルのパス)]
+        """
+        result = await self.uploader.attach_full_resolution(
+            photo.attach_to,
+            image_path,
+            photo.filename,
+            idempotency_key=photo.idempotency_key,
+            progress=functools.partial(self._on_drain_progress, photo.id)
+        )
+        if result.get('error_kind') in ('unsupported', 'client'):
+            # 添付できない（非対応・写真が削除済み等）場合はプレビューのまま残す（再送し続けない）
+            print(f"Full resolution dropped ({result.get('message')}): {photo.filename}")
+            self.offline_queue.remove_photo(photo.id)
+            return []
+        if result.get('status') == 'error':
+            message = result.get('message', 'Attach failed')
+            print(f"Failed to attach queued full resolution: {photo.filename}: {message}")
+            return [(photo, image_path)]
+        self.offline_queue.remove_photo(photo.id)
+        self.notify('queue_item_sent', {
+            'type': 'photo',
+            'filename': photo.filename,
+            'photo_uuid': photo.attach_to,
+            'duplicate': result.get('data', {}).get('duplicate', False)
+        })
+        return []
+
+    async def _send_queued_unit(self, unit: list) -> list:
+        """再送の1ジョブ分（写真のバッチ、またはフル解像度の添付1件）を送信し、送り直す分を返す"""
+        if not self.uploader.breaker.allows_requests:
+            # 待機中に遮断された - 送信せずに次回の再送に回す
+            return unit
+        photo, image_path = unit[0]
+        if photo.attach_to:
+            return await self._send_queued_full_resolution(photo, image_path)
+        return await self._send_queued_photo_batch(unit)
+
+    async def _skip_existing_photos(self, page: list) -> list:
+        """
+        サーバーに登録済みの写真（タイムアウト後に保存されていた等）を送らずにキューから外す
+
+        Args:
+            page: (QueuedPhoto, 画像ファイルのパス) のリスト
+
+        Returns:
+            list: 送信が必要な写真
+        """
+        candidates = [photo for photo, _ in page if not photo.attach_to]
+        if not candidates:
+            return page
+        existing = await self.uploader.check_existing_photos([photo.idempotency_key for photo in candidates])
+        if not existing:
+            return page
+
+        duplicates = [photo for photo in candidates if photo.idempotency_key in existing]
+        self.offline_queue.remove_photos([photo.id for photo in duplicates])
+        for photo in duplicates:
+            self.notify('queue_item_sent', {
+                'type': 'photo',
+                'filename': photo.filename,
+                'photo_uuid': None,
+                'duplicate': True
+            })
+        log_debug(f"Skipped {len(duplicates)} photos already on the server")
+        return [(p, path) for p, path in page if p.attach_to or p.idempotency_key not in existing]
+
+    async def _send_queued_photo_group(self, items: list, dependency: Optional[asyncio.Future]) -> bool:
+        """
+        同じワールド参加に依存する写真を送信（依存先の報告が済んでから）
+        失敗した写真は1枚ずつ再試行し、他の写真の送信は止めない
+
+        Args:
+            items: (QueuedPhoto, 画像ファイルのパス) のリスト
+            dependency: 依存するワールド参加の報告結果（Trueで送信済み、Noneは依存なし）
+
+        Returns:
+            bool: 全て送信できたらTrue
+        """
+        if dependency is not None and not await dependency:
+            # 依存するワールド参加を報告できなかった - 次回の再送に回す
+            return False
+        if not self.uploader.breaker.allows_requests:
+            return False
 
-        # 写真を処理
-        queued_photos = self.offline_queue.get_queued_photos()
-        for photo, jpg_bytes in queued_photos:
-            try:
-                result = await self.uploader.upload_photo(
-                    jpg_bytes,
-                    filename=photo.filename,
-                    world_id=photo.world_id,
-                    instance_id=photo.instance_id,
-                    visibility=photo.visibility,
-                    camera_data=photo.camera_data
+        photos = [(p, path) for p, path in items if not p.attach_to]
+        attachments = [(p, path) for p, path in items if p.attach_to]
+        # 参照モードはキュー追加時のPNGのサイズで分割を計画する（変換後は小さくなる）
+        sizes = [photo.source_size if photo.is_reference else image_path.stat().st_size
+                 for photo, image_path in photos]
+        # 進捗の合計: 参照モードは変換後のサイズを送信時に加える
+        self._drain_total_bytes += sum(size for (photo, _), size in zip(photos, sizes) if not photo.is_reference)
+        self._drain_total_bytes += sum(path.stat().st_size for _, path in attachments)
+        units = [[photos[i] for i in indices] for indices in self.uploader.plan_batches(sizes)]
+        units += [[attachment] for attachment in attachments]
+
+        attempt = 1
+        while units:
+            jobs = [
+                self.upload_scheduler.submit(
+                    f"queue:{unit[0][0].id}",
+                    functools.partial(self._send_queued_unit, unit),
+                    priority=UPLOAD_PRIORITY_FULL_RES if unit[0][0].attach_to else UPLOAD_PRIORITY_QUEUE,
+                    group=QUEUE_DRAIN_GROUP
                 )
-                if result.get('status') != 'error':
-                    self.offline_queue.remove_photo(photo.id)
+                for unit in units
+            ]
+            failed = []
+            for unit, job in zip(units, jobs):
+                try:
+                    failed.extend(await job.wait())
+                except asyncio.CancelledError:
+                    failed.extend(unit)
+                except Exception as e:
+                    # 変換エラー等（送り直しても成功しない） - ジョブ内の写真をまとめて失敗として記録
+                    print(f"Failed to send queued photos: {e}")
+                    self.offline_queue.record_failures('photo', [photo.id for photo, _ in unit], str(e))
+            if not failed:
+                return True
+            # 遮断中は送り直さない（未実行の再送は遮断時に取り消し済み）
+            if attempt >= self._drain_retry.max_attempts or not self.uploader.breaker.allows_requests:
+                return False
+            await asyncio.sleep(self._drain_retry.backoff(attempt))
+            attempt += 1
+            units = [[item] for item in failed]
+        return True
+
+    async def _submit_queued_photo_page(self, page: list, join_times: list, join_done: list) -> list:
+        """
+        キューの1ページ分の写真を、依存するワールド参加ごとのグループに分けて送信開始
+
+        Args:
+            page: (QueuedPhoto, 画像ファイルのパス) のリスト
+            join_times: キュー内のワールド参加の追加日時（昇順）
+            join_done: 各ワールド参加の報告結果（join_timesと同じ順）
+
+        Returns:
+            list: グループごとの送信タスク
+        """
+        page = await self._skip_existing_photos(page)
+
+        groups: dict = {}
+        for photo, image_path in page:
+            # 写真は撮影の直前に参加したワールドの報告にのみ依存（添付待ちは登録済みのため依存なし）
+            index = -1 if photo.attach_to else bisect.bisect_right(join_times, photo.taken_at) - 1
+            groups.setdefault(index, []).append((photo, image_path))
+
+        return [
+            asyncio.ensure_future(self._send_queued_photo_group(items, join_done[index] if index >= 0 else None))
+            for index, items in groups.items()
+        ]
+
+    async def _wait_drain_tasks(self, tasks: list) -> bool:
+        """
+        再送タスクの完了を待つ
+
+        Returns:
+            bool: 全て送信できたらTrue
+        """
+        complete = True
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, BaseException):
+                print(f"Queue drain task error: {result}")
+            complete = complete and result is True
+        return complete
+
+    async def _send_queued_world_joins(self, world_joins: list, join_done: list) -> bool:
+        """
+        ワールド参加を参加順に報告し、報告済みになった参加に依存する写真の送信を解放
+        失敗した参加は再試行し、順序を保つためそれ以降の参加は待機する
+
+        Args:
+            world_joins: キュー内のワールド参加（追加順）
+            join_done: 各ワールド参加の報告結果を設定するFuture
+
+        Returns:
+            bool: 全て報告できたらTrue
+        """
+        index = 0
+        attempt = 1
+        try:
+            while index < len(world_joins):
+                if not self.uploader.breaker.allows_requests:
+                    break
+                chunk = world_joins[index:index + self.uploader.event_batch_max_items]
+                results = await self.uploader.report_instance_events([
+                    {
+                        'type': 'join',
+                        'world_id': world_join.world_id,
+                        'instance_id': world_join.instance_id,
+                        'vrc_user_id': world_join.vrc_user_id,
+                        'vrc_display_name': world_join.vrc_display_name,
+                        'occurred_at': _to_utc(datetime.fromisoformat(world_join.created_at)).isoformat() + 'Z'
+                    }
+                    for world_join in chunk
+                ])
+                sent = []
+                failed_result = None
+                for world_join, result in zip(chunk, results):
+                    if result.get('status') == 'error':
+                        failed_result = result
+                        break
+                    sent.append(world_join)
+
+                # 送信済みの分はまとめて1回のコミットで削除し、依存する写真を解放
+                self.offline_queue.remove_world_joins([world_join.id for world_join in sent])
+                for world_join in sent:
+                    join_done[index].set_result(True)
+                    index += 1
                     self.notify('queue_item_sent', {
-                        'type': 'photo',
-                        'filename': photo.filename,
-                        'photo_uuid': result.get('data', {}).get('photo_uuid')
+                        'type': 'world_join',
+                        'world_id': world_join.world_id
                     })
-                else:
-                    # 送信失敗 - オフラインモードに戻る
-                    self._set_offline()
-                    return
-            except Exception as e:
-                print(f"Failed to send queued photo: {e}")
-                self._set_offline()
-                return
+                if failed_result is None:
+                    attempt = 1
+                    continue
+
+                message = failed_result.get('message', 'Report failed')
+                print(f"Failed to send queued world join: {message}")
+                if is_permanent_error(failed_result):
+                    # サーバーが拒否した参加は送り直さない（保留になれば次回からは除いて送る）
+                    self.offline_queue.record_failures('world_join', [world_joins[index].id], message)
+                    break
+                if attempt >= self._drain_retry.max_attempts:
+                    break
+                await asyncio.sleep(self._drain_retry.backoff(attempt))
+                attempt += 1
+        finally:
+            # 報告できなかった参加に依存する写真は今回は送らない
+            for future in join_done[index:]:
+                if not future.done():
+                    future.set_result(False)
+        return index == len(world_joins)
+
+    async def _drain_offline_queue(self):
+        """
+        オフラインキューの送信本体
+
+        ワールド参加は参加順に報告し、写真は依存するワールド参加の報告が済んだものから並列に送る。
+        失敗した項目は1件ずつ再試行し、他の項目の送信は続ける。
+        送信済みの項目はその都度キューから削除するため、途中で終了しても次回は残りだけを送る。
+        """
+        self._drain_progress = {}
+        self._drain_sent_bytes = 0
+        self._drain_total_bytes = 0
+
+        # 失敗が続いて保留にした項目は送らない（手動の再送で戻す）
+        world_joins = self.offline_queue.get_queued_world_joins(skip_parked=True)
+        loop = asyncio.get_running_loop()
+        join_times = [world_join.created_at for world_join in world_joins]
+        join_done = [loop.create_future() for _ in world_joins]
+        joins_task = asyncio.ensure_future(self._send_queued_world_joins(world_joins, join_done))
+
+        # 写真はページ単位で読み込む（送信中のページの次の1ページだけ先に投入するので、キューが長くてもメモリは一定）
+        complete = True
+        previous_tasks: list = []
+        for page in self.offline_queue.iter_photo_pages(page_size=QUEUE_DRAIN_PAGE_SIZE, skip_parked=True):
+            if not self.uploader.breaker.allows_requests:
+                complete = False
+                break
+            tasks = await self._submit_queued_photo_page(page, join_times, join_done)
+            complete = await self._wait_drain_tasks(previous_tasks) and complete
+            previous_tasks = tasks
+        complete = await self._wait_drain_tasks(previous_tasks) and complete
+        complete = await joins_task and complete
 
-        # 全て送信完了
         counts = self.offline_queue.get_queue_counts()
+        if self.uploader.breaker.state == BreakerState.CLOSED:
+            # サーバーに到達できている（送信できなかった項目が残っていてもオンライン）
+            self._set_online()
+        if not complete:
+            print(f"Queue drain finished with {counts['photos']} photos and {counts['worlds']} world joins remaining")
         self.notify('queue_processed', {
             'remaining_photos': counts['photos'],
-            'remaining_worlds': counts['worlds']
+            'remaining_worlds': counts['worlds'],
+            'parked_photos': counts['parked_photos'],
+            'parked_worlds': counts['parked_worlds']
         })
 
 
@@ -586,17 +1373,20 @@ def main():
 
     QTimer.singleShot(500, lambda: asyncio.ensure_future(fetch_username_if_needed()))
 
-    # ログ解析タイマー（1秒ごと）
-    log_timer = QTimer()
-    log_timer.timeout.connect(uploader_app.log_parser.parse_new_lines)
-    log_timer.start(1000)
+    # 保存トークンでのログイン復元時は接続を事前確立
+    if uploader_app.uploader.token:
+        asyncio.ensure_future(uploader_app.uploader.warm_up())
+
+    # ログ解析（バックグラウンドスレッドでファイル更新を待機）
+    uploader_app.start_log_tailing(loop)
+    asyncio.ensure_future(uploader_app.refresh_world_index())
 
     # タスク処理タイマー（100msごと）
     task_timer = QTimer()
     task_timer.timeout.connect(uploader_app.process_pending_tasks)
     task_timer.start(100)
 
-    # ヘルスチェック＆キュー送信タイマー（10分ごと）
+    # キュー送信タイマー（10分ごと、オフライン中の復旧確認はサーキットブレーカーが行う）
     def schedule_health_check():
         asyncio.ensure_future(uploader_app.try_send_queue())
 
@@ -608,7 +1398,18 @@ def main():
     def debug_log_tick():
         thread_count = log_active_threads()
         log_debug(f"Watcher running: {uploader_app.watcher.is_running}")
+        log_debug(f"Log tailer running: {uploader_app.log_tailer.is_running}")
         log_debug(f"Task queue size: {uploader_app._task_queue.qsize()}")
+        for endpoint, stats in uploader_app.get_upload_metrics(minutes=5).items():
+            total = stats['total_ms']
+            log_debug(f"{endpoint}: {stats['requests']} req, retries {stats['retries']}, "
+                      f"p50/p95/p99 {total['p50']:.0f}/{total['p95']:.0f}/{total['p99']:.0f} ms")
+        quota = uploader_app.get_queue_quota()
+        log_debug(f"Offline queue: {quota['photos']} photos, {quota['disk_bytes']} / {quota['max_bytes']} bytes, "
+                  f"evicted {quota['evicted']}, reencoded {quota['reencoded']}, refused {quota['refused']}")
+        log_debug(f"Offline queue evictions (5 min): {uploader_app.queue_metrics.summary(minutes=5)}")
+        compacted = uploader_app.offline_queue.compaction_counts
+        log_debug(f"World joins coalesced: {compacted['duplicates']} duplicates, {compacted['short_stays']} short stays")
 
     debug_timer = QTimer()
     debug_timer.timeout.connect(debug_log_tick)
@@ -625,11 +1426,8 @@ def main():
         uploader_app.start_osc()
         window._update_ui()
 
-    # 起動時に保留中のキューがあれば確認
+    # 起動時に保留中のキューがあれば送信を試みる（届かなければサーキットブレーカーがオフラインにする）
     if uploader_app.offline_queue.has_pending_data():
-        uploader_app._is_offline = True
-        uploader_app.notify('offline_mode', {'is_offline': True})
-        # 起動後すぐにキュー送信試行
         QTimer.singleShot(3000, schedule_health_check)
 
     # アプリケーション終了時のクリーンアップ
@@ -646,8 +1444,11 @@ def main():
         log_debug("Stopping OSC...")
         uploader_app.stop_osc()
 
+        log_debug("Stopping log tailer...")
+        uploader_app.stop_log_tailing()
+        uploader_app.uploader.breaker.shutdown()
+
         log_debug("Stopping timers...")
-        log_timer.stop()
         task_timer.stop()
         health_timer.stop()
         debug_timer.stop()
@@ -0,0 +1,30 @@
+"""
+テスト共通設定
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# リポジトリ直下をパスに追加（core / tools を読み込めるように）
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from tools.local_server import FaultConfig, create_server
+
+
+@pytest.fixture
+def local_server():
+    """
+    ローカル検証用サーバーを空きポートで起動し、(サーバー, URL) を返す
+
+    server.state.set_faults で障害設定を変更できる。
+    """
+    server = create_server(port=0, faults=FaultConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,95 @@
+"""
+オフラインキューの再送（VRCUploaderApp）のテスト
+アプリ本体の依存関係（PyQt6等、Windows）が無い環境ではスキップする
+"""
+
+import asyncio
+
+import pytest
+
+from core.circuit_breaker import BreakerState
+from tools.local_server import FaultConfig
+
+main = pytest.importorskip('main', reason='アプリ本体の依存関係が必要')
+config_module = pytest.importorskip('config')
+
+
+def _create_app(url: str, queue_path) -> 'main.VRCUploaderApp':
+    config = config_module.AppConfig(
+        server_url=url,
+        http2_enabled=False,
+        retry_max_attempts=1,
+        retry_base_delay=0.01,
+        retry_max_delay=0.05,
+        breaker_failure_threshold=1,
+        health_probe_min_sec=60,
+        health_probe_max_sec=60,
+        queue_park_after_attempts=1
+    )
+    return main.VRCUploaderApp(config=config, queue_path=queue_path)
+
+
+def _attempts(queue) -> list:
+    photos = [photo.attempts for page in queue.iter_photo_pages() for photo, _ in page]
+    return photos + [join.attempts for join in queue.get_queued_world_joins()]
+
+
+def test_outage_does_not_count_toward_parking(local_server, tmp_path):
+    server, url = local_server
+
+    async def run():
+        app = _create_app(url, tmp_path)
+        try:
+            assert (await app.uploader.register('tester', 'password'))['status'] == 'success'
+            queue = app.offline_queue
+            queue.queue_world_join('wrld_a', '1', None, None)
+            queue.queue_photo(b'x' * 1000, 'a.jpg', world_id='wrld_a', instance_id='1')
+
+            # 503で遮断されるまでの再送と、遮断中の再送
+            server.state.set_faults(FaultConfig(outages=[(0, 3600)], outage_mode='503'))
+            await app._process_offline_queue()
+            assert app.uploader.breaker.state == BreakerState.OPEN
+            await app._process_offline_queue()
+            return queue.get_queue_counts(), _attempts(queue), queue.has_pending_data()
+        finally:
+            await app.upload_scheduler.close()
+            await app.uploader.close()
+
+    counts, attempts, pending = asyncio.run(run())
+    # 障害中の失敗は保留の判定に数えない
+    assert attempts == [0, 0]
+    assert (counts['parked_photos'], counts['parked_worlds']) == (0, 0)
+    assert pending
+
+
+def test_pending_drain_jobs_are_cancelled_when_breaker_opens(local_server, tmp_path):
+    server, url = local_server
+
+    async def run():
+        app = _create_app(url, tmp_path)
+        app.upload_scheduler.set_concurrency(1)
+        app.uploader.batch_max_items = 1
+        calls = []
+        upload_photos_batch = app.uploader.upload_photos_batch
+
+        async def counting_upload(items, progress=None):
+            calls.append(len(items))
+            return await upload_photos_batch(items, progress=progress)
+
+        app.uploader.upload_photos_batch = counting_upload
+        try:
+            assert (await app.uploader.register('tester', 'password'))['status'] == 'success'
+            for i in range(4):
+                app.offline_queue.queue_photo(bytes([i]) * 1000, f'{i}.jpg')
+
+            server.state.set_faults(FaultConfig(outages=[(0, 3600)], outage_mode='503'))
+            await app._process_offline_queue()
+            return calls, _attempts(app.offline_queue)
+        finally:
+            await app.upload_scheduler.close()
+            await app.uploader.close()
+
+    calls, attempts = asyncio.run(run())
+    # 最初の送信で遮断された時点で、待機中の再送は実行しない
+    assert calls == [1]
+    assert attempts == [0, 0, 0, 0]
@@ -0,0 +1,94 @@
+"""
+UploaderClient とローカル検証用サーバーの結合テスト
+アップロード・重複（409）・ボディ上限超過（413）の経路を確認する
+"""
+
+import asyncio
+
+from core.circuit_breaker import BreakerState
+from core.uploader import UploaderClient
+from tools.local_server import FaultConfig
+
+
+async def _registered_client(url: str) -> UploaderClient:
+    client = UploaderClient(url, http2=False, batch_max_bytes=4 * 1024 * 1024, batch_max_items=10)
+    result = await client.register('tester', 'password')
+    assert result['status'] == 'success'
+    return client
+
+
+def test_upload_photo(local_server):
+    server, url = local_server
+
+    async def run():
+        client = await _registered_client(url)
+        try:
+            return await client.upload_photo(b'x' * 1000, 'a.jpg', world_id='wrld_test', instance_id='1',
+                                             idempotency_key='key-1')
+        finally:
+            await client.close()
+
+    result = asyncio.run(run())
+    assert result['status'] == 'success'
+    assert result['data']['photo_uuid'] == server.state.photos[0]['photo_uuid']
+    assert len(server.state.photos) == 1
+
+
+def test_duplicate_upload_is_reported_as_success(local_server):
+    server, url = local_server
+
+    async def run():
+        client = await _registered_client(url)
+        try:
+            first = await client.upload_photo(b'x' * 1000, 'a.jpg', idempotency_key='key-1')
+            second = await client.upload_photo(b'x' * 1000, 'a.jpg', idempotency_key='key-1')
+            return first, second
+        finally:
+            await client.close()
+
+    first, second = asyncio.run(run())
+    # 409 already_exists は送信済みとして扱う（再送しない）
+    assert second['status'] == 'success'
+    assert second['data']['duplicate'] is True
+    assert second['data']['photo_uuid'] == first['data']['photo_uuid']
+    assert len(server.state.photos) == 1
+
+
+def test_batch_too_large_is_split(local_server):
+    server, url = local_server
+    server.state.set_faults(FaultConfig(max_body_bytes=700 * 1024))
+    items = [
+        {'jpg_bytes': bytes([i]) * (300 * 1024), 'filename': f'{i}.jpg', 'idempotency_key': f'key-{i}'}
+        for i in range(4)
+    ]
+
+    async def run():
+        client = await _registered_client(url)
+        try:
+            return await client.upload_photos_batch(items)
+        finally:
+            await client.close()
+
+    results = asyncio.run(run())
+    # 413で半分に分割して送り直す
+    assert [result['status'] for result in results] == ['success'] * 4
+    assert server.state.fault_counts.get('too_large', 0) >= 1
+    assert len(server.state.photos) == 4
+
+
+def test_exists_check_failure_does_not_open_breaker(local_server):
+    server, url = local_server
+
+    async def run():
+        client = UploaderClient(url, http2=False, breaker_failure_threshold=1)
+        try:
+            assert (await client.register('tester', 'password'))['status'] == 'success'
+            server.state.set_faults(FaultConfig(error_rate=1.0))
+            return await client.check_existing_photos(['key-1']), client.breaker.state
+        finally:
+            await client.close()
+
+    existing, state = asyncio.run(run())
+    # 登録済み確認は補助的なため、失敗してもオフラインにしない（全て送信する）
+    assert existing == set()
+    assert state == BreakerState.CLOSED
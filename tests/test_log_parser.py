@@ -0,0 +1,32 @@
+"""
+VRChatLogParser のテスト
+"""
+
+import os
+import time
+
+from core.log_parser import VRChatLogParser
+
+
+def _write_log(path, *lines):
+    with open(path, 'a', encoding='utf-8') as f:
+        for line in lines:
+            f.write(f"2024.01.01 12:00:00 Log        -  {line}\n")
+
+
+def test_stale_log_is_not_in_world(tmp_path):
+    parser = VRChatLogParser(startup_seek=False)
+    parser.log_path = tmp_path
+    first = tmp_path / 'output_log_1.txt'
+    second = tmp_path / 'output_log_2.txt'
+    _write_log(first, '[Behaviour] Joining wrld_a:1')
+    _write_log(second, '[Behaviour] Joining wrld_b:2')
+    parser.parse_new_lines()
+    assert parser.is_in_world()
+    assert parser.is_in_world(exclude=first)
+
+    # 終了行を書かずに止まったクライアントは、書き込みが途絶えた後は滞在中とみなさない
+    stale = time.time() - VRChatLogParser.IN_WORLD_WRITE_WINDOW_SEC - 60
+    os.utime(second, (stale, stale))
+    assert parser.is_in_world()
+    assert not parser.is_in_world(exclude=first)
@@ -0,0 +1,135 @@
+"""
+OfflineQueueManager のテスト
+"""
+
+import sqlite3
+from datetime import datetime
+
+from core.offline_queue import OfflineQueueManager
+
+
+def test_world_join_without_user_info(tmp_path):
+    queue = OfflineQueueManager(tmp_path)
+    queue_id = queue.queue_world_join('wrld_a', '1', None, None)
+
+    joins = queue.get_queued_world_joins()
+    assert [join.id for join in joins] == [queue_id]
+    assert joins[0].vrc_user_id is None
+    assert joins[0].vrc_display_name is None
+    assert queue.get_queue_counts()['worlds'] == 1
+    queue.close()
+
+
+def test_reference_survives_source_deletion(tmp_path):
+    source = tmp_path / 'VRChat_test.png'
+    source.write_bytes(b'png' * 100)
+    queue = OfflineQueueManager(tmp_path / 'queue')
+    queue_id = queue.queue_photo_reference(source, 'VRChat_test.jpg')
+    source.unlink()
+
+    [(photo, path)] = next(queue.iter_photo_pages())
+    assert photo.id == queue_id and photo.is_reference
+    assert path.read_bytes() == b'png' * 100
+    assert queue.is_source_unchanged(photo)
+
+    queue.remove_photos([queue_id])
+    assert not path.exists()
+    queue.close()
+
+
+def test_changed_reference_is_replaced_with_copy(tmp_path):
+    source = tmp_path / 'VRChat_test.png'
+    source.write_bytes(b'png' * 100)
+    queue = OfflineQueueManager(tmp_path / 'queue')
+    queue.queue_photo_reference(source, 'VRChat_test.jpg')
+    [(photo, path)] = next(queue.iter_photo_pages())
+    old_key = photo.idempotency_key
+    with open(path, 'ab') as f:
+        f.write(b'edited')
+    assert not queue.is_source_unchanged(photo)
+
+    image_path = queue.replace_reference_with_copy(photo, b'jpg' * 10)
+
+    [(stored, stored_path)] = next(queue.iter_photo_pages())
+    assert not stored.is_reference
+    assert stored_path == image_path and image_path.read_bytes() == b'jpg' * 10
+    assert stored.idempotency_key == photo.idempotency_key != old_key
+    assert not path.exists()
+    assert queue.get_queue_counts()['bytes'] == 30
+    queue.close()
+
+
+def test_failing_items_are_parked(tmp_path):
+    queue = OfflineQueueManager(tmp_path, max_attempts=2)
+    photo_id = queue.queue_photo(b'jpg' * 10, 'a.jpg')
+    join_id = queue.queue_world_join('wrld_a', '1', None, None)
+
+    queue.record_failures('photo', [photo_id], 'error')
+    queue.record_failures('world_join', [join_id], 'error')
+    assert queue.has_pending_data()
+    queue.record_failures('photo', [photo_id], 'error')
+    queue.record_failures('world_join', [join_id], 'error')
+
+    # 保留中の項目は再送の対象にしないが、件数には残す
+    assert not queue.has_pending_data()
+    assert list(queue.iter_photo_pages(skip_parked=True)) == []
+    assert queue.get_queued_world_joins(skip_parked=True) == []
+    counts = queue.get_queue_counts()
+    assert (counts['photos'], counts['parked_photos']) == (1, 1)
+    assert (counts['worlds'], counts['parked_worlds']) == (1, 1)
+    queue.close()
+
+    # 再起動後も保留のまま
+    queue = OfflineQueueManager(tmp_path, max_attempts=2)
+    assert queue.get_queue_counts()['parked_photos'] == 1
+    assert queue.reset_parked() == 2
+    assert queue.has_pending_data()
+    [[(photo, _)]] = list(queue.iter_photo_pages(skip_parked=True))
+    assert photo.id == photo_id and photo.attempts == 0
+
+    queue.record_failures('photo', [photo_id], 'error')
+    queue.record_failures('photo', [photo_id], 'error')
+    queue.remove_photos([photo_id])
+    assert queue.get_queue_counts()['parked_photos'] == 0
+    queue.close()
+
+
+def test_same_instance_rejoin_is_a_duplicate(tmp_path):
+    queue = OfflineQueueManager(tmp_path, min_stay_sec=60)
+    queue_id = queue.queue_world_join('wrld_a', '1', None, None)
+    queue.mark_world_left(queue_id)
+
+    # 滞在が短くても、同じインスタンスへの再参加は短い滞在ではなく重複としてまとめる
+    assert queue.queue_world_join('wrld_a', '1', None, None) == queue_id
+    assert queue.compaction_counts == {'duplicates': 1, 'short_stays': 0}
+
+    queue.mark_world_left(queue_id)
+    queue.queue_world_join('wrld_b', '2', None, None)
+    assert [join.world_id for join in queue.get_queued_world_joins()] == ['wrld_b']
+    assert queue.compaction_counts == {'duplicates': 1, 'short_stays': 1}
+    queue.close()
+
+
+
+def test_short_stay_uses_photo_taken_time(tmp_path):
+    queue = OfflineQueueManager(tmp_path, min_stay_sec=60)
+    taken_at = datetime.now()
+    join_b = queue.queue_world_join('wrld_b', '2', None, None)
+    queue.mark_world_left(join_b)
+
+    # Bの参加前に撮影された写真が、Bの参加後にキューに入っても、Bの短い滞在は残さない
+    queue.queue_photo(b'x' * 100, 'a.jpg', world_id='wrld_a', instance_id='1', taken_at=taken_at)
+    queue.queue_world_join('wrld_c', '3', None, None)
+    assert [join.world_id for join in queue.get_queued_world_joins()] == ['wrld_c']
+    queue.close()
+
+def test_leave_is_only_recorded_for_the_queued_join(tmp_path):
+    queue = OfflineQueueManager(tmp_path, min_stay_sec=60)
+    queue_id = queue.queue_world_join('wrld_a', '1', None, None)
+    # 報告済み（キューに無い）参加の退出では、キュー内の参加の退出時刻を記録しない
+    queue.mark_world_left('reported-online')
+    queue.close()
+
+    conn = sqlite3.connect(str(tmp_path / OfflineQueueManager.DB_FILE))
+    assert conn.execute('SELECT id, left_at FROM worlds').fetchall() == [(queue_id, None)]
+    conn.close()
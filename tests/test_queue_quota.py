@@ -0,0 +1,52 @@
+"""
+容量上限と退避ポリシーのテスト
+"""
+
+from core.offline_queue import OfflineQueueManager
+from core.queue_quota import ROW_OVERHEAD_BYTES, OldestFirstPolicy, ReencodePolicy
+
+
+def test_reencode_policy_resumes_after_checked_photos(tmp_path):
+    calls = []
+
+    def reencode(jpg_bytes: bytes) -> bytes:
+        calls.append(len(jpg_bytes))
+        if len(calls) == 1:
+            raise ValueError('broken image')
+        return jpg_bytes[:len(jpg_bytes) // 2]
+
+    policy = ReencodePolicy(reencode)
+    queue = OfflineQueueManager(tmp_path, max_bytes=3 * (2000 + ROW_OVERHEAD_BYTES), eviction_policy=policy)
+    for i in range(3):
+        queue.queue_photo(bytes([i]) * 2000, f'{i}.jpg')
+
+    # 1枚目は再圧縮に失敗、2枚目を再圧縮して空きを作る
+    queue.queue_photo(b'\xff' * 100, 'new.jpg')
+    assert calls == [2000, 2000]
+    assert queue.get_quota_status()['reencoded'] == 1
+
+    # 次回は失敗した1枚目・再圧縮済みの2枚目を読み直さず3枚目から
+    queue.queue_photo(b'\xfe' * 100, 'new2.jpg')
+    assert calls == [2000, 2000, 2000]
+    queue.close()
+
+
+def test_references_count_their_linked_size(tmp_path):
+    sources = []
+    for i in range(3):
+        source = tmp_path / f'VRChat_{i}.png'
+        source.write_bytes(bytes([i]) * 2000)
+        sources.append(source)
+    queue = OfflineQueueManager(tmp_path / 'queue', max_bytes=2 * (2000 + ROW_OVERHEAD_BYTES),
+                                eviction_policy=OldestFirstPolicy())
+    first = queue.queue_photo_reference(sources[0], 'VRChat_0.jpg')
+    queue.queue_photo_reference(sources[1], 'VRChat_1.jpg')
+    # 元ファイルが消えてもハードリンクが容量を使うため、PNGのサイズで数える
+    assert queue.disk_usage == 2 * (2000 + ROW_OVERHEAD_BYTES)
+
+    # 古い参照を1件削除すれば、その分の実際の容量が空く
+    queue.queue_photo_reference(sources[2], 'VRChat_2.jpg')
+    quota = queue.get_quota_status()
+    assert (quota['photos'], quota['evicted'], quota['freed_bytes']) == (2, 1, 2000 + ROW_OVERHEAD_BYTES)
+    assert not (tmp_path / 'queue' / 'images' / f'{first}.png').exists()
+    queue.close()
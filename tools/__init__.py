@@ -0,0 +1 @@
+# VRC Uploader Development Tools
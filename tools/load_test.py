@@ -0,0 +1,302 @@
+"""
+Load Test
+ローカル検証用サーバーに対してアップロードの負荷試験を行う
+ネットワークのない環境でも、再送・再試行・並列数の変更を同じ条件で比較できる
+
+使い方:
+    # UploaderClientで写真200枚(各2MB)を並列4でアップロード
+    python -m tools.load_test client --photos 200 --size-kb 2048 --concurrency 4
+
+    # バッチAPIを使い、遅延150ms・帯域2MB/s・エラー率5%の条件で比較
+    python -m tools.load_test client --batch --latency-ms 150 --bandwidth-kbps 2048 --error-rate 0.05 --seed 1
+
+    # VRCUploaderAppのオフラインキュー再送（起動5〜15秒はサーバー停止）
+    python -m tools.load_test drain --photos 100 --worlds 10 --outage 5:15
+
+    # 起動済みのサーバーを使う場合
+    python -m tools.load_test client --server-url http://127.0.0.1:8765
+"""
+
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# python tools/load_test.py でも実行できるようにリポジトリ直下をパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.uploader import UploaderClient, RetryPolicy
+from core.upload_scheduler import UploadScheduler
+from tools.local_server import create_server, add_fault_arguments, faults_from_args
+
+
+def make_photos(directory: Path, count: int, size: int, seed: Optional[int]) -> List[Path]:
+    """試験用の写真ファイルを作成（内容は乱数、JPEGとしては扱わない）"""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        path = directory / f"VRChat_loadtest_{i:05d}.jpg"
+        path.write_bytes(rng.randbytes(size))
+        paths.append(path)
+    return paths
+
+
+def start_local_server(args: argparse.Namespace):
+    """ローカルサーバーを別スレッドで起動"""
+    server = create_server(port=0, batch_enabled=not args.no_server_batch, faults=faults_from_args(args))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def build_report(
+    elapsed: float,
+    sent_photos: int,
+    sent_bytes: int,
+    failed: int,
+    client: UploaderClient,
+    server=None,
+    extra: Optional[Dict] = None
+) -> Dict:
+    """試験結果をまとめる"""
+    report = {
+        'elapsed_sec': round(elapsed, 3),
+        'photos_sent': sent_photos,
+        'photos_failed': failed,
+        'photos_per_sec': round(sent_photos / elapsed, 2) if elapsed > 0 else None,
+        'mb_per_sec': round(sent_bytes / elapsed / (1024 * 1024), 2) if elapsed > 0 else None,
+        'client_metrics': client.metrics.summary(minutes=24 * 60),
+    }
+    if server is not None:
+        report['server_requests'] = dict(server.state.request_counts)
+        report['server_faults'] = dict(server.state.fault_counts)
+        report['server_photos'] = len(server.state.photos)
+    if extra:
+        report.update(extra)
+    return report
+
+
+def print_report(report: Dict):
+    """試験結果を表示"""
+    print("=== Load test result ===")
+    for key in ('http_version', 'elapsed_sec', 'photos_sent', 'photos_failed', 'photos_per_sec', 'mb_per_sec',
+                'remaining_photos', 'remaining_worlds', 'server_photos'):
+        if key in report:
+            print(f"{key}: {report[key]}")
+    if report.get('server_requests'):
+        print(f"server_requests: {report['server_requests']}")
+    if report.get('server_faults'):
+        print(f"server_faults: {report['server_faults']}")
+    print("--- per endpoint (ms) ---")
+    for endpoint, stats in report['client_metrics'].items():
+        total, ttfb = stats['total_ms'], stats['ttfb_ms']
+        line = (f"{endpoint}: {stats['requests']} req, retries {stats['retries']}, statuses {stats['statuses']}, "
+                f"total p50/p95/p99 {total['p50']:.0f}/{total['p95']:.0f}/{total['p99']:.0f}")
+        if ttfb['count']:
+            line += f", ttfb p50/p95 {ttfb['p50']:.0f}/{ttfb['p95']:.0f}"
+        print(line)
+
+
+def make_client(url: str, args: argparse.Namespace) -> UploaderClient:
+    """試験条件に合わせたクライアントを作成"""
+    return UploaderClient(
+        url,
+        http2=args.http2,
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_connections,
+        retry_policy=RetryPolicy(max_attempts=args.retry_attempts, base_delay=args.retry_base_delay),
+        probe_base_delay=args.probe_delay,
+        probe_max_delay=args.probe_delay * 8,
+        batch_max_bytes=args.batch_max_kb * 1024,
+        batch_max_items=args.batch_max_items
+    )
+
+
+async def negotiated_http_version(client: UploaderClient) -> Optional[str]:
+    """実際に使われたHTTPのバージョン（--http2を指定してもサーバーが対応していなければHTTP/1.1）"""
+    try:
+        response = await client.client.get(f'{client.base_url}/vrc/api/health')
+    except Exception:
+        return None
+    return response.http_version
+
+
+async def register(client: UploaderClient):
+    """試験用ユーザーを登録"""
+    result = await client.register(f"loadtest_{uuid.uuid4().hex[:8]}", 'loadtest')
+    if result.get('status') != 'success':
+        raise SystemExit(f"ユーザー登録に失敗しました: {result.get('message')}")
+
+
+async def run_client(url: str, args: argparse.Namespace, work_dir: Path, server=None) -> Dict:
+    """UploaderClientとUploadSchedulerで写真を並列アップロード"""
+    client = make_client(url, args)
+    scheduler = UploadScheduler(concurrency=args.concurrency)
+    try:
+        await register(client)
+        paths = make_photos(work_dir, args.photos, args.size_kb * 1024, args.seed)
+        sizes = [path.stat().st_size for path in paths]
+        if args.warm_up:
+            await client.warm_up(args.concurrency)
+
+        started = time.perf_counter()
+        if args.batch:
+            groups = client.plan_batches(sizes)
+            jobs = [
+                scheduler.submit(
+                    f"batch:{indices[0]}",
+                    lambda indices=indices: client.upload_photos_batch(
+                        [{'jpg_path': paths[i], 'filename': paths[i].name} for i in indices]
+                    )
+                )
+                for indices in groups
+            ]
+        else:
+            groups = [[i] for i in range(len(paths))]
+            jobs = [
+                scheduler.submit(
+                    f"photo:{i}",
+                    lambda i=i: client.upload_photo_file(paths[i], paths[i].name)
+                )
+                for i in range(len(paths))
+            ]
+
+        outcomes = await asyncio.gather(*(job.wait() for job in jobs), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        sent = failed = sent_bytes = 0
+        for indices, outcome in zip(groups, outcomes):
+            results = outcome if isinstance(outcome, list) else [outcome]
+            for i, result in zip(indices, results):
+                if isinstance(result, dict) and result.get('status') != 'error':
+                    sent += 1
+                    sent_bytes += sizes[i]
+                else:
+                    failed += 1
+        return build_report(elapsed, sent, sent_bytes, failed, client, server, {
+            'http_version': await negotiated_http_version(client),
+        })
+    finally:
+        await scheduler.close()
+        await client.close()
+
+
+async def run_drain(url: str, args: argparse.Namespace, work_dir: Path, server=None) -> Dict:
+    """VRCUploaderAppのオフラインキュー再送を計測"""
+    try:
+        from config import AppConfig
+        from main import VRCUploaderApp
+    except ImportError as e:
+        raise SystemExit(f"VRCUploaderAppを読み込めません（PyQt6等の依存関係が必要です）: {e}")
+
+    # 保存済みの設定・キューは読み書きしない（設定は既定値から作り、キューは作業フォルダに置く）
+    config = AppConfig(
+        server_url=url,
+        http2_enabled=args.http2,
+        retry_max_attempts=args.retry_attempts,
+        retry_base_delay=args.retry_base_delay,
+        health_probe_min_sec=args.probe_delay,
+        health_probe_max_sec=args.probe_delay * 8,
+        upload_concurrency=args.concurrency,
+        batch_max_bytes=args.batch_max_kb * 1024,
+        batch_max_items=args.batch_max_items if args.batch else 1,
+        # 試験用のワールド参加・写真はまとめたり退避したりせず全て送る
+        queue_max_mb=0,
+        queue_join_min_stay_sec=0
+    )
+    app = VRCUploaderApp(config=config, queue_path=work_dir / 'queue')
+    app._loop = asyncio.get_running_loop()
+
+    events: Dict[str, int] = {}
+    app.add_callback(lambda event_type, data: events.__setitem__(event_type, events.get(event_type, 0) + 1))
+
+    try:
+        await register(app.uploader)
+        rng = random.Random(args.seed)
+        size = args.size_kb * 1024
+        for i in range(args.worlds):
+            app.offline_queue.queue_world_join(f"wrld_loadtest_{i}", f"{i}~private", 'usr_loadtest', 'loadtest')
+        for i in range(args.photos):
+            app.offline_queue.queue_photo(rng.randbytes(size), f"VRChat_loadtest_{i:05d}.png",
+                                          world_id=f"wrld_loadtest_{i % max(args.worlds, 1)}")
+
+        started = time.perf_counter()
+        deadline = started + args.timeout
+        # 停止時間帯があれば、サーキットブレーカーの復旧確認から再送が再開される
+        await app.try_send_queue()
+        while app.offline_queue.has_pending_data() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+
+        counts = app.offline_queue.get_queue_counts()
+        sent = args.photos - counts['photos']
+        return build_report(elapsed, sent, sent * size, counts['photos'], app.uploader, server, {
+            'remaining_photos': counts['photos'],
+            'remaining_worlds': counts['worlds'],
+            'app_events': events,
+            'http_version': await negotiated_http_version(app.uploader),
+        })
+    finally:
+        await app.upload_scheduler.close()
+        await app.uploader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VRC Uploader 負荷試験')
+    parser.add_argument('scenario', choices=['client', 'drain'],
+                        help='client: UploaderClientで直接送信 / drain: VRCUploaderAppのキュー再送')
+    parser.add_argument('--server-url', help='起動済みサーバーのURL（省略時はローカルサーバーを起動）')
+    parser.add_argument('--photos', type=int, default=100, help='写真の枚数')
+    parser.add_argument('--size-kb', type=int, default=1024, help='写真1枚のサイズ（KB）')
+    parser.add_argument('--worlds', type=int, default=0, help='キューに入れるワールド参加数（drainのみ）')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時アップロード数')
+    parser.add_argument('--batch', action='store_true', help='バッチAPIでまとめて送信')
+    parser.add_argument('--batch-max-kb', type=int, default=16 * 1024, help='バッチの合計サイズ上限（KB）')
+    parser.add_argument('--batch-max-items', type=int, default=20, help='バッチの枚数上限')
+    parser.add_argument('--http2', action='store_true',
+                        help='HTTP/2を有効化（--server-urlでHTTP/2対応のサーバーを指定した場合のみ）')
+    parser.add_argument('--max-connections', type=int, default=10, help='接続プールの上限')
+    parser.add_argument('--warm-up', action='store_true', help='計測前に接続を確立しておく')
+    parser.add_argument('--retry-attempts', type=int, default=4, help='試行回数（初回含む）')
+    parser.add_argument('--retry-base-delay', type=float, default=0.5, help='再試行待機の初期値（秒）')
+    parser.add_argument('--probe-delay', type=float, default=1.0, help='遮断中の復旧確認間隔（秒）')
+    parser.add_argument('--timeout', type=float, default=600.0, help='drainの打ち切り時間（秒）')
+    parser.add_argument('--no-server-batch', action='store_true', help='ローカルサーバーのバッチAPIを無効にする')
+    parser.add_argument('--json', metavar='PATH', help='結果をJSONで保存')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    if args.http2 and args.server_url is None:
+        # ローカルサーバーはHTTP/1.1のみのため、HTTP/2を指定しても比較にならない
+        parser.error('--http2 はHTTP/2対応のサーバーを --server-url で指定した場合のみ使えます（ローカルサーバーはHTTP/1.1のみ）')
+
+    server = None
+    url = args.server_url
+    if url is None:
+        server, url = start_local_server(args)
+        print(f"Local server: {url}")
+
+    runner = run_client if args.scenario == 'client' else run_drain
+    try:
+        with tempfile.TemporaryDirectory(prefix='vrc_loadtest_') as work_dir:
+            report = asyncio.run(runner(url, args, Path(work_dir), server))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    report['scenario'] = args.scenario
+    report['args'] = {k: v for k, v in vars(args).items() if k != 'json'}
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
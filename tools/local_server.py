@@ -0,0 +1,619 @@
+"""
+ローカル検証用サーバー
+本番サーバーのVRC APIを最小限に再現し、アップローダーの動作確認・負荷試験・テスト（tests/）に使用する
+写真は保存せずサイズとハッシュのみ記録する
+遅延・帯域制限・エラー率・429・413・停止時間帯を設定して障害を再現できる
+
+使い方:
+    python -m tools.local_server --port 8765
+    python -m tools.local_server --no-batch  # バッチAPI・登録済み確認に非対応のサーバーとして起動
+    python -m tools.local_server --latency-ms 150 --bandwidth-kbps 2000 --error-rate 0.05 --outage 30:60
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+# リクエストボディを読み込む単位（帯域制限の粒度）
+BODY_READ_CHUNK = 64 * 1024
+
+
+@dataclass
+class FaultConfig:
+    """障害の再現設定"""
+    latency_ms: float = 0.0  # 応答前の固定遅延
+    latency_jitter_ms: float = 0.0  # 遅延に加える一様乱数の幅
+    bandwidth_bps: int = 0  # 受信帯域の上限（全接続合計、バイト/秒、0=無制限）
+    error_rate: float = 0.0  # 500を返す確率
+    rate_limit_rate: float = 0.0  # 429を返す確率
+    rate_limit_rps: float = 0.0  # 1秒あたりの受付上限（超過分は429、0=無制限）
+    retry_after_sec: float = 1.0  # 429に付けるRetry-After
+    outages: List[Tuple[float, float]] = field(default_factory=list)  # 起動からの秒数 (開始, 終了)
+    outage_mode: str = 'close'  # 停止中の挙動: 'close'=応答せず切断, '503'=503を返す
+    max_body_bytes: int = 0  # リクエストボディの上限（超過分は413、0=無制限）
+    seed: Optional[int] = None  # 乱数のシード（再現用）
+
+    def in_outage(self, elapsed: float) -> bool:
+        """停止時間帯かどうか"""
+        return any(start <= elapsed < end for start, end in self.outages)
+
+
+class BandwidthLimiter:
+    """全接続で共有する帯域制限（送信予定時刻を進める方式）"""
+
+    def __init__(self, bytes_per_sec: int):
+        self.bytes_per_sec = bytes_per_sec
+        self._lock = threading.Lock()
+        self._next_free = 0.0
+
+    def consume(self, size: int):
+        """sizeバイト分の時間だけ待つ"""
+        if self.bytes_per_sec <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_free)
+            self._next_free = start + size / self.bytes_per_sec
+            wait = self._next_free - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """1秒あたりの受付数を制限するトークンバケット"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._updated = time.monotonic()
+
+    def allow(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class LocalServerState:
+    """サーバーの状態（メモリ上のみ）"""
+
+    def __init__(self, batch_enabled: bool = True, faults: Optional[FaultConfig] = None):
+        self.batch_enabled = batch_enabled
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.set_faults(faults or FaultConfig())
+        self.users: Dict[str, Dict] = {}  # username -> {'id', 'password'}
+        self.tokens: Dict[str, str] = {}  # token -> username
+        self.photos: List[Dict] = []
+        self.photos_by_key: Dict[Tuple[str, str], Dict] = {}  # (username, 重複防止キー) -> 写真
+        self.locations: Dict[str, Optional[Dict]] = {}  # username -> 現在地
+        self.instance_events: List[Dict] = []
+        self.request_counts: Dict[str, int] = {}
+        self.fault_counts: Dict[str, int] = {}
+
+    def set_faults(self, faults: FaultConfig):
+        """障害設定を差し替え（試験中に変更可能）"""
+        self.faults = faults
+        self.random = random.Random(faults.seed)
+        self.bandwidth = BandwidthLimiter(faults.bandwidth_bps)
+        self.rate_limiter = RateLimiter(faults.rate_limit_rps)
+
+    @property
+    def elapsed(self) -> float:
+        """起動からの経過秒数"""
+        return time.monotonic() - self.started
+
+    def count_request(self, route: str):
+        """エンドポイントごとのリクエスト数を記録"""
+        with self.lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+
+    def count_fault(self, kind: str):
+        """発生させた障害の回数を記録"""
+        with self.lock:
+            self.fault_counts[kind] = self.fault_counts.get(kind, 0) + 1
+
+    def pick_fault(self, is_health: bool) -> Optional[str]:
+        """
+        このリクエストで発生させる障害を決定
+
+        Returns:
+            Optional[str]: 'outage' / 'rate_limited' / 'server_error' / None
+        """
+        faults = self.faults
+        if faults.in_outage(self.elapsed):
+            return 'outage'
+        if is_health:
+            # 死活確認は停止時間帯のみ影響を受ける
+            return None
+        if not self.rate_limiter.allow():
+            return 'rate_limited'
+        with self.lock:
+            roll = self.random.random()
+        if roll < faults.rate_limit_rate:
+            return 'rate_limited'
+        if roll < faults.rate_limit_rate + faults.error_rate:
+            return 'server_error'
+        return None
+
+    def latency(self) -> float:
+        """応答前に待つ秒数"""
+        faults = self.faults
+        if faults.latency_ms <= 0 and faults.latency_jitter_ms <= 0:
+            return 0.0
+        with self.lock:
+            jitter = self.random.uniform(0, faults.latency_jitter_ms)
+        return (faults.latency_ms + jitter) / 1000
+
+    def issue_token(self, username: str) -> str:
+        """トークンを発行"""
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = username
+        return token
+
+    def add_photo(
+        self,
+        username: str,
+        filename: str,
+        content: bytes,
+        fields: Dict,
+        idempotency_key: Optional[str] = None
+    ) -> Tuple[Dict, bool]:
+        """
+        写真を記録
+
+        Returns:
+            Tuple[Dict, bool]: (写真, 新規に記録したか) - 同じ重複防止キーは既存の写真を返す
+        """
+        photo = {
+            'photo_uuid': str(uuid.uuid4()),
+            'username': username,
+            'filename': filename,
+            'size': len(content),
+            'sha256': hashlib.sha256(content).hexdigest(),
+            'preview': fields.get('preview') == 'true',
+            'fields': fields,
+            'received_at': datetime.utcnow().isoformat() + 'Z'
+        }
+        with self.lock:
+            if idempotency_key:
+                existing = self.photos_by_key.get((username, idempotency_key))
+                if existing is not None:
+                    return existing, False
+                self.photos_by_key[(username, idempotency_key)] = photo
+            self.photos.append(photo)
+        return photo, True
+
+    def attach_full(self, username: str, photo_uuid: str, content: bytes) -> Tuple[Optional[Dict], bool]:
+        """
+        プレビューの写真にフル解像度を添付
+
+        Returns:
+            Tuple[Optional[Dict], bool]: (写真、見つからなければNone, 新規に添付したか)
+        """
+        with self.lock:
+            photo = next((p for p in self.photos
+                          if p['photo_uuid'] == photo_uuid and p['username'] == username), None)
+            if photo is None:
+                return None, False
+            if not photo['preview']:
+                return photo, False
+            photo.update(preview=False, full_size=len(content),
+                         full_sha256=hashlib.sha256(content).hexdigest())
+            return photo, True
+
+    def existing_keys(self, username: str, keys: List[str]) -> List[str]:
+        """登録済みの重複防止キー"""
+        with self.lock:
+            return [key for key in keys if (username, key) in self.photos_by_key]
+
+    def apply_instance_event(self, username: str, event: Dict) -> Dict:
+        """インスタンス参加・退出イベントを反映"""
+        with self.lock:
+            self.instance_events.append(dict(event, username=username))
+            if event.get('type') == 'leave':
+                self.locations[username] = None
+            else:
+                self.locations[username] = {
+                    'world_id': event.get('world_id'),
+                    'instance_id': event.get('instance_id'),
+                    'vrc_user_id': event.get('vrc_user_id'),
+                    'vrc_display_name': event.get('vrc_display_name')
+                }
+            return {'location': self.locations[username]}
+
+
+def parse_multipart(content_type: str, body: bytes) -> Tuple[Dict[str, str], List[Tuple[str, str, bytes]]]:
+    """
+    multipart/form-dataを解析
+
+    Args:
+        content_type: Content-Typeヘッダー
+        body: リクエストボディ
+
+    Returns:
+        Tuple: (フォーム項目, [(項目名, ファイル名, 内容)])
+    """
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+    )
+    fields: Dict[str, str] = {}
+    files: List[Tuple[str, str, bytes]] = []
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        filename = part.get_filename()
+        content = part.get_payload(decode=True) or b''
+        if filename is not None:
+            files.append((name, filename, content))
+        else:
+            fields[name] = content.decode('utf-8')
+    return fields, files
+
+
+class LocalRequestHandler(BaseHTTPRequestHandler):
+    """VRC APIのリクエストハンドラー"""
+
+    server_version = 'VRCUploaderLocal/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    # (メソッド, パス) -> (ハンドラー名, 認証が必要か)
+    ROUTES = {
+        ('GET', '/vrc/api/health'): ('handle_health', False),
+        ('POST', '/vrc/api/auth/login'): ('handle_login', False),
+        ('POST', '/vrc/api/auth/register'): ('handle_register', False),
+        ('GET', '/vrc/api/auth/me'): ('handle_me', True),
+        ('POST', '/vrc/api/photos/upload'): ('handle_photo_upload', True),
+        ('POST', '/vrc/api/photos/upload/batch'): ('handle_photo_upload_batch', True),
+        ('POST', '/vrc/api/photos/exists'): ('handle_photo_exists', True),
+        ('POST', '/vrc/api/instance/join'): ('handle_instance_join', True),
+        ('POST', '/vrc/api/instance/leave'): ('handle_instance_leave', True),
+        ('POST', '/vrc/api/instance/events/batch'): ('handle_instance_events_batch', True),
+        ('GET', '/vrc/api/location/current'): ('handle_location_current', True),
+    }
+    # パスにIDを含むルート: (メソッド, 正規表現) -> (ハンドラー名, 認証が必要か)
+    PATTERN_ROUTES = {
+        ('PUT', re.compile(r'^/vrc/api/photos/(?P<photo_uuid>[0-9a-f-]+)/full$')): ('handle_photo_full', True),
+    }
+    # --no-batch で無効になるエンドポイント（旧サーバーの再現用）
+    BATCH_ROUTES = {'/vrc/api/photos/upload/batch', '/vrc/api/instance/events/batch', '/vrc/api/photos/exists'}
+
+    @property
+    def state(self) -> LocalServerState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if getattr(self.server, 'verbose', False):
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def _dispatch(self, method: str):
+        """ルーティング"""
+        path = self.path.split('?', 1)[0]
+        state = self.state
+        fault = state.pick_fault(is_health=path == '/vrc/api/health')
+        if fault == 'outage' and state.faults.outage_mode == 'close':
+            # サーバー停止を再現 - 応答せずに切断
+            state.count_fault(fault)
+            self.close_connection = True
+            self.connection.close()
+            return
+
+        body = self._read_body()
+        if state.faults.max_body_bytes and len(body) > state.faults.max_body_bytes:
+            # 本番のリバースプロキシと同じくボディが大きすぎるリクエストを拒否
+            state.count_fault('too_large')
+            self.send_json(413, {'status': 'error', 'message': 'Request entity too large'})
+            return
+        delay = state.latency()
+        if delay:
+            time.sleep(delay)
+
+        if fault:
+            state.count_fault(fault)
+            if fault == 'rate_limited':
+                self.send_json(429, {'status': 'error', 'message': 'Too many requests'},
+                               headers={'Retry-After': f'{state.faults.retry_after_sec:g}'})
+            elif fault == 'outage':
+                self.send_json(503, {'status': 'error', 'message': 'Service unavailable'})
+            else:
+                self.send_json(500, {'status': 'error', 'message': 'Internal server error'})
+            return
+
+        route = self.ROUTES.get((method, path))
+        self.path_params = {}
+        if route is None:
+            for (route_method, pattern), pattern_route in self.PATTERN_ROUTES.items():
+                match = pattern.match(path) if route_method == method else None
+                if match:
+                    route, self.path_params = pattern_route, match.groupdict()
+                    path = pattern.pattern
+                    break
+        if route is None or (path in self.BATCH_ROUTES and not state.batch_enabled):
+            self.send_json(404, {'status': 'error', 'message': 'Not found'})
+            return
+
+        state.count_request(path)
+        handler_name, auth_required = route
+        username = None
+        if auth_required:
+            username = self._authenticate()
+            if username is None:
+                self.send_json(401, {'status': 'error', 'message': 'Unauthorized'})
+                return
+
+        try:
+            getattr(self, handler_name)(body, username)
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {'status': 'error', 'message': f'Bad request: {e}'})
+
+    def _read_body(self) -> bytes:
+        """ボディを読み込む（帯域制限があれば速度を抑える）"""
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return b''
+        bandwidth = self.state.bandwidth
+        if bandwidth.bytes_per_sec <= 0:
+            return self.rfile.read(length)
+
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(BODY_READ_CHUNK, remaining))
+            if not chunk:
+                break
+            bandwidth.consume(len(chunk))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def _authenticate(self) -> Optional[str]:
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            return None
+        return self.state.tokens.get(auth[len('Bearer '):])
+
+    def send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        """JSONレスポンスを送信"""
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_success(self, data: Dict):
+        self.send_json(200, {'status': 'success', 'data': data})
+
+    # ========== エンドポイント ==========
+
+    def handle_health(self, body: bytes, username: Optional[str]):
+        self.send_success({'ok': True})
+
+    def handle_register(self, body: bytes, username: Optional[str]):
+        payload = json.loads(body or b'{}')
+        name, password = payload['username'], payload['password']
+        with self.state.lock:
+            if name in self.state.users:
+                self.send_json(409, {'status': 'error', 'message': 'User already exists'})
+                return
+            self.state.users[name] = {'id': len(self.state.users) + 1, 'password': password}
+        self.send_success({'token': self.state.issue_token(name), 'username': name})
+
+    def handle_login(self, body: bytes, username: Optional[str]):
+        payload = json.loads(body or b'{}')
+        name, password = payload['username'], payload['password']
+        user = self.state.users.get(name)
+        if user is None or user['password'] != password:
+            self.send_json(401, {'status': 'error', 'message': 'Invalid credentials'})
+            return
+        self.send_success({'token': self.state.issue_token(name), 'username': name})
+
+    def handle_me(self, body: bytes, username: Optional[str]):
+        self.send_success({'id': self.state.users[username]['id'], 'username': username})
+
+    def handle_photo_upload(self, body: bytes, username: Optional[str]):
+        fields, files = parse_multipart(self.headers.get('Content-Type', ''), body)
+        images = [f for f in files if f[0] == 'image']
+        if not images:
+            raise ValueError('image is required')
+        _, filename, content = images[0]
+        photo, created = self.state.add_photo(username, filename, content, fields,
+                                              self.headers.get('Idempotency-Key'))
+        if not created:
+            self.send_json(409, {
+                'status': 'error',
+                'code': 'already_exists',
+                'message': 'Photo already exists',
+                'data': {'photo_uuid': photo['photo_uuid']}
+            })
+            return
+        self.send_success({'photo_uuid': photo['photo_uuid']})
+
+    def handle_photo_full(self, body: bytes, username: Optional[str]):
+        _, files = parse_multipart(self.headers.get('Content-Type', ''), body)
+        images = [f for f in files if f[0] == 'image']
+        if not images:
+            raise ValueError('image is required')
+        photo_uuid = self.path_params['photo_uuid']
+        photo, attached = self.state.attach_full(username, photo_uuid, images[0][2])
+        if photo is None:
+            self.send_json(404, {'status': 'error', 'message': 'Photo not found'})
+            return
+        if not attached:
+            self.send_json(409, {
+                'status': 'error',
+                'code': 'already_exists',
+                'message': 'Full resolution already attached',
+                'data': {'photo_uuid': photo_uuid}
+            })
+            return
+        self.send_success({'photo_uuid': photo_uuid})
+
+    def handle_photo_upload_batch(self, body: bytes, username: Optional[str]):
+        fields, files = parse_multipart(self.headers.get('Content-Type', ''), body)
+        images = [f for f in files if f[0] == 'images']
+        metadata = json.loads(fields.get('metadata', '[]'))
+        if len(metadata) != len(images):
+            raise ValueError('metadata count does not match images')
+
+        results = []
+        for (_, filename, content), meta in zip(images, metadata):
+            photo, created = self.state.add_photo(username, filename, content, meta, meta.get('idempotency_key'))
+            if created:
+                results.append({'status': 'success', 'data': {'photo_uuid': photo['photo_uuid']}})
+            else:
+                results.append({
+                    'status': 'error',
+                    'code': 'already_exists',
+                    'message': 'Photo already exists',
+                    'data': {'photo_uuid': photo['photo_uuid']}
+                })
+        self.send_success({'results': results})
+
+    def handle_photo_exists(self, body: bytes, username: Optional[str]):
+        keys = json.loads(body or b'{}').get('idempotency_keys', [])
+        self.send_success({'existing': self.state.existing_keys(username, keys)})
+
+    def handle_instance_join(self, body: bytes, username: Optional[str]):
+        event = dict(json.loads(body or b'{}'), type='join')
+        self.send_success(self.state.apply_instance_event(username, event))
+
+    def handle_instance_leave(self, body: bytes, username: Optional[str]):
+        self.send_success(self.state.apply_instance_event(username, {'type': 'leave'}))
+
+    def handle_instance_events_batch(self, body: bytes, username: Optional[str]):
+        events = json.loads(body or b'[]')
+        if not isinstance(events, list):
+            raise ValueError('events must be a list')
+        results = [
+            {'status': 'success', 'data': self.state.apply_instance_event(username, event)}
+            for event in events
+        ]
+        self.send_success({'results': results})
+
+    def handle_location_current(self, body: bytes, username: Optional[str]):
+        self.send_success({'location': self.state.locations.get(username)})
+
+
+def create_server(
+    host: str = '127.0.0.1',
+    port: int = 8765,
+    batch_enabled: bool = True,
+    faults: Optional[FaultConfig] = None,
+    verbose: bool = False,
+    handler_class=LocalRequestHandler
+) -> ThreadingHTTPServer:
+    """
+    ローカルサーバーを作成（port=0で空きポートを使用）
+
+    Args:
+        host: 待ち受けアドレス
+        port: 待ち受けポート
+        batch_enabled: バッチAPIを有効にするか
+        faults: 障害の再現設定
+        verbose: アクセスログを出力するか
+        handler_class: リクエストハンドラー
+
+    Returns:
+        ThreadingHTTPServer: サーバー（server.stateで状態を参照可能）
+    """
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    server.state = LocalServerState(batch_enabled=batch_enabled, faults=faults)
+    server.verbose = verbose
+    return server
+
+
+def parse_outage(value: str) -> Tuple[float, float]:
+    """'開始:終了'（起動からの秒数）を解析"""
+    start, end = value.split(':', 1)
+    return float(start), float(end)
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """障害設定のコマンドライン引数を追加"""
+    group = parser.add_argument_group('障害の再現')
+    group.add_argument('--latency-ms', type=float, default=0.0, help='応答前の遅延（ミリ秒）')
+    group.add_argument('--jitter-ms', type=float, default=0.0, help='遅延に加える乱数の幅（ミリ秒）')
+    group.add_argument('--bandwidth-kbps', type=float, default=0.0, help='受信帯域の上限（KB/秒、全接続合計）')
+    group.add_argument('--error-rate', type=float, default=0.0, help='500を返す確率（0〜1）')
+    group.add_argument('--rate-limit-rate', type=float, default=0.0, help='429を返す確率（0〜1）')
+    group.add_argument('--rate-limit-rps', type=float, default=0.0, help='1秒あたりの受付上限（超過分は429）')
+    group.add_argument('--retry-after', type=float, default=1.0, help='429に付けるRetry-After（秒）')
+    group.add_argument('--outage', type=parse_outage, action='append', default=[],
+                       metavar='START:END', help='停止時間帯（起動からの秒数、複数指定可）')
+    group.add_argument('--outage-mode', choices=['close', '503'], default='close', help='停止中の挙動')
+    group.add_argument('--max-body-kb', type=int, default=0, help='リクエストボディの上限（KB、超過分は413）')
+    group.add_argument('--seed', type=int, default=None, help='乱数のシード')
+
+
+def faults_from_args(args: argparse.Namespace) -> FaultConfig:
+    """コマンドライン引数から障害設定を作成"""
+    return FaultConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.jitter_ms,
+        bandwidth_bps=int(args.bandwidth_kbps * 1024),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rate_limit_rps=args.rate_limit_rps,
+        retry_after_sec=args.retry_after,
+        outages=args.outage,
+        outage_mode=args.outage_mode,
+        max_body_bytes=args.max_body_kb * 1024,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VRC Uploader ローカル検証用サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-batch', action='store_true', help='バッチAPIを無効にする')
+    parser.add_argument('--verbose', action='store_true', help='アクセスログを出力する')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, batch_enabled=not args.no_batch,
+                           faults=faults_from_args(args), verbose=args.verbose)
+    print(f"Local server listening on http://{args.host}:{server.server_address[1]}"
+          f" (batch: {'on' if not args.no_batch else 'off'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Queue Benchmark
+オフラインキューの追加・再送（全件取得→1件ずつ削除）の所要時間を計測する
+旧CSV方式（削除のたびにCSV全体を読み書き）と現在のSQLite方式を同じ件数で比較する
+
+使い方:
+    python -m tools.queue_benchmark --items 10000
+    python -m tools.queue_benchmark --items 10000 --image-kb 0 --backend sqlite
+"""
+
+import sys
+import csv
+import time
+import uuid
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# python tools/queue_benchmark.py でも実行できるようにリポジトリ直下をパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from core.offline_queue import OfflineQueueManager
+
+
+class LegacyCsvQueue:
+    """比較用: 旧バージョンのCSVキュー（削除のたびにCSV全体を読み直して書き直す）"""
+
+    FIELDS = OfflineQueueManager.PHOTO_FIELDS
+
+    def __init__(self, base_path: Path):
+        self.csv_path = base_path / OfflineQueueManager.PHOTOS_CSV
+        self.images_path = base_path / OfflineQueueManager.IMAGES_DIR
+        self.images_path.mkdir(parents=True, exist_ok=True)
+
+    def queue_photo(self, jpg_bytes: bytes, filename: str) -> str:
+        queue_id = str(uuid.uuid4())
+        (self.images_path / f"{queue_id}.jpg").write_bytes(jpg_bytes)
+        file_exists = self.csv_path.exists()
+        with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS, restval='')
+            if not file_exists:
+                writer.writeheader()
+            writer.writerow({'id': queue_id, 'filename': filename, 'visibility': 'self',
+                             'taken_at': '', 'created_at': '', 'idempotency_key': queue_id})
+        return queue_id
+
+    def get_queued_ids(self) -> List[str]:
+        with open(self.csv_path, 'r', newline='', encoding='utf-8') as f:
+            return [row['id'] for row in csv.DictReader(f)]
+
+    def remove_photo(self, queue_id: str):
+        image_path = self.images_path / f"{queue_id}.jpg"
+        if image_path.exists():
+            image_path.unlink()
+        with open(self.csv_path, 'r', newline='', encoding='utf-8') as f:
+            rows = [row for row in csv.DictReader(f) if row['id'] != queue_id]
+        if rows:
+            with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            self.csv_path.unlink()
+
+
+def _timed(func: Callable) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def run_legacy(base_path: Path, items: int, image: bytes, batch: int) -> Dict[str, float]:
+    """旧CSV方式"""
+    queue = LegacyCsvQueue(base_path)
+    enqueue = _timed(lambda: [queue.queue_photo(image, f"VRChat_{i:05d}.png") for i in range(items)])
+
+    def drain():
+        for queue_id in queue.get_queued_ids():
+            queue.remove_photo(queue_id)
+
+    return {'enqueue_sec': enqueue, 'drain_sec': _timed(drain)}
+
+
+def run_sqlite(base_path: Path, items: int, image: bytes, batch: int) -> Dict[str, float]:
+    """SQLite方式（batch件ごとに1回のコミットで削除）"""
+    queue = OfflineQueueManager(base_path)
+    enqueue = _timed(lambda: [queue.queue_photo(image, f"VRChat_{i:05d}.png") for i in range(items)])
+
+    def drain():
+        ids = [photo.id for photo, _ in queue.get_queued_photo_files()]
+        for start in range(0, len(ids), batch):
+            queue.remove_photos(ids[start:start + batch])
+
+    result = {'enqueue_sec': enqueue, 'drain_sec': _timed(drain)}
+    assert not queue.has_pending_data()
+    queue.close()
+    return result
+
+
+BACKENDS = {'csv': run_legacy, 'sqlite': run_sqlite}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='オフラインキューのベンチマーク')
+    parser.add_argument('--items', type=int, default=10000, help='キューに入れる写真の枚数')
+    parser.add_argument('--image-kb', type=int, default=1, help='画像1枚のサイズ（KB、0で空ファイル）')
+    parser.add_argument('--batch', type=int, default=20, help='SQLite方式で1回のコミットで削除する件数')
+    parser.add_argument('--backend', choices=['all', *BACKENDS], default='all', help='計測する方式')
+    args = parser.parse_args()
+
+    image = b'\0' * (args.image_kb * 1024)
+    backends = BACKENDS if args.backend == 'all' else {args.backend: BACKENDS[args.backend]}
+    print(f"items: {args.items}, image: {args.image_kb} KB")
+    for name, runner in backends.items():
+        with tempfile.TemporaryDirectory(prefix='vrc_queue_bench_') as work_dir:
+            result = runner(Path(work_dir), args.items, image, args.batch)
+        per_item_ms = result['drain_sec'] / max(args.items, 1) * 1000
+        print(f"{name:>6}: enqueue {result['enqueue_sec']:.2f}s, drain {result['drain_sec']:.2f}s "
+              f"({per_item_ms:.3f} ms/item)")
+
+
+if __name__ == '__main__':
+    main()
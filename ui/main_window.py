@@ -340,16 +340,36 @@ class MainWindow(QMainWindow):
             name = data.get('display_name', '-')
             self.vrc_user_label.setText(f"VRChatユーザー: {name}")
 
-        elif event_type == 'photo_queued':
-            count = data.get('pending_count', 0)
-            self._update_queue_display(count)
-
-        elif event_type == 'queue_item_sent':
-            self._refresh_queue_display()
+        elif event_type == 'queue_counts':
+            self._update_queue_display(data.get('photos', 0) + data.get('worlds', 0), data.get('bytes', 0),
+                                       data.get('disk_bytes', 0), data.get('max_bytes', 0),
+                                       data.get('parked_photos', 0) + data.get('parked_worlds', 0))
+
+        elif event_type == 'queue_evicted':
+            actions = {'evicted': '削除', 'reencoded': '再圧縮', 'refused': '保存せず'}
+            action = actions.get(data.get('action'), data.get('action'))
+            self.statusbar.showMessage(f"送信待ちの容量上限: {data.get('filename', '')} を{action}")
+
+        elif event_type == 'queue_progress':
+            sent_mb = data.get('sent_bytes', 0) / (1024 * 1024)
+            total_mb = data.get('total_bytes', 0) / (1024 * 1024)
+            self.statusbar.showMessage(f"再送中: {sent_mb:.1f} / {total_mb:.1f} MB")
+
+        elif event_type == 'upload_limit_changed':
+            kbps = data.get('kbps', 0)
+            limit = f"{kbps} KB/s" if kbps else "無制限"
+            state = "VRChat滞在中" if data.get('in_world') else "VRChat外"
+            self.statusbar.showMessage(f"送信速度上限: {limit}（{state}）")
 
         elif event_type == 'queue_processed':
-            remaining = data.get('remaining_photos', 0)
-            self._update_queue_display(remaining)
+            remaining = data.get('remaining_photos', 0) + data.get('remaining_worlds', 0)
+            parked = data.get('parked_photos', 0) + data.get('parked_worlds', 0)
+            if parked:
+                self.statusbar.showMessage(f"再送完了（失敗が続いた {parked} 件を保留しました。再送ボタンで再試行できます）")
+            elif remaining:
+                self.statusbar.showMessage(f"再送完了（送信できなかった {remaining} 件は次回再送します）")
+            else:
+                self.statusbar.showMessage("再送完了")
 
         elif event_type == 'offline_mode':
             is_offline = data.get('is_offline', False)
@@ -536,9 +556,19 @@ class MainWindow(QMainWindow):
 
         asyncio.create_task(do_resend())
 
-    def _update_queue_display(self, count: int):
+    def _update_queue_display(self, count: int, size: int = 0, disk_bytes: int = 0, max_bytes: int = 0,
+                              parked: int = 0):
         """キュー表示を更新"""
-        self.queue_label.setText(f"送信待ち: {count}件")
+        text = f"送信待ち: {count}件"
+        if size:
+            text += f"（{size / (1024 * 1024):.1f} MB）"
+        if parked:
+            # 失敗が続いたため自動では再送しない件数（count に含まれる）
+            text += f" 保留 {parked}件"
+        if max_bytes and count:
+            # 容量上限に対する使用量
+            text += f" 使用量 {disk_bytes * 100 / max_bytes:.0f}%"
+        self.queue_label.setText(text)
         if count > 0:
             self.queue_label.setStyleSheet("color: #FF9800;")
             self.resend_btn.setEnabled(True)
@@ -550,7 +580,9 @@ class MainWindow(QMainWindow):
         """キュー表示を最新に更新"""
         counts = self.app.get_pending_counts()
         total = counts.get('photos', 0) + counts.get('worlds', 0)
-        self._update_queue_display(total)
+        self._update_queue_display(total, counts.get('bytes', 0), counts.get('disk_bytes', 0),
+                                   counts.get('max_bytes', 0),
+                                   counts.get('parked_photos', 0) + counts.get('parked_worlds', 0))
 
     def _on_toggle_osc(self):
         """OSC開始/停止トグル"""